@@ -18,25 +18,54 @@
 # - writing the results page to file for later comparison
 ##
 
-import requests, re, sys, os, datetime, codecs, stat
-from bs4 import BeautifulSoup
+# requests and bs4 take far longer to import than the rest of the script
+# takes to run when there is nothing new, so they are imported where needed
+import re, sys, os, glob, datetime, codecs, stat, json, time, hashlib, threading
+from contextlib import contextmanager
+
+try:
+    from html.parser import HTMLParser
+    from html.entities import name2codepoint
+except ImportError:
+    # Python 2
+    from HTMLParser import HTMLParser
+    from htmlentitydefs import name2codepoint
 from os.path import expanduser
 
-config = None
-studweb_hostname = None
-latest_html = None
-
 # The settings file
 home = expanduser("~")
 settings_file = home + '/.studweb.conf'
+results_file = home + '/.studweb.json'
+# results used to be stored as a prettified copy of the results page
 data_file = home + '/.studweb.dat'
-error_file = home + '/.studweb.latest_error.html'
+# the latest pages that could not be parsed, see studweb_failures.py
+failures_dir = home + '/.studweb.failures'
+session_file = home + '/.studweb.session'
+# fingerprint of the results table stored in the results file
+digest_file = home + '/.studweb.digest'
+# every distinct set of results stored, see studweb_archive.py
+archive_dir = home + '/.studweb.archive'
+# held while a run is checking for results, see RunLock
+lock_file = home + '/.studweb.lock'
+# the latest results page, kept in low memory mode, see FileDocument
+page_file = home + '/.studweb.latest.html'
+outbox_dir = home + '/.studweb.outbox'
+# host files describing more StudWeb hosts, see HostProfile
+hosts_dir = home + '/.studweb.hosts'
+# the links learned to lead from the start page to the results, see NavigationCache
+navigation_file = home + '/.studweb.navigation'
 
 example_config = """\
 ssn = 12345678901
 pin = 1234
 studweb = studweb.uio.no
 """
+example_session_config = """
+# reuse the login between runs instead of logging in and out every time
+keep_session = no
+# stream the results page to ~/.studweb.latest.html and parse it from there
+low_memory = no
+"""
 example_mail_config = """
 smtp_server = smtp.uio.no
 smtp_username = ola.nordmann
@@ -49,15 +78,354 @@ studweb_settings = {
 
     'studweb.ntnu.no': {
         'term_used_for_semester': 'Termin',
-        'expand_link_text': 'Oversikt'
+        'expand_link_text': 'Oversikt',
+        # what all accounts polled from one process may send the host
+        'requests_per_minute': 60
     },
 
     'studweb.uio.no': {
         'term_used_for_semester': 'Semester',
-        'expand_link_text': 'Se opplysninger om deg'
+        'expand_link_text': 'Se opplysninger om deg',
+        'requests_per_minute': 60
     }
 }
 
+example_host_config = """\
+studweb = studweb.example.no
+term_used_for_semester = Semester
+expand_link_text = Se opplysninger om deg
+requests_per_minute = 60
+"""
+
+
+class LoginError(Exception):
+    """StudWeb refused the login, typically because of a wrong ssn or pin"""
+    pass
+
+
+class PageLayoutError(Exception):
+    """A page did not look like we expected. Keeps the failing page around for inspection
+
+    step - the phase of the run it happened in, set by the RunMetrics timer of the phase
+    url - where the page came from, if known
+    """
+
+    def __init__(self, msg, failing_html, step=None, url=None):
+        Exception.__init__(self, msg)
+        self.failing_html = failing_html
+        self.step = step
+        self.url = url or getattr(failing_html, 'url', None)
+
+
+class Counter:
+    """A count that only goes up, kept for every combination of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, n=1, **labels):
+        key = tuple(labels.get(l, '') for l in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + n
+
+    def value(self, **labels):
+        return self.values.get(tuple(labels.get(l, '') for l in self.labelnames), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, (), v) for key, v in sorted(self.values.items())]
+
+
+class Histogram:
+    """Counts of the values observed, by the upper bounds (buckets) they fall under"""
+
+    kind = 'histogram'
+    default_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help, labelnames=(), buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # per combination of label values: [counts per bucket, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(l, '') for l in self.labelnames)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        entry = self.values.get(tuple(labels.get(l, '') for l in self.labelnames))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, n in zip(self.buckets, counts):
+                    samples.append((self.name + '_bucket', key, (('le', repr(float(bound))),), n))
+                samples.append((self.name + '_bucket', key, (('le', '+Inf'),), count))
+                samples.append((self.name + '_sum', key, (), total))
+                samples.append((self.name + '_count', key, (), count))
+        return samples
+
+
+class MetricsRegistry:
+    """The counters and histograms of the process, across all runs and accounts
+
+    Served in the Prometheus text format by studweb_api as /metrics.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self.__register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=Histogram.default_buckets):
+        return self.__register(Histogram(name, help, labelnames, buckets))
+
+    def __register(self, metric):
+        with self.lock:
+            for m in self.metrics:
+                if m.name == metric.name:
+                    return m
+            self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """All the metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, key, extra, value in metric.samples():
+                labels = list(zip(metric.labelnames, key)) + list(extra)
+                if labels:
+                    name += '{%s}' % ','.join('%s="%s"' % (l, escape_label_value(v)) for l, v in labels)
+                lines.append('%s %s' % (name, repr(float(value)) if isinstance(value, float) else value))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+logins = registry.counter('studweb_logins_total', 'Logins attempted', ['host'])
+login_failures = registry.counter('studweb_login_failures_total',
+                                  'Logins refused by StudWeb (reason="refused") or failing on an error (reason="error")',
+                                  ['host', 'reason'])
+layout_errors = registry.counter('studweb_layout_errors_total', 'Pages that did not look like expected')
+rows_skipped = registry.counter('studweb_rows_skipped_total', 'Result rows skipped for lacking a column', ['host'])
+mails = registry.counter('studweb_mails_total', 'Mails sent (outcome="sent") or failing to send (outcome="failed")',
+                         ['outcome'])
+phase_seconds = registry.histogram('studweb_phase_seconds', 'Seconds spent in each phase of a run, see RunMetrics',
+                                   ['host', 'phase'])
+
+
+class RunMetrics:
+    """Timings and counters collected during one run for one account
+
+    timings - seconds spent in each phase of the run
+    counters - things like bytes downloaded and rows parsed
+    host - add the timings to the studweb_phase_seconds histogram of the host
+    """
+
+    def __init__(self, host=None):
+        self.started = time.time()
+        self.host = host
+        self.timings = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, phase):
+        started = time.time()
+        try:
+            yield
+        except PageLayoutError as e:
+            # the innermost phase is the step that failed
+            if e.step is None:
+                e.step = phase
+            raise
+        finally:
+            elapsed = time.time() - started
+            self.timings[phase] = self.timings.get(phase, 0) + elapsed
+            if self.host:
+                phase_seconds.observe(elapsed, host=self.host, phase=phase)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, account):
+        return {'time': self.started, 'account': account.name, 'host': account.hostname(),
+                'timings': self.timings, 'counters': self.counters}
+
+    def write(self, filename, account):
+        """Appends the metrics as one JSON line to the file"""
+        line = json.dumps(self.record(account), sort_keys=True) + '\n'
+        f = open(filename, 'a')
+        f.write(line)
+        f.close()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """The time left of a run, shared out between the requests it makes
+
+    seconds - the time allowed for the whole run. Unbounded if None
+    No single request is given more than max_request_seconds.
+    """
+
+    max_request_seconds = 30
+
+    def __init__(self, seconds=None, clock=time.time):
+        self.clock = clock
+        self.expires = clock() + seconds if seconds is not None else None
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return self.expires - self.clock()
+
+    def timeout(self, requests_left=1):
+        """The timeout of the next request, leaving time for the requests_left - 1 after it
+
+        Time a request does not use goes to the ones after it.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return self.max_request_seconds
+        if remaining <= 0:
+            raise DeadlineExceeded("Ran out of time")
+        return min(remaining / max(requests_left, 1), self.max_request_seconds)
+
+
+class RunLock:
+    """Keeps two runs from checking the same account at the same time
+
+    The lock is held through flock(), so it goes away with the process
+    holding it even if that process is killed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fd = None
+
+    def acquire(self):
+        """Takes the lock if no one else has it. Returns whether it was taken"""
+        try:
+            import fcntl
+        except ImportError:
+            # no flock() on this platform, so runs are not kept apart
+            return True
+
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT, stat.S_IRUSR | stat.S_IWUSR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Account:
+    """The state needed to poll StudWeb on behalf of one user
+
+    config - the values read from the user's settings file
+    The file locations default to the ones in the user's home directory.
+    """
+
+    def __init__(self, config, name='default',
+                 settings_file=settings_file, results_file=results_file, data_file=data_file,
+                 failures_dir=failures_dir, session_file=session_file, outbox_dir=outbox_dir,
+                 digest_file=digest_file, archive_dir=archive_dir, lock_file=lock_file,
+                 page_file=page_file, navigation_file=navigation_file):
+        self.config = config
+        self.name = name
+        self.settings_file = settings_file
+        self.results_file = results_file
+        self.data_file = data_file
+        self.failures_dir = failures_dir
+        self.session_file = session_file
+        self.outbox_dir = outbox_dir
+        self.digest_file = digest_file
+        self.archive_dir = archive_dir
+        self.lock_file = lock_file
+        self.page_file = page_file
+        self.navigation_file = navigation_file
+
+        # a shared connection pool for the host, set when polling many accounts
+        self.adapter = None
+
+        # the latest results, saved to be stored later on
+        self.latest_results = None
+        # the fingerprint of the results table they were parsed from
+        self.latest_digest = None
+
+        self.metrics = RunMetrics(config.get('studweb'))
+        self.deadline = Deadline()
+
+    def hostname(self):
+        return self.config['studweb']
+
+    def profile(self):
+        return all_host_profiles().get(self.hostname())
+
+    def keeps_session(self):
+        return self.config.get('keep_session', 'no').lower() in ('yes', 'true', '1')
+
+    def saves_memory(self):
+        return self.config.get('low_memory', 'no').lower() in ('yes', 'true', '1')
+
+    def navigation(self):
+        """The NavigationCache shared by the accounts using the same navigation file, or None"""
+        if not self.navigation_file:
+            return None
+        return navigation_cache(self.navigation_file)
+
+    def new_session(self):
+        """A session object that persists cookies and default values across requests"""
+        import requests
+
+        session = requests.Session()
+        if self.adapter is not None:
+            session.mount(studweb_url(self), self.adapter)
+        session.hooks['response'].append(lambda r, *args, **kwargs: self.metrics.count('requests'))
+        return session
+
+    def __str__(self):
+        return self.name
+
 
 class Mailer:
     def __init__(self, config):
@@ -70,14 +438,19 @@ class Mailer:
 
         self.__dict__.update(config)
 
-    def send(self, subject, text):
-        import smtplib
+    def message(self, subject, text):
         from email.mime.text import MIMEText
 
         msg = MIMEText(text, _charset='utf8')
         msg['Subject'] = subject
         msg['From'] = self.from_addr
         msg['To'] = self.to_addr
+        return msg
+
+    def send(self, subject, text):
+        import smtplib
+
+        msg = self.message(subject, text)
 
         s = smtplib.SMTP_SSL(self.smtp_server, timeout=10)
         s.login(self.smtp_username, self.smtp_password)
@@ -87,39 +460,50 @@ class Mailer:
     def __str__(self):
         return str(self.__dict__)
 
-class SubjectResult:
+class SubjectResult(object):
+    """One line of the results table
 
-    def __init__(self, code, name, grade, semester):
-        """Expects all strings to be unicode
-        This will be true if given input from BeautifulSoup, as
-        as internal data structures are using unicode"
-        """
-        self.__code = code
-        self.__name = name
-        self.__grade = grade
-        self.__semester = semester
+    Expects all strings to be unicode
+    This will be true if given input from BeautifulSoup, as
+    as internal data structures are using unicode
+    """
 
-        import hashlib
+    __slots__ = ('code', 'name', 'grade', 'semester')
 
-        self.__bytes = self.__str__().encode('utf8')
-        self.__hash = hashlib.md5(self.__bytes).hexdigest()
+    def __init__(self, code, name, grade, semester):
+        self.code = code
+        self.name = name
+        self.grade = grade
+        self.semester = semester
 
-    # for use in sets and as keys in dicts
+    # for use in sets and as keys in dicts. Covers the same fields as __eq__
     def __hash__(self):
-        return int(self.__hash, 16)
+        return hash((self.code, self.grade, self.semester))
 
     # as str
     def __str__(s):
-        return u" ".join([s.__code, s.__name, s.__grade, s.__semester])
+        return u" ".join([s.code, s.name, s.grade, s.semester])
 
-    # for comparison
+    # for comparison. The name of a subject is not part of its result
     def __eq__(s, o):
-        return s.__code == o.__code \
-               and s.__grade == o.__grade \
-               and s.__semester == o.__semester
+        return isinstance(o, SubjectResult) \
+               and s.code == o.code \
+               and s.grade == o.grade \
+               and s.semester == o.semester
+
+    def __ne__(s, o):
+        return not s == o
+
+    def asDict(self):
+        return {'code': self.code, 'name': self.name,
+                'grade': self.grade, 'semester': self.semester}
+
+    def key(self):
+        """Identifies the subject result across polls"""
+        return self.code + u'|' + self.semester
 
     def asBytes(self):
-        return self.__bytes
+        return self.__str__().encode('utf8')
 
     def asUnicode(self):
         s = self.__str__()
@@ -127,28 +511,600 @@ class SubjectResult:
         return s
 
 
+class ResultDiff:
+    """The changes between two ResultSets
+
+    added - results for a subject and semester not seen before
+    changed - (old, new) pairs of results where the grade has changed
+    removed - results no longer on the results page
+    """
+
+    def __init__(self, added, changed, removed):
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+
+    def new(self):
+        """The added results and the new version of the changed ones"""
+        return self.added + [new for old, new in self.changed]
+
+    def __iter__(self):
+        return iter(self.new())
+
+    # so a diff without new results is false
+    def __len__(self):
+        return len(self.added) + len(self.changed)
+
+
+class ResultSet:
+    """Subject results indexed on (code, semester)
+
+    Iterates and compares like a set of SubjectResults
+    """
+
+    def __init__(self, results=()):
+        self.__index = {}
+        for r in results:
+            self.add(r)
+
+    def add(self, result):
+        self.__index[(result.code, result.semester)] = result
+
+    def get(self, code, semester):
+        return self.__index.get((code, semester))
+
+    def diff(self, old):
+        """Classifies how these results differ from the old ones"""
+        added = []
+        changed = []
+
+        for key, result in self.__index.items():
+            previous = old.get(*key)
+            if previous is None:
+                added.append(result)
+            elif previous.grade != result.grade:
+                changed.append((previous, result))
+
+        removed = [r for r in old if self.get(r.code, r.semester) is None]
+
+        return ResultDiff(added, changed, removed)
+
+    def difference(self, other):
+        return set(self).difference(other)
+
+    def __contains__(self, result):
+        return self.get(result.code, result.semester) == result
+
+    def __iter__(self):
+        return iter(self.__index.values())
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __eq__(self, other):
+        return set(self) == set(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def best_tree_builder():
+    """lxml is several times faster than the parser in the standard library"""
+    try:
+        import lxml
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+# the BeautifulSoup tree builder used for every page. Picked on first use if None
+tree_builder = None
+
+
+class Document:
+    """A page that is decoded and parsed at most once, no matter how many parser methods look at it
+
+    markup - the page as returned by StudWeb (bytes) or as read from file (unicode)
+    encoding - the charset of the markup, if known. Detected from the markup otherwise
+    url - where the page came from, if known
+    """
+
+    def __init__(self, markup, builder=None, encoding=None, url=None):
+        self.markup = markup
+        self.builder = builder or tree_builder
+        self.encoding = encoding
+        self.url = url
+        self.__soup = None
+        self.__text = None
+
+    def soup(self):
+        global tree_builder
+
+        if self.__soup is None:
+            from bs4 import BeautifulSoup
+
+            if not self.builder:
+                tree_builder = tree_builder or best_tree_builder()
+                self.builder = tree_builder
+            # given text, BeautifulSoup has no need to guess the charset again
+            self.__soup = BeautifulSoup(self.text(), self.builder)
+        return self.__soup
+
+    def has_soup(self):
+        """Whether the page has been parsed into a tree already"""
+        return self.__soup is not None
+
+    def read(self):
+        """The whole markup, as given"""
+        return self.markup
+
+    def text(self):
+        """The markup as unicode, decoded with the given encoding or the one detected"""
+        if self.__text is None:
+            markup = self.read()
+            if is_unicode_str(markup):
+                return markup
+
+            if self.encoding:
+                # a character that does not belong shows up as U+FFFD rather than disappearing
+                self.__text = markup.decode(self.encoding, 'replace')
+            else:
+                from bs4 import UnicodeDammit
+                dammit = UnicodeDammit(markup, is_html=True)
+                self.__text = dammit.unicode_markup
+                self.encoding = dammit.original_encoding
+        return self.__text
+
+    def text_chunks(self):
+        """The text in pieces, for the parsers that can take it a piece at a time"""
+        yield self.text()
+
+    def byte_chunks(self):
+        """The markup as bytes in pieces, undecoded. Markup given as unicode is encoded as UTF-8"""
+        if is_unicode_str(self.markup):
+            yield self.markup.encode('utf8')
+        else:
+            yield self.markup
+
+
+class FileDocument(Document):
+    """A page kept in a file rather than in memory
+
+    The streaming parsers, the link lookups and the digest read it from the
+    file a chunk at a time. Only what needs the whole page, like the
+    BeautifulSoup tree, reads all of it with read().
+    """
+
+    chunk_size = 16 * 1024
+
+    def __init__(self, filename, builder=None, encoding=None, url=None):
+        Document.__init__(self, None, builder, encoding, url)
+        self.filename = filename
+
+    def read(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def text_chunks(self):
+        if not self.encoding:
+            with open(self.filename, 'rb') as f:
+                self.encoding = charset_of(f.read(4096))
+        if not self.encoding:
+            # UnicodeDammit needs the whole page to detect the charset
+            yield self.text()
+            return
+
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        with open(self.filename, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield decoder.decode(chunk)
+        yield decoder.decode(b'', True)
+
+    def byte_chunks(self):
+        with open(self.filename, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def as_document(page):
+    if isinstance(page, Document):
+        return page
+    return Document(page)
+
+
+# the charset of a Content-Type header, and of a <meta> tag
+header_charset = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+meta_charset = re.compile(br'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+def normalized_charset(name):
+    """The Python name of the charset, or None if Python does not know it"""
+    if not is_unicode_str(name):
+        name = name.decode('ascii', 'replace')
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def declared_charset(response):
+    """The charset given by the Content-Type header of the response, if any"""
+    m = header_charset.search(response.headers.get('Content-Type', ''))
+    return normalized_charset(m.group(1)) if m else None
+
+
+def charset_of(markup):
+    """The charset of a page without a Content-Type header, from its <meta> tag or by detection"""
+    m = meta_charset.search(markup[:4096])
+    if m:
+        return normalized_charset(m.group(1))
+
+    from bs4 import UnicodeDammit
+    detected = UnicodeDammit(markup, is_html=True).original_encoding
+    # a page of plain ASCII says nothing about the next one
+    if detected and detected != 'ascii':
+        return normalized_charset(detected)
+    return None
+
+
+class FastPathError(Exception):
+    """The streaming extractor could not make sense of the page"""
+    pass
+
+
+class StreamingParser(HTMLParser):
+    """An HTMLParser for picking text out of a page fed in chunks, with references handed to handle_data as text"""
+
+    # only called by Python 2, newer versions convert references before handle_data
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+
+    def handle_charref(self, name):
+        if name.startswith('x') or name.startswith('X'):
+            self.handle_data(unichr(int(name[1:], 16)))
+        else:
+            self.handle_data(unichr(int(name)))
+
+
+class ResultTableExtractor(StreamingParser):
+    """Streams through a results page picking out the cell texts of the results table
+
+    The results table is the first table nested inside the first table of the
+    page, i.e. `soup.table.table`. Nothing else on the page is kept. The page
+    can be fed in as many chunks as you like; there is no need to feed it
+    any more once `done` is set.
+
+    headers - the text of every <th> in the table
+    rows - the texts of the <td>s of every <tr> in the table, including the header row
+    """
+
+    def __init__(self):
+        StreamingParser.__init__(self)
+        self.headers = []
+        self.rows = []
+        self.done = False
+
+        self.__open_tables = 0
+        self.__in_results = False
+        self.__row = None
+        self.__cell = None
+        self.__cell_tag = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        if tag == 'table':
+            if self.__in_results:
+                raise FastPathError('Found a table nested inside the results table')
+            self.__open_tables += 1
+            self.__in_results = self.__open_tables == 2
+        elif not self.__in_results:
+            return
+        elif tag == 'tr':
+            self.__close_row()
+            self.__row = []
+        elif tag in ('td', 'th'):
+            self.__close_cell()
+            self.__cell = []
+            self.__cell_tag = tag
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+
+        if tag == 'table':
+            if self.__in_results:
+                self.__close_row()
+                self.__in_results = False
+                self.done = True
+            self.__open_tables -= 1
+            if self.__open_tables == 0 and not self.done:
+                raise FastPathError('Did not find a table inside the first table')
+        elif not self.__in_results:
+            return
+        elif tag == 'tr':
+            self.__close_row()
+        elif tag in ('td', 'th'):
+            self.__close_cell()
+
+    def handle_data(self, data):
+        if self.__cell is not None:
+            self.__cell.append(data)
+
+    def __close_cell(self):
+        if self.__cell is None:
+            return
+
+        text = u''.join(self.__cell)
+        if self.__cell_tag == 'th':
+            self.headers.append(text)
+        elif self.__row is not None:
+            self.__row.append(text)
+        self.__cell = None
+
+    def __close_row(self):
+        self.__close_cell()
+        if self.__row is not None:
+            self.rows.append(self.__row)
+        self.__row = None
+
+
+class LinkFinder(StreamingParser):
+    """Streams through a page for the first link with the text in it, or with the title
+
+    href - the href of the link, once found
+    """
+
+    def __init__(self, text=None, title=None):
+        StreamingParser.__init__(self)
+        self.text = text
+        self.title = title
+        self.href = None
+        self.__link = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.href is not None or tag != 'a':
+            return
+
+        attrs = dict(attrs)
+        if 'href' not in attrs:
+            return
+        if self.title is not None:
+            if attrs.get('title') == self.title:
+                self.href = attrs['href']
+        else:
+            self.__link = (attrs['href'], [])
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self.__link is not None:
+            if self.text in u''.join(self.__link[1]):
+                self.href = self.__link[0]
+            self.__link = None
+
+    def handle_data(self, data):
+        if self.__link is not None:
+            self.__link[1].append(data)
+
+
+def find_link_streaming(page, text=None, title=None):
+    """The href of the first link with the text in it, or with the title, found without building a tree"""
+    finder = LinkFinder(text, title)
+    for chunk in page.text_chunks():
+        finder.feed(chunk)
+        if finder.href is not None:
+            break
+    return finder.href
+
+
+class ColumnLayout(object):
+    """Which column of the results table holds what"""
+
+    __slots__ = ('code', 'name', 'grade', 'semester', 'last')
+
+    def __init__(self, code, name, grade, semester):
+        self.code = code
+        self.name = name
+        self.grade = grade
+        self.semester = semester
+        self.last = max(code, name, grade, semester)
+
+    def __str__(self):
+        return 'code=%d name=%d grade=%d semester=%d' % (self.code, self.name, self.grade, self.semester)
+
+    def __eq__(self, other):
+        return isinstance(other, ColumnLayout) and \
+            (self.code, self.name, self.grade, self.semester) == (other.code, other.name, other.grade, other.semester)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.code, self.name, self.grade, self.semester))
+
+
+# whether to tell when the results table of a host changes layout. Turned off
+# when re-parsing saved pages, which come in every layout there has been
+report_layout_changes = True
+
+
+class HostProfile:
+    """What the StudWeb of one institution looks like
+
+    Made from the options of the host in studweb_settings, or from a host file
+    (*.conf) in ~/.studweb.hosts, so new institutions can be added without
+    changing the code. A host file uses the format of the settings file:
+
+        studweb = studweb.example.no
+        term_used_for_semester = Semester
+        expand_link_text = Se opplysninger om deg
+        requests_per_minute = 60
+
+    The layout of the results table is worked out from the header row once,
+    and kept for as long as the header row stays the same.
+    """
+
+    default_options = {
+        'login_form_name': 'fnrForm',
+        'results_link_title': 'Se dine resultater',
+        'logout_link_text': 'Logg ut',
+    }
+
+    def __init__(self, hostname, options):
+        self.hostname = hostname
+        self.options = dict(self.default_options)
+        self.options.update(options)
+
+        self.term = self.options['term_used_for_semester']
+        self.expand_link_text = self.options['expand_link_text']
+        self.results_link_title = self.options['results_link_title']
+        self.logout_link_text = self.options['logout_link_text']
+
+        # the charset of the pages, given by the host file or decided from the first page
+        self.encoding = None
+        if self.options.get('encoding'):
+            self.encoding = normalized_charset(self.options['encoding'])
+        self.encoding_configured = self.encoding is not None
+
+        self.selectors = {
+            'login_form': 'form[name="%s"]' % self.options['login_form_name'],
+            'login_inputs': 'form[name="%s"] input' % self.options['login_form_name'],
+            'login_error': '#alert-box ul li',
+        }
+        self.__compiled = {}
+
+        # ColumnLayouts keyed on the header rows they were found in
+        self.layouts = {}
+        self.layout_signature = None
+        self.layout_changes = 0
+
+    def select(self, name, soup):
+        """soup.select with the selector of that name, compiled the first time it is used"""
+        if name not in self.__compiled:
+            try:
+                import soupsieve
+                self.__compiled[name] = soupsieve.compile(self.selectors[name]).select
+            except ImportError:
+                # bs4 before 4.7 has a selector engine of its own
+                selector = self.selectors[name]
+                self.__compiled[name] = lambda tag: tag.select(selector)
+        return self.__compiled[name](soup)
+
+    def charset_for(self, response, markup=None):
+        """The charset to decode the response with
+
+        A charset given by the host file is always used, as it is there for
+        hosts that get it wrong. Otherwise the one in the Content-Type header
+        is used, and without one, the charset is decided from the first page
+        and kept for the rest.
+
+        markup - the body of the response, or the start of it, if it was streamed
+        """
+        if self.encoding_configured:
+            return self.encoding
+
+        declared = declared_charset(response)
+        if declared:
+            self.encoding = declared
+        elif self.encoding is None:
+            self.encoding = charset_of(response.content if markup is None else markup)
+        return self.encoding
+
+    def column_layout(self, headers):
+        """The ColumnLayout of a results table with the given header texts
+
+        Returns None if one of the columns is missing
+        """
+        signature = tuple(h.strip() for h in headers)
+
+        layout = self.layouts.get(signature)
+        if layout is None:
+            layout = self.resolve_layout(signature)
+            if layout is None:
+                return None
+            self.layouts[signature] = layout
+
+        if signature != self.layout_signature:
+            # a header row worded differently is no change, as long as the columns are where they were
+            if self.layout_signature is not None and layout != self.layouts[self.layout_signature]:
+                self.layout_changes += 1
+                if report_layout_changes:
+                    print_error(u"The results table on %s has changed layout: %s (was %s)"
+                                % (self.hostname, layout, self.layouts[self.layout_signature]))
+            self.layout_signature = signature
+
+        return layout
+
+    def resolve_layout(self, headers):
+        index_lookup = {}
+        for s in [self.term, 'Emnekode', 'Emnenavn', 'Resultat']:
+            hits = [i for i, th in enumerate(headers) if th.find(s) >= 0]
+            if not hits:
+                return None
+            index_lookup[s] = hits[0]
+
+        return ColumnLayout(index_lookup['Emnekode'], index_lookup['Emnenavn'],
+                            index_lookup['Resultat'], index_lookup[self.term])
+
+
+def load_host_profiles(directory=hosts_dir):
+    """A HostProfile for every host in studweb_settings and every host file in the directory"""
+    profiles = dict((host, HostProfile(host, options)) for host, options in studweb_settings.items())
+
+    for filename in sorted(glob.glob(os.path.join(directory, '*.conf'))):
+        options = read_settings(filename)
+        host = options.pop('studweb', None)
+        missing = [k for k in ['term_used_for_semester', 'expand_link_text'] if k not in options]
+        if not host or missing:
+            print_error("Ignoring host file %s without %s" % (filename, ', '.join((['studweb'] if not host else []) + missing)))
+            continue
+
+        if 'requests_per_minute' in options:
+            options['requests_per_minute'] = int(options['requests_per_minute'])
+        profiles[host] = HostProfile(host, options)
+
+    return profiles
+
+
+# loaded the first time a host is looked up
+host_profiles = None
+
+
+def all_host_profiles():
+    global host_profiles
+    if host_profiles is None:
+        host_profiles = load_host_profiles()
+    return host_profiles
+
+
 class PageParser:
 
-    def __init__(self, term, expand_link_text):
-        self.semester_string = term
-        self.expand_link_text = expand_link_text
+    def __init__(self, profile):
+        self.profile = profile
 
     def parse_page_with_expanded_link_section_for_logout_url(self, html_page):
-        return find_bulleted_link(html_page, 'Logg ut')
+        return find_bulleted_link(html_page, self.profile.logout_link_text)
 
     def parse_page_with_expanded_link_section_for_results_url(self, html):
-        soup = BeautifulSoup(html)
-        link = soup.find_all("a", title="Se dine resultater")
-        check(link, "Could not find <a> tag with title \"Se dine resultater\"", soup.prettify())
+        page = as_document(html)
+        href = find_link_streaming(page, title=self.profile.results_link_title)
+        check(href, "Could not find <a> tag with title \"%s\"" % self.profile.results_link_title, page)
 
-        return link[0]['href']
+        return href
 
     def parse_start_page_for_link_url_to_expand_link_section(self, start_page_html):
-        return find_bulleted_link(start_page_html, self.expand_link_text)
+        return find_bulleted_link(start_page_html, self.profile.expand_link_text)
 
     def parse_login_page_for_path_to_form_handler(self, login_html):
-        soup = BeautifulSoup(login_html)
-        form = soup.select("form[name=fnrForm]")[0]
+        soup = as_document(login_html).soup()
+        form = self.profile.select('login_form', soup)[0]
 
         return form['action']
 
@@ -158,8 +1114,8 @@ class PageParser:
         Returns a dictionary with <input:value>
         """
 
-        soup = BeautifulSoup(login_html)
-        inputs = soup.select("form[name=fnrForm] input")
+        soup = as_document(login_html).soup()
+        inputs = self.profile.select('login_inputs', soup)
 
         attributes = [i.attrs for i in inputs]
         form_values = {}
@@ -171,27 +1127,81 @@ class PageParser:
 
 
     def parse_result_page_for_results(self, html):
-        """Parses result page and returns a list of the subject results
+        """Parses result page and returns a set of the subject results
 
-        html - the html of the page containing the results
+        The streaming extractor is tried first, as it is far cheaper than building
+        the whole tree. Should it fail, the page is parsed with BeautifulSoup.
+
+        html - the html of the page containing the results, or its Document
         """
 
         assert html != None
-        assert is_unicode_str(html)
+        assert isinstance(html, Document) or is_unicode_str(html)
+
+        page = as_document(html)
+        try:
+            return self.parse_result_page_streaming(page)
+        except FastPathError:
+            return self.parse_result_page_with_soup(page)
+
+    def parse_result_page_streaming(self, html):
+        """Parses the results table of the page without building a tree of the page
+
+        Raises FastPathError if the table does not look as expected
+        """
+        extractor = ResultTableExtractor()
+        for chunk in as_document(html).text_chunks():
+            extractor.feed(chunk)
+            if extractor.done:
+                break
+
+        if not extractor.done:
+            raise FastPathError('Did not find the end of the results table')
+
+        return self.results_from_table(extractor.headers, extractor.rows)
+
+    def results_from_table(self, headers, rows):
+        """Picks the subject results out of the cell texts found by ResultTableExtractor"""
+        layout = self.profile.column_layout(headers)
+        if layout is None:
+            raise FastPathError("Did not find the headers of the results table in %s" % headers)
+
+        code = layout.code
+        name = layout.name
+        grade = layout.grade
+        semester = layout.semester
+        last_column = layout.last
+
+        results = ResultSet()
+
+        # Skip the first row with headers, and the two summing up the table
+        for row in rows[1:-2]:
+            # only rows with non-blank subject code
+            if len(row) <= code or not row[code].strip():
+                continue
+            if len(row) <= last_column:
+                raise FastPathError('Too few columns in row: %s' % row)
+
+            results.add(SubjectResult(
+                row[code].strip(), row[name].strip(), row[grade].strip(), row[semester].strip()))
+
+        return results
 
-        soup = BeautifulSoup(html)
+    def parse_result_page_with_soup(self, html):
+        """Parses the results table by walking the BeautifulSoup tree of the whole page"""
+        page = as_document(html)
+        soup = page.soup()
 
         # parse the results table
-        result_table = soup.table.table
+        result_table = soup.table.table if soup.table else None
+        check(result_table, "No results table on the page", page)
         headers = result_table.find_all("th")
 
-        index_lookup = {}
-        for s in [self.semester_string, 'Emnekode', 'Emnenavn', 'Resultat']:
-            hits = [i for i, th in enumerate(headers) if th.text.find(s) >= 0]
-            assert len(hits) > 0, "Did not find a header with the name %s" % s
-            index_lookup[s] = hits[0]
+        layout = self.profile.column_layout([th.text for th in headers])
+        check(layout, "Page layout has changed! Did not find the columns in %s" % [th.text for th in headers], page)
 
-        assert len(index_lookup.values()) == 4, 'Page layout has changed!'
+        index_lookup = {'Emnekode': layout.code, 'Emnenavn': layout.name,
+                        'Resultat': layout.grade, 'Semester': layout.semester}
 
         # only find rows with non-blank subject code
         relevant_trs = [tr
@@ -199,7 +1209,7 @@ class PageParser:
                         for i, c in enumerate(tr.children)
                         if i == index_lookup['Emnekode'] and c.text.strip()]
 
-        results = set()
+        results = ResultSet()
 
         for tr in relevant_trs:
             tmp = {}
@@ -208,7 +1218,7 @@ class PageParser:
                     text = c.text.strip()
                     if i == index_lookup['Emnekode']:
                         tmp['code'] = text
-                    if i == index_lookup[self.semester_string]:
+                    if i == index_lookup['Semester']:
                         tmp['semester'] = text
                     if i == index_lookup['Emnenavn']:
                         tmp['name'] = text
@@ -218,6 +1228,7 @@ class PageParser:
                 results.add(SubjectResult(
                     tmp['code'], tmp['name'], tmp['grade'], tmp['semester']))
             except KeyError as e:
+                rows_skipped.inc(host=self.profile.hostname)
                 print("En feil skjedde. Fortsetter ...")
                 print(e)
                 print(tr)
@@ -234,20 +1245,18 @@ def is_unicode_str(s):
         return isinstance(s, unicode)
 
 
-def log_into_start_page(session, parser):
+def log_into_start_page(session, parser, account):
     # user_agent = "User-Agent:Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/27.0.1453.110 Safari/537.36"
     # extra_headers = { 'User-Agent' : user_agent }
     # s.headers.update(extra_headers)
-    global studweb_hostname
+    ssn = account.config['ssn']
+    pin_code = account.config['pin']
 
-    studweb_hostname = config['studweb']
-    ssn = config['ssn']
-    pin_code = config['pin']
+    r = http_get(session, studweb_url(account), account, requests_left=5)
 
-    r = session.get(studweb_url())
-
-    form_values = parser.parse_login_page_for_form_values(r.content)
-    action = parser.parse_login_page_for_path_to_form_handler(r.content)
+    login_page = page_of(r, account)
+    form_values = parser.parse_login_page_for_form_values(login_page)
+    action = parser.parse_login_page_for_path_to_form_handler(login_page)
 
     # start filling in the values
     form_values['fodselsnr'] = ssn
@@ -259,122 +1268,768 @@ def log_into_start_page(session, parser):
     # set the submit action to be Logg inn
     form_values['WOSubmitAction'] = "Logg inn"
 
-    r = session.post(studweb_url() + action,
+    # not retried, as we cannot know whether StudWeb got it
+    r = session.post(studweb_url(account) + action,
                      data=form_values,
-                     allow_redirects=True)
+                     allow_redirects=True,
+                     timeout=account.deadline.timeout(requests_left=4))
 
     # Når innlogget, husk å logge ut
-    return r.content
+    return page_of(r, account)
+
+def studweb_url(account):
+    """Where to find StudWeb. The studweb_url config value is for testing against a stand-in"""
+    return account.config.get('studweb_url') or 'https://' + account.hostname()
+
+def url_for(account, href):
+    """The url of a link found on a StudWeb page"""
+    if href.startswith('http://') or href.startswith('https://'):
+        return href
+    return studweb_url(account) + href
+
+def content_of(response, account):
+    account.metrics.count('bytes_downloaded', len(response.content))
+    return response.content
+
+# failed GETs are tried again this many times, if the deadline allows
+get_retries = 2
+retry_status_codes = (502, 503, 504)
+
+
+def http_get(session, url, account, requests_left=1, stream=False):
+    """GETs the url within the account's deadline, retrying when the connection fails or StudWeb is unavailable
 
-def studweb_url():
-    return 'https://' + config['studweb']
+    requests_left - how many requests the run has left to make, counting this one
+    stream - leave the body to be read with iter_content
+    """
+    import requests
 
-def logout(session, parser, html_page):
+    attempt = 0
+    while True:
+        timeout = account.deadline.timeout(requests_left)
+        try:
+            r = session.get(url, timeout=timeout, stream=stream)
+            if r.status_code not in retry_status_codes or attempt >= get_retries:
+                return r
+            r.close()
+            error = "Status %d" % r.status_code
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= get_retries:
+                raise
+            error = str(e)
+
+        attempt += 1
+        account.metrics.count('retries')
+        print_error(u"Retrying %s (%s)" % (url, error))
+        time.sleep(min(2 ** attempt * 0.5, max(account.deadline.timeout(requests_left) / 2, 0)))
+
+
+def page_of(response, account):
+    """The Document of a response, to be decoded with the charset decided for the host"""
+    profile = account.profile()
+    encoding = profile.charset_for(response) if profile else declared_charset(response)
+    return Document(content_of(response, account), encoding=encoding, url=response.url)
+
+def spooled_page_of(response, account):
+    """Streams the body of a response to the account's page file, returning its FileDocument
+
+    The body is written to a temporary file that replaces the page file once
+    complete, so the page file always holds a whole page.
+    """
+    import tempfile
+
+    head = b''
+    size = 0
+    fd, tmp_file = tempfile.mkstemp(prefix='.studweb-page-', dir=os.path.dirname(account.page_file) or '.')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            for chunk in response.iter_content(FileDocument.chunk_size):
+                if len(head) < 4096:
+                    head += chunk[:4096 - len(head)]
+                size += len(chunk)
+                f.write(chunk)
+        finally:
+            f.close()
+        os.rename(tmp_file, account.page_file)
+    except Exception:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    finally:
+        response.close()
+
+    account.metrics.count('bytes_downloaded', size)
+    profile = account.profile()
+    encoding = profile.charset_for(response, head) if profile else declared_charset(response)
+    return FileDocument(account.page_file, encoding=encoding, url=response.url)
+
+
+def results_page_of(session, url, account, requests_left):
+    """Fetches the results page, streaming it to disk in low memory mode"""
+    if account.saves_memory():
+        return spooled_page_of(http_get(session, url, account, requests_left, stream=True), account)
+    return page_of(http_get(session, url, account, requests_left), account)
+
+def logout(session, parser, html_page, account):
     if not html_page:
         raise Exception("No html received")
 
     logout_url = parser.parse_page_with_expanded_link_section_for_logout_url(html_page)
-    session.get(studweb_url() + logout_url)
+    http_get(session, url_for(account, logout_url), account)
 
 
 def check(find_result, error_msg, failing_html):
     if not find_result:
-        f = codecs.open(error_file, 'w', encoding='utf8')
-        decoded = codecs.decode(failing_html, 'iso8859-1')
-        f.write(decoded)
-        f.close()
-        raise Exception(error_msg)
+        layout_errors.inc()
+        raise PageLayoutError(error_msg, failing_html)
+
+
+# writes the failure snapshots of all accounts, made when the first one is recorded
+snapshot_writer = None
+snapshot_writer_lock = threading.Lock()
+
+
+def record_failure(error, account, page=None, step=None):
+    """Queues a snapshot of the page that could not be parsed for the account's failures directory
+
+    page - the page, for errors other than PageLayoutError, which carries its own
+    step - the phase of the run, if the error does not know it
+    See studweb_failures.py
+    """
+    global snapshot_writer
+    import studweb_failures
+
+    page = getattr(error, 'failing_html', None) or page
+    if page is None or not account.failures_dir:
+        return
+
+    document = as_document(page)
+    markup, encoding = document.read(), document.encoding
+    if is_unicode_str(markup):
+        markup, encoding = markup.encode('utf8'), 'utf-8'
+
+    profile = account.profile()
+    metadata = {
+        'time': time.time(),
+        'account': account.name,
+        'host': account.hostname(),
+        'step': getattr(error, 'step', None) or step,
+        'url': getattr(error, 'url', None) or document.url,
+        'error': u"%s: %s" % (type(error).__name__, error),
+        'encoding': encoding,
+        'profile': dict(profile.options, layout=profile.layout_signature) if profile else None,
+    }
+
+    with snapshot_writer_lock:
+        if snapshot_writer is None:
+            snapshot_writer = studweb_failures.SnapshotWriter()
+    snapshot_writer.put(account.failures_dir, markup, metadata)
+
+
+def flush_failure_snapshots():
+    """Waits for the failure snapshots to be written, before exiting"""
+    if snapshot_writer is not None:
+        snapshot_writer.flush()
+
+
+# the start and end tags of tables in the raw page
+table_tag = re.compile(br'<(/?)table\b', re.IGNORECASE)
+
+# the parts of the results table that change with every session and request
+volatile_parts = [
+    (re.compile(br'/WebObjects/[^"\'\s>]*'), b'/WebObjects/'),
+    (re.compile(br'wosid=[^&"\'\s>]*'), b'wosid='),
+    (re.compile(br'\s+'), b' '),
+]
+
+
+class TableRegionScanner:
+    """Picks the raw markup of the results table, `soup.table.table`, out of a page fed in chunks of bytes
+
+    feed() returns the pieces of the table found so far. A chunk is only
+    looked at up to its last '>', the rest being kept for the next one, so
+    no tag, link or run of whitespace is split between two pieces.
+
+    done - the end of the table has been found
+    missing - the page turned out to have no results table
+    """
+
+    def __init__(self):
+        self.done = False
+        self.missing = False
+
+        self.__depth = 0
+        self.__in_table = False
+        self.__pending = b''
+
+    def feed(self, chunk):
+        data = self.__pending + chunk
+        cut = data.rfind(b'>') + 1
+        self.__pending = data[cut:]
+        return self.__scan(data[:cut])
+
+    def close(self):
+        """The pieces of the table in what is left after the last '>'"""
+        data, self.__pending = self.__pending, b''
+        return self.__scan(data)
+
+    def __scan(self, data):
+        if self.done or self.missing:
+            return []
+
+        start = 0 if self.__in_table else None
+        for m in table_tag.finditer(data):
+            if m.group(1):
+                self.__depth -= 1
+                if self.__in_table and self.__depth == 1:
+                    self.done = True
+                    end = data.find(b'>', m.end()) + 1
+                    return [data[start:end or len(data)]]
+                if self.__depth <= 0:
+                    self.missing = True
+                    return []
+            else:
+                self.__depth += 1
+                if self.__depth == 2 and not self.__in_table:
+                    self.__in_table = True
+                    start = m.start()
+
+        return [data[start:]] if self.__in_table else []
+
+
+def results_table_pieces(html, scanner):
+    """Yields the pieces of the results table as the scanner finds them, reading the page a chunk at a time"""
+    for chunk in as_document(html).byte_chunks():
+        for piece in scanner.feed(chunk):
+            yield piece
+        if scanner.done or scanner.missing:
+            return
+    for piece in scanner.close():
+        yield piece
+
+
+def results_table_region(markup):
+    """The raw markup of the results table, `soup.table.table`, or None if there is none"""
+    scanner = TableRegionScanner()
+    region = b''.join(results_table_pieces(markup, scanner))
+    return region if scanner.done else None
+
+
+def has_results_table(html, profile):
+    """Whether the page has a results table with the columns of the host
+
+    Reads no further than the header row of the table.
+    """
+    extractor = ResultTableExtractor()
+    try:
+        for text in as_document(html).text_chunks():
+            for i in range(0, len(text), FileDocument.chunk_size):
+                extractor.feed(text[i:i + FileDocument.chunk_size])
+                if extractor.rows or extractor.done:
+                    return profile.resolve_layout(extractor.headers) is not None
+    except FastPathError:
+        return False
+    return False
+
+
+def results_digest(html):
+    """A fingerprint of the results table of the page that stays the same as long as the results do
+
+    The links in the table point to the current session, so they are left out.
+    The table is hashed as it is read, without keeping the page or the table.
+    Returns None if the page has no results table.
+    """
+    scanner = TableRegionScanner()
+    digest = hashlib.sha1()
+    for piece in results_table_pieces(html, scanner):
+        # no link or run of whitespace is split between pieces
+        for pattern, replacement in volatile_parts:
+            piece = pattern.sub(replacement, piece)
+        digest.update(piece)
+
+    return digest.hexdigest() if scanner.done else None
+
+
+def stored_digest(account):
+    """The fingerprint of the results table the results file was last checked against"""
+    if not os.path.isfile(account.digest_file) or not os.path.isfile(account.results_file):
+        return None
+
+    f = open(account.digest_file, 'r')
+    digest = f.read().strip()
+    f.close()
+    return digest or None
+
+
+def store_digest(digest, account):
+    if digest is None:
+        return
+
+    tmp_file = account.digest_file + '.tmp'
+    f = open(tmp_file, 'w')
+    f.write(digest)
+    f.close()
+    os.rename(tmp_file, account.digest_file)
 
 
 def diff(old, new):
-    return new.difference(old)
+    """Returns the results that are new or have a new grade"""
+    return set(ResultSet(new).diff(ResultSet(old)))
 
 
-def new_results(parser):
-    return diff(old_results(parser), latest_results(parser))
+def new_results(parser, account):
+    """Returns a ResultDiff of the results that are new since the results were last stored
 
+    When the results table looks just like it did last time, there is
+    nothing new and the page is neither parsed nor compared with the stored results.
+    """
+    page = latest_page(parser, account)
+
+    with account.metrics.timer('digest'):
+        digest = results_digest(page)
+
+    if digest is not None and digest == stored_digest(account):
+        account.metrics.count('unchanged_digest')
+        account.latest_results = None
+        return ResultDiff([], [], [])
+
+    with account.metrics.timer('old_results'):
+        old = old_results(parser, account)
+
+    latest = parse_latest_results(parser, page, account)
+    account.latest_digest = digest
+
+    with account.metrics.timer('diff'):
+        new = ResultSet(latest).diff(ResultSet(old))
+    account.metrics.count('results_diffed', len(old) + len(latest))
+    account.metrics.count('new_results', len(new))
+
+    # nothing new to tell, but results that are gone or subjects that were renamed
+    # still have to be stored for the digest to stand for the results file
+    if not new and os.path.isfile(account.results_file):
+        if serialized(latest) != serialized(old):
+            store(latest, account)
+        store_digest(digest, account)
+
+    return new
+
+
+def old_results(parser, account):
+    if os.path.isfile(account.results_file):
+        return load_results(account.results_file)
+    if os.path.isfile(account.data_file):
+        return migrate_data_file(parser, account)
+    return ResultSet()
+
+
+def migrate_data_file(parser, account):
+    """Imports the results page stored by earlier versions into the results file"""
+    f = codecs.open(account.data_file, 'r', encoding='utf8')
+    previous_html = f.read()
+    f.close()
+
+    results = parser.parse_result_page_for_results(previous_html)
+    store(results, account)
+
+    return results
+
+
+def load_results(filename):
+    f = codecs.open(filename, 'r', encoding='utf8')
+    stored = json.load(f)
+    f.close()
+
+    return results_from(stored)
+
+
+def results_from(stored):
+    """The ResultSet of results read from JSON written by serialized()"""
+    return ResultSet(SubjectResult(r['code'], r['name'], r['grade'], r['semester'])
+                     for r in stored['results'].values())
+
+
+def latest_results(parser, account):
+    return parse_latest_results(parser, latest_page(parser, account), account)
+
+
+def parse_latest_results(parser, page, account):
+    # Saved to be stored later on
+    with account.metrics.timer('parse_results'):
+        try:
+            account.latest_results = parser.parse_result_page_for_results(page)
+        except Exception as e:
+            record_failure(e, account, page, step='parse_results')
+            raise
+    account.metrics.count('rows_parsed', len(account.latest_results))
+
+    return account.latest_results
+
+
+# the parts of a WebObjects link: the path up to the context id, which goes up with
+# every request in the session, the context id, and the element id of the link on its page
+webobjects_link = re.compile(r'^(.*/wo/(?:[^/?]+/)?)(\d+)\.(\d+(?:\.\d+)*)(\?.*)?$')
+
+
+class NavigationCache:
+    """The links leading from the start page to the results page on each host
+
+    After logging in, the results are normally found by following the link
+    expanding the link section of the start page, and then the results link
+    on that page. Both are WebObjects links, whose element ids stay the same
+    for as long as the pages look the same. So once the path has been
+    followed, the results link can be made from the expand link on the start
+    page, saving the request for the expanded page and the parsing of it.
+
+    A shortcut that does not lead to a results page counts as a miss, and
+    after max_misses in a row the path of the host is not used until the
+    pages change. Kept in a JSON file, shared by all accounts and processes
+    using it, which is read again before every change.
+    """
+
+    max_misses = 3
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.paths = {}
+
+    def shortcut(self, hostname, expand_href):
+        """The results link to try, given the expand link on the start page. None if there is none to try"""
+        expand = webobjects_link.match(expand_href)
+        with self.lock:
+            # read every time, as other processes may have learned something since
+            self.paths = self.__read()
+            path = self.paths.get(hostname)
+        if not expand or not path or path['misses'] >= self.max_misses or expand.group(3) != path['expand']:
+            return None
+
+        prefix, context, element, query = expand.groups()
+        return '%s%d.%s%s' % (prefix, int(context) + path['context_step'], path['results'], query or '')
+
+    def learned(self, hostname, expand_href, results_href):
+        """Keeps the path followed to the results, unless it is the one known already"""
+        expand, results = webobjects_link.match(expand_href), webobjects_link.match(results_href)
+        if not expand or not results:
+            return
+
+        path = {'expand': expand.group(3), 'results': results.group(3),
+                'context_step': int(results.group(2)) - int(expand.group(2)), 'misses': 0}
+
+        def change(known):
+            if known and all(known[k] == path[k] for k in ['expand', 'results', 'context_step']):
+                return None
+            return path
+        self.__update(hostname, change)
+
+    def hit(self, hostname):
+        self.__update(hostname, lambda path: dict(path, misses=0) if path and path['misses'] else None)
+
+    def missed(self, hostname):
+        self.__update(hostname, lambda path: dict(path, misses=path['misses'] + 1) if path else None)
+
+    def __update(self, hostname, change):
+        """Changes the path of the host as it is in the file now, so the paths of the other processes are kept
+
+        change - given the path of the host, or None, returns its new path, or None to leave the file alone
+        A cache that cannot be written is only a missed shortcut, so it never fails the poll.
+        """
+        with self.lock:
+            try:
+                lock_fd = self.__lock_file()
+                try:
+                    self.paths = self.__read()
+                    path = change(self.paths.get(hostname))
+                    if path is not None:
+                        self.paths[hostname] = path
+                        self.__write()
+                finally:
+                    if lock_fd is not None:
+                        os.close(lock_fd)
+            except (IOError, OSError) as e:
+                print_error(u"Could not update %s: %s" % (self.filename, e))
+
+    def __lock_file(self):
+        """Keeps other processes from writing the file until closed. None where there is no flock()"""
+        try:
+            import fcntl
+        except ImportError:
+            return None
+
+        fd = os.open(self.filename + '.lock', os.O_WRONLY | os.O_CREAT, stat.S_IRUSR | stat.S_IWUSR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except (IOError, OSError):
+            os.close(fd)
+            raise
+        return fd
+
+    def __read(self):
+        if not os.path.isfile(self.filename):
+            return {}
+        try:
+            with codecs.open(self.filename, 'r', encoding='utf8') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            print_error(u"Ignoring the unreadable " + self.filename)
+            return {}
+
+    def __write(self):
+        # a name of its own, as the file is shared by the processes of a daemon
+        tmp_file = '%s.%d-%d.tmp' % (self.filename, os.getpid(), threading.current_thread().ident)
+        with codecs.open(tmp_file, 'w', encoding='utf8') as f:
+            json.dump(self.paths, f, sort_keys=True)
+        os.rename(tmp_file, self.filename)
+
+
+navigation_caches = {}
+navigation_caches_lock = threading.Lock()
 
-def old_results(parser):
-    if os.path.isfile(data_file):
-        f = codecs.open(data_file, 'r', encoding='utf8')
-        previous_html = f.read()
-        f.close()
-        return parser.parse_result_page_for_results(previous_html)
-    return set()
 
+def navigation_cache(filename):
+    """The NavigationCache of the file, made once per process"""
+    with navigation_caches_lock:
+        if filename not in navigation_caches:
+            navigation_caches[filename] = NavigationCache(filename)
+        return navigation_caches[filename]
 
-def latest_results(parser):
-    global latest_html
 
-    session = requests.Session()  # The session object that persists cookies and default values across requests
+def latest_page(parser, account):
+    """Fetches the results page, using the session saved by the last run if there is one"""
+    keep_session = account.keeps_session()
+
+    if keep_session:
+        with account.metrics.timer('saved_session'):
+            page = page_from_saved_session(parser, account)
+        if page is not None:
+            return page
+
+    session = account.new_session()
     html = None
 
     try:
-        login_page = log_into_start_page(session, parser)
+        logins.inc(host=account.hostname())
         try:
-            check(login_page,
-                  "Failed parsing start page for expand link section. Check the configuration settings at " + settings_file,
-                  login_page)
-        except Exception as e:
-            # try to get the error message
-            error_msg = BeautifulSoup(login_page).select("#alert-box ul li")
-            if error_msg:
-                print_error("Caught error when trying to log in: \n" + error_msg[0].get_text())
-                sys.exit(1)
-            else:
-                raise e
+            with account.metrics.timer('login'):
+                login_page = log_into_start_page(session, parser, account)
+        except Exception:
+            login_failures.inc(host=account.hostname(), reason='error')
+            raise
+
+        check(login_page.markup,
+              "Failed parsing start page for expand link section. Check the configuration settings at " + account.settings_file,
+              login_page)
 
-        url = parser.parse_start_page_for_link_url_to_expand_link_section(login_page)
+        # StudWeb shows us the login page with an error message if the login failed
+        error_msg = parser.profile.select('login_error', login_page.soup())
+        if error_msg:
+            login_failures.inc(host=account.hostname(), reason='refused')
+            raise LoginError(error_msg[0].get_text())
 
-        check(url, "Failed parsing start page for expand link section.", login_page)
+        with account.metrics.timer('navigation'):
+            url = parser.parse_start_page_for_link_url_to_expand_link_section(login_page)
 
-        html = session.get(studweb_url() + url).content
+            check(url, "Failed parsing start page for expand link section.", login_page)
 
-        result_page_url = parser.parse_page_with_expanded_link_section_for_results_url(html)
+        html, result_page_url = results_page_by_shortcut(session, parser, url, account)
+        if not html:
+            with account.metrics.timer('navigation'):
+                expanded_page = page_of(http_get(session, url_for(account, url), account, requests_left=3), account)
 
-        r = session.get(studweb_url() + result_page_url)
+                result_page_url = parser.parse_page_with_expanded_link_section_for_results_url(expanded_page)
 
-        html = BeautifulSoup(r.content).prettify()
+            with account.metrics.timer('fetch_results'):
+                html = results_page_of(session, url_for(account, result_page_url), account, requests_left=2)
 
+            if account.navigation():
+                account.navigation().learned(account.hostname(), url, result_page_url)
+
+        if keep_session:
+            # WebObjects urls are only valid for a limited number of requests, so keep the newest
+            fresh_url = find_link_streaming(html, title=parser.profile.results_link_title)
+            save_session(session, fresh_url or result_page_url, account)
+
+    except LoginError:
+        raise
     except Exception as e:
         print_error('Failed parsing: ' + str(e))
+        if isinstance(e, PageLayoutError):
+            # the one check outside the timed phases is of the page after logging in
+            record_failure(e, account, step='login')
+        raise
     finally:
         try:
-            logout(session, parser, html)
+            # a kept session is left logged in for the next run, and
+            # without the results page we might not be logged in at all
+            if html and not keep_session:
+                with account.metrics.timer('logout'):
+                    logout(session, parser, html, account)
         except Exception as e:
             print_error('Failed to log out:' + str(e))
             raise e
-            # pass  # we might not be logged in
 
-    # Saved to be stored later on
-    latest_html = html
+    if not html:
+        raise Exception("No results page received")
+
+    return html
+
+
+def results_page_by_shortcut(session, parser, expand_url, account):
+    """The results page fetched straight from the start page, using the path learned by the NavigationCache
+
+    Returns the page and its url, or (None, None) if there is no path to take or it did not lead to the results
+    """
+    navigation = account.navigation()
+    shortcut = navigation.shortcut(account.hostname(), expand_url) if navigation else None
+    if not shortcut:
+        return None, None
+
+    with account.metrics.timer('fetch_results'):
+        html = results_page_of(session, url_for(account, shortcut), account, requests_left=3)
+
+    if not has_results_table(html, parser.profile):
+        navigation.missed(account.hostname())
+        account.metrics.count('navigation_misses')
+        return None, None
+
+    navigation.hit(account.hostname())
+    account.metrics.count('navigation_shortcuts')
+    return html, shortcut
+
+
+def save_session(session, result_page_url, account):
+    """Saves the cookies of a logged in session, and where to find the results, for the next run
+
+    Like the settings file, the session file is only readable by the user.
+    """
+    cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+                'secure': c.secure, 'expires': c.expires}
+               for c in session.cookies]
+
+    tmp_file = account.session_file + '.tmp'
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+    f = os.fdopen(fd, 'w')
+    f.write(json.dumps({'cookies': cookies, 'results_url': result_page_url}))
+    f.close()
+    os.rename(tmp_file, account.session_file)
 
-    return parser.parse_result_page_for_results(latest_html)
+
+def load_session(account):
+    """Returns a session with the cookies saved by the last run, and the url of the results page
+
+    Returns (None, None) if there is no usable saved session. A session file
+    that cannot be read is removed, so the next run logs in as if it had expired
+    """
+    if not os.path.isfile(account.session_file):
+        return None, None
+
+    mode = os.stat(account.session_file).st_mode
+    if mode & stat.S_IROTH or mode & stat.S_IRGRP:
+        print_error("Ignoring saved session readable by others: " + account.session_file)
+        return None, None
+
+    try:
+        f = open(account.session_file, 'r')
+        saved = json.load(f)
+        f.close()
+
+        session = account.new_session()
+        for c in saved['cookies']:
+            session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'],
+                                secure=c['secure'], expires=c['expires'])
+        result_page_url = saved['results_url']
+    except (ValueError, KeyError, TypeError) as e:
+        print_error("Ignoring unreadable saved session %s: %s" % (account.session_file, e))
+        os.remove(account.session_file)
+        return None, None
+
+    return session, result_page_url
+
+
+def page_from_saved_session(parser, account):
+    """Fetches the results page directly using the session saved by the last run
+
+    Returns None if the session has expired, so we need to log in again
+    """
+    session, result_page_url = load_session(account)
+    if not session:
+        return None
+
+    try:
+        # leaving time to log in, should the session have expired
+        html = results_page_of(session, url_for(account, result_page_url), account, requests_left=6)
+        if not has_results_table(html, parser.profile):
+            # StudWeb sends us somewhere else once the session has expired
+            os.remove(account.session_file)
+            return None
+
+        # WebObjects urls are only valid for a limited number of requests, so keep the newest
+        save_session(session, parser.parse_page_with_expanded_link_section_for_results_url(html), account)
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        # StudWeb sends us somewhere else once the session has expired
+        os.remove(account.session_file)
+        return None
+
+    return html
 
 
 def find_bulleted_link(html, text_to_match):
-    soup = BeautifulSoup(html)
+    # looked up in the tree only if there is one, as the results page is not
+    # otherwise parsed into one when the results are unchanged
+    page = as_document(html)
+    if page.has_soup():
+        link = page.soup().find(lambda tag: tag.name == 'a' and tag.has_attr('href') and text_to_match in tag.get_text())
+        href = link['href'] if link else None
+    else:
+        href = find_link_streaming(page, text=text_to_match)
+
+    check(href, 'Did not find "' + text_to_match + '".', page)
+
+    return href
+
 
-    a = soup.find(lambda tag: tag.name == 'a' and tag.has_attr('href') and text_to_match in tag.text)
+def serialized(results):
+    """The results as JSON, keyed on subject code and semester. The same results always give the same JSON"""
+    stored = {'version': 1,
+              'results': dict((r.key(), r.asDict()) for r in results)}
 
-    check(a, 'Did not find "' + text_to_match + '".', html)
+    return json.dumps(stored, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
 
-    return a['href']
 
+# functions called with the account every time store() has written its results,
+# e.g. to drop the copies of the old results kept by studweb_api
+results_stored = []
 
-def store(html):
-    f = codecs.open(data_file, 'w', encoding='utf8', errors='ignore')
-    f.write(html)
+
+def store(results, account):
+    """Writes the results to the results file, and adds them to the account's archive
+
+    The file is replaced atomically, so a crash never leaves a half-written file behind
+    """
+    tmp_file = account.results_file + '.tmp'
+    f = codecs.open(tmp_file, 'w', encoding='utf8')
+    f.write(serialized(results))
     f.close()
+    os.rename(tmp_file, account.results_file)
+
+    if account.archive_dir:
+        import studweb_archive
+        studweb_archive.Archive(account.archive_dir).add(results)
+
+    for listener in results_stored:
+        listener(account)
 
 
 def get_parser(studweb_hostname):
-    options = studweb_settings[studweb_hostname]
+    profile = all_host_profiles().get(studweb_hostname)
 
-    if not options:
-        raise Exception('No suitable page parser found.')
+    if not profile:
+        raise Exception('No suitable page parser found for %s. Describe the host in a file in %s'
+                        % (studweb_hostname, hosts_dir))
 
-    return PageParser(options['term_used_for_semester'], options['expand_link_text'])
+    return PageParser(profile)
 
 
 def modification_date(filename):
@@ -396,30 +2051,43 @@ def _print(s):
 
 
 def print_error(s):
-    sys.stderr.write((s + '\n').encode('utf-8'))
+    if sys.version_info < (3, 0, 0):
+        write = sys.stderr.write
+    else:
+        write = sys.stderr.buffer.write
+
+    write((s + '\n').encode('utf-8'))
     sys.stderr.flush()
 
 
-def read_config():
+def read_config(settings_file=settings_file):
     config = None
     if os.path.isfile(settings_file):
-        check_permissions()
+        check_permissions(settings_file)
+        config = read_settings(settings_file)
 
-        config = {}
-        fp = open(settings_file, 'r')
-        for l in fp.readlines():
-            if len(l.strip()) == 0: continue
+    return config
 
-            k, v = [s.strip() for s in l.split("=")]
-            config[k] = v
-        fp.close()
 
-    return config
+def read_settings(filename):
+    """Reads the `key = value` lines of a file, skipping blank lines and comments"""
+    settings = {}
+    fp = open(filename, 'r')
+    for l in fp.readlines():
+        if len(l.strip()) == 0: continue
+        if l.strip().startswith('#'): continue
+
+        k, v = [s.strip() for s in l.split("=", 1)]
+        settings[k] = v
+    fp.close()
+
+    return settings
 
 
 def write_example_config(include_mail_config):
     fp = open(settings_file, 'w')
     fp.write(example_config)
+    fp.write(example_session_config)
     if include_mail_config:
         fp.write(example_mail_config)
     fp.close()
@@ -431,23 +2099,64 @@ def write_example_config(include_mail_config):
     print("Change values as necessary")
 
 
-def send_mail(subject, body, config):
-    mailer = Mailer(config)
+def send_mail(subject, body, account):
+    """Puts the mail in the account's outbox and tries to deliver it right away
+
+    Mail that could not be delivered is retried by deliver_mail on later runs
+    """
+    import studweb_outbox
+
+    # exits if the mail settings are missing
+    Mailer(account.config)
+
+    _print(u"\nMailing results to " + account.config['to_addr'])
+    studweb_outbox.Outbox(account.outbox_dir).put(account.name, subject, body, account.config)
+    account.metrics.count('mails_queued')
+
+    if deliver_mail(account):
+        _print(u"\nMail sent successfully")
+    else:
+        _print(u"\nCould not send the mail. Will try again on the next run")
+
+
+def deliver_mail(account):
+    """Sends what is waiting in the outbox. Returns True if the outbox was emptied"""
+    import studweb_outbox
 
-    _print(u"\nMailing results to " + config['to_addr'])
-    mailer.send(subject, body)
-    _print(u"\nMail sent successfully")
+    outbox = studweb_outbox.Outbox(account.outbox_dir)
+    if outbox.is_empty():
+        return True
 
+    with account.metrics.timer('mail'):
+        sent = studweb_outbox.Sender(outbox).drain()
+    account.metrics.count('mails_sent', sent)
 
-def check_permissions():
+    return outbox.is_empty()
+
+
+def check_permissions(settings_file=settings_file):
     mode = os.stat(settings_file).st_mode
 
     if mode & stat.S_IROTH or mode & stat.S_IRGRP:
         print("The settings file should only be readable by the user!")
-        print("Use `chmod 400 ~/.studweb.conf` to make it private")
+        print("Use `chmod 400 " + settings_file + "` to make it private")
         sys.exit(1)
 
 
+def format_results(results):
+    """Lists the results, noting the previous grade of results in a ResultDiff that changed"""
+    if isinstance(results, ResultDiff):
+        lines = [r.asUnicode() for r in results.added]
+        lines += [new.asUnicode() + u" (was " + old.grade + u")" for old, new in results.changed]
+    else:
+        lines = [r.asUnicode() for r in results]
+
+    body = u""
+    for line in lines:
+        body += u"\n - " + line
+    return body
+
+
 if __name__ == '__main__':
 
     import argparse
@@ -459,9 +2168,51 @@ if __name__ == '__main__':
     argument_parser.add_argument("--quiet", help="Prevent output when there are no new results", action="store_true")
     argument_parser.add_argument("--config", help="Creates a default config file. Pass --mail to add email values",
                                  action="store_true")
+    argument_parser.add_argument("--html-parser", choices=['lxml', 'html.parser'],
+                                 help="The BeautifulSoup tree builder to use (default: lxml when installed)")
+    argument_parser.add_argument("--metrics", metavar="FILE",
+                                 help="Append timings and counters of the run to FILE as a line of JSON")
+    argument_parser.add_argument("--profile", metavar="FILE",
+                                 help="Profile the run with cProfile, writing the stats to FILE")
+    argument_parser.add_argument("--daemon", metavar="DIR",
+                                 help="Keep polling every account config (*.conf) found in DIR")
+    argument_parser.add_argument("--workers", type=int, default=8,
+                                 help="Number of accounts polled at the same time in daemon mode (default: 8)")
+    argument_parser.add_argument("--interval", type=int, default=30 * 60,
+                                 help="Seconds between the polls of each account in daemon mode (default: 1800)")
+    argument_parser.add_argument("--exam-windows", metavar="MM-DD:MM-DD,...", default="",
+                                 help="Periods when exam results are expected, e.g. 05-20:07-10,12-01:01-31")
+    argument_parser.add_argument("--exam-interval", type=int,
+                                 help="Seconds between the polls of each account inside the exam windows")
+    argument_parser.add_argument("--deadline", type=int, default=120,
+                                 help="Seconds a run, or a poll in daemon mode, may take talking to StudWeb (default: 120)")
+    argument_parser.add_argument("--low-memory", action="store_true",
+                                 help="Stream the results pages to disk and parse them from there (same as low_memory = yes)")
+    argument_parser.add_argument("--digest", action="store_true",
+                                 help="In daemon mode, mail the new results of accounts with the same address together")
+    argument_parser.add_argument("--api", metavar="PORT", type=int,
+                                 help="In daemon mode, serve the stored results as JSON on PORT on localhost")
+    argument_parser.add_argument("--shard", action="store_true",
+                                 help="In daemon mode, split the accounts with the other daemons polling DIR")
+    argument_parser.add_argument("--worker-id",
+                                 help="The name of this daemon among the ones sharing DIR (default: host-pid)")
     args = argument_parser.parse_args()
 
-    body = ""
+    if args.html_parser:
+        tree_builder = args.html_parser
+
+    if args.daemon:
+        import studweb_daemon
+
+        import studweb_scheduler
+
+        studweb_daemon.run(args.daemon, args.workers, args.interval, args.mail,
+                           html_parser=args.html_parser, metrics_file=args.metrics, digest=args.digest,
+                           exam_interval=args.exam_interval, deadline=args.deadline, low_memory=args.low_memory,
+                           api_port=args.api, shard=args.shard, worker_id=args.worker_id,
+                           exam_windows=studweb_scheduler.parse_exam_windows(args.exam_windows))
+        sys.exit(0)
+
     subject = None
     config = read_config()
 
@@ -474,25 +2225,61 @@ if __name__ == '__main__':
 
         sys.exit(1)
 
-    new = new_results(get_parser(config['studweb']))
+    if args.low_memory:
+        config['low_memory'] = 'yes'
 
-    if new:
-        subject = u"Found new results since last check!"
-        _print(subject)
+    account = Account(config)
+    account.deadline = Deadline(args.deadline)
 
-        for result in new:
-            result = result.asUnicode()
-            body += u"\n - " + result
+    # a run stuck on a StudWeb that does not answer should not have the next ones piling up behind it
+    lock = RunLock(account.lock_file)
+    if not lock.acquire():
+        if not args.quiet:
+            print_error("An earlier run is still checking for results. Exiting")
+        sys.exit(1)
+
+    profiler = None
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        with account.metrics.timer('total'):
+            try:
+                new = new_results(get_parser(config['studweb']), account)
+            except LoginError as e:
+                print_error("Caught error when trying to log in: \n" + str(e))
+                sys.exit(1)
+
+            if new:
+                subject = u"Found new results since last check!"
+                _print(subject)
 
-        _print(u"\nNew results:" + body)
+                body = format_results(new)
+                _print(u"\nNew results:" + body)
 
-        _print(u"\nStoring results ...")
-        store(latest_html)
+                _print(u"\nStoring results ...")
+                with account.metrics.timer('store'):
+                    store(account.latest_results, account)
+                    store_digest(account.latest_digest, account)
 
-        if args.mail:
-            send_mail(subject, body, config)
+                if args.mail:
+                    send_mail(subject, body, account)
 
-    elif not args.quiet:
-        _print(u"No new results since " + str(modification_date(data_file)))
+            else:
+                if args.mail:
+                    deliver_mail(account)
+                if not args.quiet:
+                    _print(u"No new results since " + str(modification_date(account.results_file)))
+    finally:
+        lock.release()
+        flush_failure_snapshots()
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.metrics:
+            account.metrics.write(args.metrics, account)
 
     sys.exit(0)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+# Read-only HTTP/JSON access to the stored results
+#
+# Dashboards and bots wanting the current grades of an account should not
+# have to log in to StudWeb. This serves the results stored by the last poll,
+# and never talks to StudWeb itself:
+#
+#   GET /accounts         - the names of the accounts
+#   GET /accounts/<name>  - the results of the account and when they last changed
+#   GET /metrics          - the counters and latencies of the polls made by this
+#                           process, in the Prometheus text format
+#
+# The JSON of an account is kept in memory until its results are stored
+# again, either by a poll in the same process or, seen from the modification
+# time of the results file, by another process. Every response has an ETag,
+# and a GET with a matching If-None-Match gets an empty 304 back.
+#
+#   python studweb_api.py --port 8080                     # the account in ~/.studweb.conf
+#   python studweb_api.py --daemon /path/to/accounts      # the accounts of the daemon
+#
+# The results are served to anyone who can connect, so by default only on localhost.
+##
+
+import os, sys, json, hashlib, datetime, threading, argparse
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import studweb
+
+
+class CachedResults:
+    """The JSON served for an account, and what it was made from"""
+
+    def __init__(self, stat_key, body):
+        self.stat_key = stat_key
+        self.body = body
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def stat_key(filename):
+    """What tells one version of the results file from another, or None if there is none"""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+class ResultsCache:
+    """The JSON of the stored results of each account, made once per change
+
+    Register invalidate() in studweb.results_stored to drop an account's JSON
+    as soon as a poll in the same process stores its results.
+    """
+
+    def __init__(self, accounts):
+        self.accounts = dict((a.name, a) for a in accounts)
+        self.entries = {}
+        self.lock = threading.Lock()
+        # counted to see how much reading the results files is saved
+        self.hits = 0
+        self.misses = 0
+
+    def names(self):
+        return sorted(self.accounts)
+
+    def get(self, name):
+        """The CachedResults of the account, or None if there is no such account"""
+        account = self.accounts.get(name)
+        if account is None:
+            return None
+
+        key = stat_key(account.results_file)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry.stat_key == key:
+                self.hits += 1
+                return entry
+
+        entry = CachedResults(key, results_json(account, key))
+        with self.lock:
+            self.misses += 1
+            self.entries[name] = entry
+        return entry
+
+    def invalidate(self, account):
+        with self.lock:
+            self.entries.pop(account.name, None)
+
+
+def results_json(account, key):
+    """The stored results of the account as UTF-8 JSON. No results if nothing has been stored yet"""
+    if key is None:
+        results, changed = studweb.ResultSet(), None
+    else:
+        results = studweb.load_results(account.results_file)
+        changed = datetime.datetime.fromtimestamp(key[0]).replace(microsecond=0).isoformat()
+
+    document = {
+        'account': account.name,
+        'host': account.hostname(),
+        'changed': changed,
+        'results': [r.asDict() for r in sorted(results, key=lambda r: r.key())],
+    }
+    return json.dumps(document, ensure_ascii=False, sort_keys=True).encode('utf8')
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Answers GETs from the ResultsCache of the server"""
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        cache = self.server.cache
+
+        if path == '/metrics':
+            return self.respond(200, studweb.registry.exposition().encode('utf8'),
+                                  content_type='text/plain; version=0.0.4; charset=utf-8')
+        elif path == '/accounts':
+            body = json.dumps({'accounts': cache.names()}).encode('utf8')
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        elif path.startswith('/accounts/'):
+            entry = cache.get(path[len('/accounts/'):])
+            if entry is None:
+                return self.respond(404, json.dumps({'error': 'No such account'}).encode('utf8'))
+            body, etag = entry.body, entry.etag
+        else:
+            return self.respond(404, json.dumps({'error': 'Not found'}).encode('utf8'))
+
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.respond(200, body, etag)
+
+    def do_HEAD(self):
+        self.respond(405, b'')
+
+    do_POST = do_PUT = do_DELETE = do_HEAD
+
+    def respond(self, status, body, etag=None, content_type='application/json; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if status == 405:
+            self.send_header('Allow', 'GET')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ApiServer(ThreadingMixIn, HTTPServer):
+    """Serves the ResultsCache. Results stored by this process are picked up at once"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cache):
+        HTTPServer.__init__(self, address, ApiHandler)
+        self.cache = cache
+        studweb.results_stored.append(cache.invalidate)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        if self.cache.invalidate in studweb.results_stored:
+            studweb.results_stored.remove(self.cache.invalidate)
+
+
+def serve(accounts, address=('127.0.0.1', 8080)):
+    """Starts serving the results of the accounts on a background thread. Returns the ApiServer
+
+    Call shutdown() and server_close() on the server to stop it
+    """
+    server = ApiServer(address, ResultsCache(accounts))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Serve the stored StudWeb results as JSON")
+    argument_parser.add_argument("--daemon", metavar="DIR",
+                                 help="Serve the accounts polled by the daemon in DIR instead of ~/.studweb.conf")
+    argument_parser.add_argument("--bind", default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    argument_parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    args = argument_parser.parse_args(argv)
+
+    if args.daemon:
+        import studweb_daemon
+        accounts = studweb_daemon.load_accounts(args.daemon)
+    else:
+        config = studweb.read_config()
+        accounts = [studweb.Account(config)] if config else []
+
+    if not accounts:
+        studweb.print_error("No accounts to serve the results of")
+        return 1
+
+    server = ApiServer((args.bind, args.port), ResultsCache(accounts))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv[1:]))
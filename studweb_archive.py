@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+#
+# History of the results of an account
+#
+# Every time studweb.py stores results, the set of results is added to the
+# account's archive, so you can later find out when a grade first showed up
+# or what changed between two dates. The archive is a directory with
+#
+#   objects/<sha1>.z - every distinct set of results, as zlib compressed JSON
+#                      named after the SHA-1 of the JSON. Going back to an
+#                      earlier set of results does not store it again.
+#   index            - one fixed size record per change: the time it was stored
+#                      and the SHA-1 of the results. Only ever appended to, and
+#                      read through mmap, so looking up a date is a binary search.
+#
+# Storing the same results twice in a row adds nothing, so the archive grows
+# with the number of changes rather than the number of polls.
+#
+#   python studweb_archive.py first-seen INF1000 A
+#   python studweb_archive.py changes --since 2014-06-01 --until 2014-07-01
+##
+
+import os, sys, json, stat, time, zlib, mmap, struct, hashlib, datetime, argparse
+from bisect import bisect_left
+
+import studweb
+
+# seconds since the epoch, and the SHA-1 of the results stored then
+record = struct.Struct('<d20s')
+
+
+class Index:
+    """The records of the index file, read through mmap
+
+    Indexing gives (time, sha1 hex digest) pairs, oldest first.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.map = None
+        self.length = 0
+
+        if os.path.isfile(filename) and os.path.getsize(filename) >= record.size:
+            f = open(filename, 'rb')
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+            # a record cut short by a crash is ignored
+            self.length = len(self.map) // record.size
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        stored, digest = record.unpack_from(self.map, i * record.size)
+        return stored, hexlify(digest)
+
+    def times(self):
+        return IndexTimes(self)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class IndexTimes:
+    """The times of the records in an Index, for bisect"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return record.unpack_from(self.index.map, i * record.size)[0]
+
+
+def hexlify(digest):
+    return ''.join('%02x' % c for c in bytearray(digest))
+
+
+class Archive:
+    """The results stored for one account over time"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.objects_directory = os.path.join(directory, 'objects')
+        self.index_file = os.path.join(directory, 'index')
+        self.__cache = {}
+
+    def add(self, results, now=None):
+        """Archives the results, unless they are the ones archived last. Returns their digest"""
+        data = studweb.serialized(results).encode('utf8')
+        digest = hashlib.sha1(data).hexdigest()
+
+        index = Index(self.index_file)
+        try:
+            if len(index) and index[-1][1] == digest:
+                return digest
+        finally:
+            index.close()
+
+        self.__make_directories()
+        object_file = self.__object_file(digest)
+        if not os.path.isfile(object_file):
+            tmp_file = object_file + '.tmp'
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+            f = os.fdopen(fd, 'wb')
+            f.write(zlib.compress(data, 9))
+            f.close()
+            os.rename(tmp_file, object_file)
+
+        # the object is in place before the record pointing to it
+        fd = os.open(self.index_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, stat.S_IRUSR | stat.S_IWUSR)
+        f = os.fdopen(fd, 'ab')
+        f.write(record.pack(now or time.time(), bytes(bytearray.fromhex(digest))))
+        f.close()
+
+        return digest
+
+    def results(self, digest):
+        """The ResultSet archived under the digest"""
+        if digest not in self.__cache:
+            f = open(self.__object_file(digest), 'rb')
+            data = zlib.decompress(f.read())
+            f.close()
+            self.__cache[digest] = studweb.results_from(json.loads(data.decode('utf8')))
+        return self.__cache[digest]
+
+    def snapshots(self, since=None, until=None):
+        """(time, ResultSet) of every change stored in [since, until), oldest first
+
+        since, until - seconds since the epoch. Unbounded if None
+        """
+        index = Index(self.index_file)
+        try:
+            times = index.times()
+            first = bisect_left(times, since) if since is not None else 0
+            last = bisect_left(times, until) if until is not None else len(index)
+            entries = [index[i] for i in range(first, last)]
+        finally:
+            index.close()
+
+        return [(stored, self.results(digest)) for stored, digest in entries]
+
+    def snapshot_before(self, when):
+        """The (time, ResultSet) stored last before `when`, or None"""
+        index = Index(self.index_file)
+        try:
+            i = bisect_left(index.times(), when)
+            entry = index[i - 1] if i else None
+        finally:
+            index.close()
+
+        if entry is None:
+            return None
+        return entry[0], self.results(entry[1])
+
+    def first_seen(self, code, grade=None):
+        """When a result for the subject (with the grade, if given) was first stored
+
+        Returns (time, SubjectResult), or None if it never was
+        """
+        for stored, results in self.snapshots():
+            for r in results:
+                if r.code == code and (grade is None or r.grade == grade):
+                    return stored, r
+        return None
+
+    def changes(self, since=None, until=None):
+        """(time, ResultDiff) for every change stored in [since, until), compared with the results before it"""
+        previous = self.snapshot_before(since) if since is not None else None
+        previous = previous[1] if previous else studweb.ResultSet()
+
+        changes = []
+        for stored, results in self.snapshots(since, until):
+            changes.append((stored, results.diff(previous)))
+            previous = results
+        return changes
+
+    def __make_directories(self):
+        for d in [self.directory, self.objects_directory]:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+                os.chmod(d, stat.S_IRWXU)
+
+    def __object_file(self, digest):
+        return os.path.join(self.objects_directory, digest + '.z')
+
+
+def parse_date(s):
+    return time.mktime(datetime.datetime.strptime(s, '%Y-%m-%d').timetuple())
+
+
+def format_time(t):
+    return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M')
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Look through the results archived by studweb.py")
+    argument_parser.add_argument("--archive", metavar="DIR", default=studweb.archive_dir,
+                                 help="The archive of the account (default: %s)" % studweb.archive_dir)
+    commands = argument_parser.add_subparsers(dest="command")
+
+    first_seen = commands.add_parser("first-seen", help="When a result for the subject first appeared")
+    first_seen.add_argument("code", help="The subject code, e.g. INF1000")
+    first_seen.add_argument("grade", nargs='?', help="Only count results with this grade")
+
+    changes = commands.add_parser("changes", help="List the changes to the results between two dates")
+    changes.add_argument("--since", metavar="YYYY-MM-DD", help="From the start of this day")
+    changes.add_argument("--until", metavar="YYYY-MM-DD", help="Up to the start of this day")
+
+    args = argument_parser.parse_args(argv)
+    archive = Archive(args.archive)
+
+    if args.command == "first-seen":
+        found = archive.first_seen(args.code, args.grade)
+        if not found:
+            studweb.print_error(u" ".join(filter(None, [args.code, args.grade])) + u" has not been seen")
+            return 1
+        studweb._print(u"%s %s" % (format_time(found[0]), found[1].asUnicode()))
+
+    elif args.command == "changes":
+        since = parse_date(args.since) if args.since else None
+        until = parse_date(args.until) if args.until else None
+        for stored, diff in archive.changes(since, until):
+            studweb._print(format_time(stored) + studweb.format_results(diff))
+            for r in diff.removed:
+                studweb._print(u" - " + r.asUnicode() + u" (removed)")
+
+    else:
+        argument_parser.print_help()
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv[1:]))
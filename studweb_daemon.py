@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#
+# Daemon mode for studweb.py: polls many accounts from one long-running process
+#
+# Every `*.conf` file in the account directory describes one account, using
+# the same format as ~/.studweb.conf. The results and error pages of an
+# account are kept next to its config file, e.g.
+#
+#   accounts/ola.conf
+#   accounts/ola.json
+#   accounts/ola.digest
+#   accounts/ola.archive/
+#   accounts/ola.failures/
+#
+# The accounts are polled on a bounded pool of worker threads, and all
+# accounts on the same StudWeb host share one connection pool, so TLS
+# connections are reused between polls instead of being set up per user.
+#
+# The links learned to lead to the results page of each host are shared by
+# all accounts too (accounts/navigation.json, see studweb.NavigationCache).
+#
+# Mail is put in the outbox shared by all accounts (accounts/outbox) and
+# delivered by a separate thread, so a slow SMTP server never holds up polling.
+#
+# When each account is polled is up to the Scheduler in studweb_scheduler.py.
+#
+# With --api PORT the stored results are also served as JSON on localhost,
+# see studweb_api.py. With --shard several daemons, on one or more machines,
+# can share the account directory and split the accounts between them, see
+# studweb_shard.py.
+##
+
+import os, sys, glob, time, threading
+from multiprocessing.pool import ThreadPool
+
+import studweb
+import studweb_outbox
+import studweb_scheduler
+
+
+class AdapterPool:
+    """Hands out one HTTP connection pool per StudWeb host
+
+    The cookies live in each account's own session, so sharing the
+    adapter does not leak logins between accounts.
+
+    buckets - TokenBuckets limiting the requests sent to each host
+    """
+
+    def __init__(self, pool_maxsize, buckets=None):
+        self.pool_maxsize = pool_maxsize
+        self.buckets = buckets or {}
+        self.adapters = {}
+        self.lock = threading.Lock()
+
+    def adapter_for(self, hostname):
+        from requests.adapters import HTTPAdapter
+
+        with self.lock:
+            if hostname not in self.adapters:
+                if hostname in self.buckets:
+                    adapter = studweb_scheduler.rate_limited_adapter(
+                        self.buckets[hostname], pool_connections=1, pool_maxsize=self.pool_maxsize)
+                else:
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                self.adapters[hostname] = adapter
+            return self.adapters[hostname]
+
+
+def load_accounts(directory):
+    """Returns an Account for every config file in the directory"""
+    accounts = []
+
+    for settings_file in sorted(glob.glob(os.path.join(directory, '*.conf'))):
+        name = os.path.splitext(os.path.basename(settings_file))[0]
+        base = os.path.join(directory, name)
+
+        config = studweb.read_config(settings_file)
+        if not config:
+            continue
+
+        accounts.append(studweb.Account(config, name=name,
+                                        settings_file=settings_file,
+                                        results_file=base + '.json',
+                                        data_file=base + '.dat',
+                                        failures_dir=base + '.failures',
+                                        session_file=base + '.session',
+                                        digest_file=base + '.digest',
+                                        archive_dir=base + '.archive',
+                                        lock_file=base + '.lock',
+                                        page_file=base + '.latest.html',
+                                        navigation_file=os.path.join(directory, 'navigation.json'),
+                                        outbox_dir=os.path.join(directory, 'outbox')))
+
+    return accounts
+
+
+# serializes the lines written to the metrics file by the worker threads
+metrics_lock = threading.Lock()
+
+polls = studweb.registry.counter('studweb_polls_total', 'Polls by the daemon, by how they ended', ['host', 'outcome'])
+
+
+def poll(account, mail, metrics_file=None, deadline=None, shard=None):
+    """Checks one account for new results. Returns whether the poll succeeded
+
+    deadline - seconds the poll may take talking to StudWeb
+    shard - renew the lease of the account right before polling it, as the
+            polls before it in the round may have taken longer than the lease.
+            Returns None without polling if another worker has taken it since
+    Never raises, as that would stop the other accounts
+    """
+    if shard and not shard.claim(account.name):
+        studweb.print_error(u"[%s] Skipped, as another worker has taken over the account" % account)
+        return None
+
+    lock = studweb.RunLock(account.lock_file)
+    if not lock.acquire():
+        studweb.print_error(u"[%s] Skipped, as the account is being checked by another process" % account)
+        return False
+
+    account.metrics = studweb.RunMetrics(account.hostname())
+    account.deadline = studweb.Deadline(deadline)
+    outcome = 'error'
+    try:
+        with account.metrics.timer('total'):
+            new = studweb.new_results(studweb.get_parser(account.hostname()), account)
+
+            if new:
+                body = studweb.format_results(new)
+                studweb._print(u"[%s] New results:%s" % (account, body))
+                with account.metrics.timer('store'):
+                    studweb.store(account.latest_results, account)
+                    studweb.store_digest(account.latest_digest, account)
+
+                if mail:
+                    outbox = studweb_outbox.Outbox(account.outbox_dir)
+                    outbox.put(account.name, u"Found new results since last check!", body, account.config)
+                    account.metrics.count('mails_queued')
+
+        outcome = 'new_results' if new else 'no_change'
+        return True
+    except studweb.LoginError as e:
+        outcome = 'login_refused'
+        studweb.print_error(u"[%s] Caught error when trying to log in: %s" % (account, e))
+    except Exception as e:
+        if isinstance(e, studweb.PageLayoutError):
+            outcome = 'layout_error'
+        studweb.print_error(u"[%s] Polling failed: %s" % (account, e))
+    finally:
+        polls.inc(host=account.hostname(), outcome=outcome)
+        lock.release()
+        if metrics_file:
+            with metrics_lock:
+                account.metrics.write(metrics_file, account)
+
+    return False
+
+
+def poll_all(pool, accounts, mail, metrics_file=None, deadline=None, shard=None):
+    return pool.map(lambda account: poll(account, mail, metrics_file, deadline, shard), accounts)
+
+
+def claim_due(shard, scheduler, due):
+    """The due accounts this worker gets to poll. The others are looked at again later
+
+    An account taken over from another worker is not polled before its interval
+    since that worker's last poll is up.
+    """
+    now = time.time()
+    claimed = []
+    for account in due:
+        if not shard.owns(account.name):
+            scheduler.postpone(account, shard.ttl / 3.0)
+            continue
+
+        worker, polled = shard.last_polled(account.name)
+        if worker != shard.worker_id and polled and polled + scheduler.current_interval(now) > now:
+            scheduler.postpone(account, polled + scheduler.current_interval(now) - now)
+        elif shard.claim(account.name):
+            claimed.append(account)
+        else:
+            # still held by the worker that had it before
+            scheduler.postpone(account, shard.ttl / 3.0)
+    return claimed
+
+
+def renew(shard, stopped):
+    """Keeps telling the other workers this one is alive, until stopped is set"""
+    while not stopped.wait(shard.ttl / 3.0):
+        try:
+            shard.heartbeat()
+        except (IOError, OSError) as e:
+            studweb.print_error(u"Could not renew the worker file of %s: %s" % (shard.worker_id, e))
+
+
+def run(directory, workers, interval, mail=False, rounds=None, html_parser=None, metrics_file=None,
+        digest=False, mail_interval=60, exam_interval=None, exam_windows=(), deadline=None, low_memory=False,
+        api_port=None, shard=False, worker_id=None):
+    """Polls all accounts in the directory about every `interval` seconds
+
+    rounds - stop after polling this many times. Polls forever if None
+    html_parser - the BeautifulSoup tree builder to use instead of the default
+    metrics_file - append the metrics of every poll to this file
+    digest - merge the new results of accounts mailing the same address into one mail
+    mail_interval - seconds between each delivery of the mail in the outbox
+    exam_interval - seconds between the polls of an account in the exam windows
+    exam_windows - (month, day) pairs of when exam results are expected, see studweb_scheduler
+    deadline - seconds each poll may take talking to StudWeb
+    low_memory - stream the results pages to disk (name.latest.html) instead of keeping them in memory
+    api_port - serve the stored results as JSON on this port on localhost, see studweb_api
+    shard - only poll the share of the accounts given to this worker, see studweb_shard
+    worker_id - the name of this worker among the others sharing the directory
+    """
+    if html_parser:
+        studweb.tree_builder = html_parser
+
+    accounts = load_accounts(directory)
+    if not accounts:
+        studweb.print_error("No account configs (*.conf) found in " + directory)
+        sys.exit(1)
+
+    if low_memory:
+        for account in accounts:
+            account.config['low_memory'] = 'yes'
+
+    adapters = AdapterPool(pool_maxsize=workers, buckets=studweb_scheduler.host_buckets())
+    for account in accounts:
+        account.adapter = adapters.adapter_for(account.hostname())
+
+    api = None
+    if api_port:
+        import studweb_api
+        api = studweb_api.serve(accounts, ('127.0.0.1', api_port))
+
+    sender = None
+    stopped = threading.Event()
+    if mail:
+        for account in accounts:
+            studweb.Mailer(account.config)  # exits if the mail settings are missing
+
+        sender = studweb_outbox.Sender(studweb_outbox.Outbox(os.path.join(directory, 'outbox')), digest=digest)
+        sender_thread = threading.Thread(target=sender.run, args=(mail_interval, stopped))
+        sender_thread.daemon = True
+        sender_thread.start()
+
+    if shard:
+        import studweb_shard
+
+        shard = studweb_shard.Shard(os.path.join(directory, 'shard'), worker_id)
+        shard.heartbeat()
+        heartbeat_thread = threading.Thread(target=renew, args=(shard, stopped))
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+    scheduler = studweb_scheduler.Scheduler(accounts, interval, exam_interval, exam_windows)
+    pool = ThreadPool(workers)
+    completed = 0
+
+    try:
+        while rounds is None or completed < rounds:
+            due = scheduler.due()
+            if due and shard:
+                due = claim_due(shard, scheduler, due)
+                if not due:
+                    continue
+            if not due:
+                time.sleep(scheduler.seconds_until_next())
+                continue
+
+            for account, succeeded in zip(due, poll_all(pool, due, mail, metrics_file, deadline, shard)):
+                if succeeded is None:
+                    # lost to another worker while waiting for its turn in the round
+                    scheduler.postpone(account, shard.ttl / 3.0)
+                    continue
+                scheduler.polled(account, succeeded)
+                if shard:
+                    shard.release(account.name, time.time())
+            completed += 1
+    finally:
+        pool.close()
+        pool.join()
+        studweb.flush_failure_snapshots()
+
+        if shard:
+            stopped.set()
+            heartbeat_thread.join()
+            shard.leave()
+
+        if api:
+            api.shutdown()
+            api.server_close()
+
+        if sender:
+            stopped.set()
+            sender_thread.join()
+            # deliver what was found in the last round
+            sender.drain()
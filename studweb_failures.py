@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# The pages StudWeb sent when polling an account failed
+#
+# Every page that could not be parsed is kept as a snapshot in the account's
+# failures directory (~/.studweb.failures, or name.failures/ in daemon mode):
+#
+#   <id>.html.gz - the page as StudWeb sent it, gzip compressed
+#   <id>.json    - when and where it failed: the step of the poll, the url
+#                  of the page, the host and its profile, and the error
+#
+# Only the latest snapshots are kept, up to max_snapshots of them and
+# max_bytes in all, so a layout change hitting every poll of many accounts
+# never fills the disk. The snapshots are written by a background thread,
+# so a poll never waits for the disk.
+#
+#   python studweb_failures.py list
+#   python studweb_failures.py extract --output ../test/testdata/failed 1402900000.000000-3f2a
+#
+# Extracted pages, or the .html.gz files themselves, can be run through the
+# parser with studweb_reparse.py.
+##
+
+import os, sys, gzip, json, stat, time, uuid, datetime, threading, argparse
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+import studweb
+
+dropped = studweb.registry.counter('studweb_failure_snapshots_dropped_total',
+                                   'Failure snapshots not kept, as too many were waiting to be written')
+
+
+class FailureSnapshots:
+    """The ring buffer of failure snapshots of one account, oldest first"""
+
+    def __init__(self, directory, max_snapshots=20, max_bytes=5 * 1024 * 1024):
+        self.directory = directory
+        self.max_snapshots = max_snapshots
+        self.max_bytes = max_bytes
+
+    def add(self, markup, metadata):
+        """Keeps the page (bytes) with its metadata, dropping the oldest snapshots beyond the bounds. Returns its id"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+            os.chmod(self.directory, stat.S_IRWXU)
+
+        snapshot_id = '%017.6f-%s' % (metadata.get('time') or time.time(), uuid.uuid4().hex[:8])
+        metadata = dict(metadata, id=snapshot_id, size=len(markup))
+
+        # the page is in place before the metadata listing it
+        page_file = self.__page_file(snapshot_id)
+        fd = os.open(page_file + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+        raw = os.fdopen(fd, 'wb')
+        f = gzip.GzipFile(fileobj=raw, mode='wb')
+        try:
+            f.write(markup)
+        finally:
+            f.close()
+            raw.close()
+        os.rename(page_file + '.tmp', page_file)
+
+        fd = os.open(self.__metadata_file(snapshot_id), os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                     stat.S_IRUSR | stat.S_IWUSR)
+        f = os.fdopen(fd, 'w')
+        f.write(json.dumps(metadata, sort_keys=True))
+        f.close()
+
+        self.prune()
+        return snapshot_id
+
+    def ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(n[:-len('.json')] for n in os.listdir(self.directory) if n.endswith('.json'))
+
+    def metadata(self, snapshot_id):
+        with open(self.__metadata_file(snapshot_id)) as f:
+            return json.load(f)
+
+    def snapshots(self):
+        """The metadata of every snapshot"""
+        return [self.metadata(i) for i in self.ids()]
+
+    def page(self, snapshot_id):
+        """The page of the snapshot, as bytes"""
+        f = gzip.open(self.__page_file(snapshot_id), 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def prune(self):
+        """Drops the oldest snapshots until there are no more than max_snapshots, taking no more than max_bytes"""
+        ids = self.ids()
+        sizes = dict((i, self.__size(i)) for i in ids)
+        total = sum(sizes.values())
+
+        # the newest is kept whatever its size
+        while len(ids) > 1 and (len(ids) > self.max_snapshots or total > self.max_bytes):
+            oldest = ids.pop(0)
+            total -= sizes[oldest]
+            for filename in [self.__metadata_file(oldest), self.__page_file(oldest)]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    def __size(self, snapshot_id):
+        size = 0
+        for filename in [self.__metadata_file(snapshot_id), self.__page_file(snapshot_id)]:
+            if os.path.exists(filename):
+                size += os.path.getsize(filename)
+        return size
+
+    def __page_file(self, snapshot_id):
+        return os.path.join(self.directory, snapshot_id + '.html.gz')
+
+    def __metadata_file(self, snapshot_id):
+        return os.path.join(self.directory, snapshot_id + '.json')
+
+
+class SnapshotWriter:
+    """Writes snapshots on a thread of its own
+
+    Snapshots coming faster than they can be written are dropped once
+    `backlog` are waiting, rather than holding up the polls.
+    """
+
+    def __init__(self, backlog=32):
+        self.queue = queue.Queue(backlog)
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def put(self, directory, markup, metadata):
+        """Queues the snapshot. Returns False if it had to be dropped"""
+        try:
+            self.queue.put_nowait((directory, markup, metadata))
+            return True
+        except queue.Full:
+            dropped.inc()
+            return False
+
+    def run(self):
+        while True:
+            directory, markup, metadata = self.queue.get()
+            try:
+                FailureSnapshots(directory).add(markup, metadata)
+            except Exception as e:
+                studweb.print_error(u"Could not save the failed page in %s: %s" % (directory, e))
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Waits for the queued snapshots to be written"""
+        self.queue.join()
+
+
+def format_time(t):
+    return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="List or extract the pages studweb.py failed on")
+    argument_parser.add_argument("--failures", metavar="DIR", default=studweb.failures_dir,
+                                 help="The failures directory of the account (default: %s)" % studweb.failures_dir)
+    commands = argument_parser.add_subparsers(dest="command")
+
+    commands.add_parser("list", help="List the snapshots, oldest first")
+
+    extract = commands.add_parser("extract", help="Write the pages of snapshots to files, to parse or add to testdata")
+    extract.add_argument("ids", nargs='*', metavar="ID", help="The snapshots to extract (default: all)")
+    extract.add_argument("--output", metavar="DIR", default='.', help="Where to write them (default: .)")
+
+    args = argument_parser.parse_args(argv)
+    snapshots = FailureSnapshots(args.failures)
+
+    if args.command == "list":
+        for m in snapshots.snapshots():
+            studweb._print(u"%s  %s  %-13s %s %s: %s" % (m['id'], format_time(m['time']), m.get('step') or u'-',
+                                                        m.get('host'), m.get('url') or u'-', m.get('error')))
+
+    elif args.command == "extract":
+        ids = args.ids or snapshots.ids()
+        unknown = [i for i in ids if i not in snapshots.ids()]
+        if unknown:
+            studweb.print_error(u"No such snapshot: " + u", ".join(unknown))
+            return 1
+
+        if not os.path.isdir(args.output):
+            os.makedirs(args.output)
+        for snapshot_id in ids:
+            filename = os.path.join(args.output, snapshot_id + '.html')
+            with open(filename, 'wb') as f:
+                f.write(snapshots.page(snapshot_id))
+            with open(os.path.join(args.output, snapshot_id + '.json'), 'w') as f:
+                f.write(json.dumps(snapshots.metadata(snapshot_id), indent=2, sort_keys=True))
+            studweb._print(u"Wrote " + filename)
+
+    else:
+        argument_parser.print_help()
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# Outbox for the mails sent by studweb.py
+#
+# Polling never talks to the SMTP server itself. It puts the mail in the
+# outbox, a directory with one JSON file per message, and a Sender delivers
+# what is waiting there. The sender logs in once per SMTP server and account
+# for all the mail it has for it, retries failed deliveries with exponential
+# backoff and can merge the mail going to the same address into a digest.
+#
+# The messages contain the SMTP password, so like the settings file the
+# outbox is only readable by the user.
+##
+
+import os, json, time, uuid, stat
+
+import studweb
+
+# the config values a message needs to be delivered
+mail_settings = ['smtp_server', 'smtp_username', 'smtp_password', 'from_addr', 'to_addr']
+
+
+class Outbox:
+    """A directory of messages waiting to be delivered
+
+    A message stays until it is delivered, however many attempts it takes,
+    as nobody is likely to notice mail with new results going missing.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            os.chmod(directory, stat.S_IRWXU)
+
+    def put(self, account_name, subject, body, config):
+        now = time.time()
+        message = {
+            'id': '%017.6f-%s' % (now, uuid.uuid4().hex),
+            'account': account_name,
+            'subject': subject,
+            'body': body,
+            'mail': dict((k, config.get(k)) for k in mail_settings),
+            'created': now,
+            'attempts': 0,
+            'next_attempt': now,
+            'last_error': None,
+        }
+        self.__write(message)
+        return message['id']
+
+    def messages(self):
+        """All waiting messages, oldest first"""
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith('.json'))
+        messages = []
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    messages.append(json.load(f))
+            except (IOError, OSError, ValueError):
+                # removed by someone else, or not written completely
+                continue
+        return messages
+
+    def due(self, now=None):
+        now = now or time.time()
+        return [m for m in self.messages() if m['next_attempt'] <= now]
+
+    def is_empty(self):
+        return not any(n.endswith('.json') for n in os.listdir(self.directory))
+
+    def remove(self, message):
+        try:
+            os.remove(self.__filename(message))
+        except OSError:
+            pass
+
+    def retry(self, message, error, backoff, max_attempts):
+        """Schedules the message for another attempt
+
+        The wait doubles with every attempt until max_attempts, and stays
+        at the longest wait from then on.
+        """
+        message['attempts'] += 1
+        message['last_error'] = str(error)
+        message['next_attempt'] = time.time() + backoff * 2 ** (min(message['attempts'], max_attempts) - 1)
+
+        if message['attempts'] == max_attempts:
+            studweb.print_error(u"Could not deliver the mail of %s after %d attempts (%s). Will keep trying every %d seconds"
+                                % (message['account'], max_attempts, error, backoff * 2 ** (max_attempts - 1)))
+        self.__write(message)
+
+    def __filename(self, message):
+        return os.path.join(self.directory, message['id'] + '.json')
+
+    def __write(self, message):
+        filename = self.__filename(message)
+        tmp_file = filename + '.tmp'
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+        f = os.fdopen(fd, 'w')
+        f.write(json.dumps(message))
+        f.close()
+        os.rename(tmp_file, filename)
+
+
+class Delivery:
+    """One mail to send, made from one or more messages in the outbox"""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.mail = messages[0]['mail']
+
+        if len(messages) == 1:
+            self.subject = messages[0]['subject']
+            self.body = messages[0]['body']
+        else:
+            self.subject = u"Found new results for %d accounts" % len(messages)
+            self.body = u"\n\n".join(u"[%s]%s" % (m['account'], m['body']) for m in messages)
+
+    def as_string(self):
+        return studweb.Mailer(self.mail).message(self.subject, self.body).as_string()
+
+
+def connection_key(mail):
+    return (mail['smtp_server'], mail['smtp_username'], mail['smtp_password'])
+
+
+def digest_key(mail):
+    return connection_key(mail) + (mail['from_addr'], mail['to_addr'])
+
+
+class Sender:
+    """Delivers the mail waiting in an outbox
+
+    smtp_class - makes the SMTP connections. Anything with the interface of smtplib.SMTP_SSL
+    digest - merge the messages going to the same address into one mail
+    backoff - seconds to wait before the first retry. Doubles with every attempt
+    """
+
+    def __init__(self, outbox, smtp_class=None, digest=False, backoff=60, max_attempts=8, timeout=10):
+        if smtp_class is None:
+            import smtplib
+            smtp_class = smtplib.SMTP_SSL
+
+        self.outbox = outbox
+        self.smtp_class = smtp_class
+        self.digest = digest
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+    def deliveries(self, messages):
+        if not self.digest:
+            return [Delivery([m]) for m in messages]
+
+        grouped = {}
+        order = []
+        for m in messages:
+            key = digest_key(m['mail'])
+            if key not in grouped:
+                grouped[key] = []
+                order.append(key)
+            grouped[key].append(m)
+        return [Delivery(grouped[key]) for key in order]
+
+    def drain(self):
+        """Tries to deliver all messages that are due. Returns the number of mails sent"""
+        by_connection = {}
+        order = []
+        for delivery in self.deliveries(self.outbox.due()):
+            key = connection_key(delivery.mail)
+            if key not in by_connection:
+                by_connection[key] = []
+                order.append(key)
+            by_connection[key].append(delivery)
+
+        return sum(self.send_all(by_connection[key]) for key in order)
+
+    def send_all(self, deliveries):
+        """Sends mails that use the same SMTP server and login over one connection"""
+        mail = deliveries[0].mail
+
+        try:
+            connection = self.smtp_class(mail['smtp_server'], timeout=self.timeout)
+            connection.login(mail['smtp_username'], mail['smtp_password'])
+        except Exception as e:
+            studweb.print_error(u"Could not connect to %s: %s" % (mail['smtp_server'], e))
+            studweb.mails.inc(len(deliveries), outcome='failed')
+            for delivery in deliveries:
+                self.failed(delivery, e)
+            return 0
+
+        sent = 0
+        try:
+            for delivery in deliveries:
+                try:
+                    connection.sendmail(delivery.mail['from_addr'], delivery.mail['to_addr'], delivery.as_string())
+                except Exception as e:
+                    studweb.print_error(u"Could not send mail to %s: %s" % (delivery.mail['to_addr'], e))
+                    studweb.mails.inc(outcome='failed')
+                    self.failed(delivery, e)
+                    continue
+
+                for m in delivery.messages:
+                    self.outbox.remove(m)
+                studweb.mails.inc(outcome='sent')
+                sent += 1
+        finally:
+            try:
+                connection.quit()
+            except Exception:
+                pass
+
+        return sent
+
+    def failed(self, delivery, error):
+        for m in delivery.messages:
+            self.outbox.retry(m, error, self.backoff, self.max_attempts)
+
+    def run(self, interval, stopped):
+        """Keeps draining the outbox every `interval` seconds until the `stopped` event is set"""
+        while not stopped.is_set():
+            try:
+                self.drain()
+            except Exception as e:
+                studweb.print_error(u"Delivering mail failed: %s" % e)
+            stopped.wait(interval)
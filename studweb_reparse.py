@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Re-parses saved StudWeb pages in bulk
+#
+# When the layout of StudWeb changes, or the parser is fixed, run the results
+# pages you have saved, and the pages studweb.py failed on (the .html.gz files
+# in ~/.studweb.failures, see studweb_failures.py), through the current parser
+# to see how it does:
+#
+#   python studweb_reparse.py ~/saved-pages ~/.studweb.failures > results.jsonl
+#
+# The files are parsed on a pool of processes, and a line of JSON is written
+# for every file as soon as it is done, with the results found or the error,
+# and the seconds spent parsing. A summary is printed to stderr at the end.
+#
+# Without --host, every host profile is tried until one of them can parse
+# the page, which is what tells UiO pages (Semester) from NTNU pages (Termin).
+##
+
+import os, sys, glob, gzip, json, time, codecs, argparse
+from multiprocessing import Pool
+
+import studweb
+
+
+def expand(paths):
+    """The HTML files in the given files, directories and glob patterns, in order and without duplicates"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for directory, dirnames, filenames in os.walk(path):
+                found += [os.path.join(directory, f) for f in filenames if f.endswith(('.html', '.htm', '.html.gz'))]
+            files += sorted(found)
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            files += sorted(glob.glob(path))
+
+    seen = set()
+    return [f for f in files if not (f in seen or seen.add(f))]
+
+
+def read_page(filename):
+    """The Document of a saved page
+
+    Error dumps used to be written as UTF-8 but keep the <meta> charset of the
+    page they came from, so markup that is valid UTF-8 is taken to be UTF-8.
+    Failure snapshots (.gz) are uncompressed.
+    """
+    with (gzip.open if filename.endswith('.gz') else open)(filename, 'rb') as f:
+        markup = f.read()
+
+    try:
+        markup.decode('utf-8')
+        return studweb.Document(markup, encoding='utf-8')
+    except UnicodeDecodeError:
+        return studweb.Document(markup)
+
+
+def init_worker(html_parser):
+    # saved pages come in all the layouts there have been, so a change is nothing to tell
+    studweb.report_layout_changes = False
+    if html_parser:
+        studweb.tree_builder = html_parser
+
+
+def parse_file(job):
+    """Parses one file with the first of the hosts that can. Returns the line of JSON to write, as a dict"""
+    filename, hosts = job
+    started = time.time()
+    line = {'file': filename}
+
+    try:
+        page = read_page(filename)
+        errors = []
+        for host in hosts:
+            try:
+                results = studweb.get_parser(host).parse_result_page_for_results(page)
+            except Exception as e:
+                errors.append(u"%s: %s" % (host, e))
+                continue
+            line['host'] = host
+            line['results'] = [r.asDict() for r in sorted(results, key=lambda r: r.key())]
+            break
+        else:
+            line['error'] = u'; '.join(errors)
+    except Exception as e:
+        line['error'] = u"%s" % e
+
+    line['seconds'] = time.time() - started
+    return line
+
+
+def reparse(files, hosts=None, workers=None, html_parser=None, chunksize=4):
+    """Yields the line of JSON of every file as a dict, in the order they are done"""
+    hosts = hosts or sorted(studweb.all_host_profiles())
+    pool = Pool(workers, initializer=init_worker, initargs=(html_parser,))
+    try:
+        for line in pool.imap_unordered(parse_file, [(f, hosts) for f in files], chunksize):
+            yield line
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Parse saved StudWeb results pages with the current parser")
+    argument_parser.add_argument("paths", nargs='+', metavar="PATH",
+                                 help="HTML files, directories of them, or glob patterns")
+    argument_parser.add_argument("--host", action="append",
+                                 help="Parse with the profile of this host. Tries every host profile if not given")
+    argument_parser.add_argument("--workers", type=int, help="Number of processes (default: one per CPU)")
+    argument_parser.add_argument("--html-parser", choices=['lxml', 'html.parser'],
+                                 help="The BeautifulSoup tree builder to use (default: lxml when installed)")
+    argument_parser.add_argument("--output", help="Write the JSON lines to this file instead of stdout")
+    args = argument_parser.parse_args(argv)
+
+    files = expand(args.paths)
+    if not files:
+        studweb.print_error("No HTML files found")
+        return 1
+
+    if args.output:
+        out = codecs.open(args.output, 'w', encoding='utf8')
+    else:
+        out = codecs.getwriter('utf8')(sys.stdout.buffer if hasattr(sys.stdout, 'buffer') else sys.stdout)
+
+    started = time.time()
+    parsed = failed = results = 0
+    parse_seconds = 0.0
+    try:
+        for line in reparse(files, args.host, args.workers, args.html_parser):
+            out.write(json.dumps(line, ensure_ascii=False, sort_keys=True) + u'\n')
+            parse_seconds += line['seconds']
+            if 'error' in line:
+                failed += 1
+                studweb.print_error(u"Failed parsing %s: %s" % (line['file'], line['error']))
+            else:
+                parsed += 1
+                results += len(line['results'])
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+
+    elapsed = time.time() - started
+    studweb.print_error(u"Parsed %d of %d files (%d failed, %d results) in %.2f seconds, %.2f seconds of parsing"
+                        % (parsed, len(files), failed, results, elapsed, parse_seconds))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Scheduling of the polls made by the studweb.py daemon
+#
+# Instead of polling every account at the same fixed times, like a cron line
+# would, the Scheduler spreads the polls out with some random jitter, backs off
+# exponentially from accounts that fail to log in or parse, and polls more
+# often in the weeks exam results are expected.
+#
+# On top of that a TokenBucket per StudWeb host limits the requests all
+# accounts together send to that host, using the `requests_per_minute` of the
+# host's HostProfile.
+##
+
+import time, random, threading
+
+import studweb
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, and bursts of up to `capacity` requests"""
+
+    def __init__(self, rate, capacity, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def __refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Takes a token if there is one. Returns the seconds to wait for one otherwise"""
+        with self.lock:
+            self.__refill(self.clock())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        """Blocks until a token is available. Returns the seconds waited
+
+        timeout - the longest to wait. Raises studweb.DeadlineExceeded rather than waiting any longer
+        """
+        waited = 0
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                raise studweb.DeadlineExceeded("Would have to wait %.1f seconds for a request to be allowed"
+                                               % (waited + wait))
+            self.sleep(wait)
+            waited += wait
+
+
+def host_buckets(settings=None):
+    """A TokenBucket for every StudWeb host with a request budget"""
+    if settings is None:
+        settings = dict((host, profile.options) for host, profile in studweb.all_host_profiles().items())
+    buckets = {}
+    for host, options in settings.items():
+        per_minute = options.get('requests_per_minute')
+        if per_minute:
+            # allow one poll (a handful of requests) to go through without waiting
+            buckets[host] = TokenBucket(per_minute / 60.0, capacity=max(5, per_minute / 10))
+    return buckets
+
+
+def rate_limited_adapter(bucket, **kwargs):
+    """An HTTPAdapter that takes a token from the bucket before every request
+
+    The time waited for the token comes out of the timeout of the request,
+    which is its share of the run's Deadline, so a rate limited poll does
+    not run past its time.
+    """
+    from requests.adapters import HTTPAdapter
+
+    class RateLimitedAdapter(HTTPAdapter):
+        def send(self, request, **send_kwargs):
+            timeout = send_kwargs.get('timeout')
+            if not isinstance(timeout, (int, float)):
+                # no timeout, or one for connecting and one for reading
+                timeout = None
+
+            waited = bucket.acquire(timeout)
+            if waited and timeout is not None:
+                send_kwargs['timeout'] = timeout - waited
+            return HTTPAdapter.send(self, request, **send_kwargs)
+
+    return RateLimitedAdapter(**kwargs)
+
+
+def parse_exam_windows(text):
+    """Parses windows like `05-20:07-10, 12-01:01-31` into ((5, 20), (7, 10)) pairs
+
+    A window may wrap around new year.
+    """
+    windows = []
+    for window in text.split(','):
+        if not window.strip():
+            continue
+        start, end = window.strip().split(':')
+        windows.append((tuple(int(p) for p in start.split('-')),
+                        tuple(int(p) for p in end.split('-'))))
+    return windows
+
+
+def in_exam_window(windows, now):
+    t = time.localtime(now)
+    day = (t.tm_mon, t.tm_mday)
+    for start, end in windows:
+        if start <= end:
+            if start <= day <= end:
+                return True
+        elif day >= start or day <= end:
+            return True
+    return False
+
+
+class Scheduler:
+    """Decides when each account is polled next
+
+    interval - seconds between polls of an account
+    exam_interval - seconds between polls inside the exam windows
+    jitter - fraction of the interval the polls are randomly moved by
+    max_backoff - the most seconds to wait after repeated failures
+    """
+
+    def __init__(self, accounts, interval, exam_interval=None, exam_windows=(),
+                 jitter=0.1, max_backoff=24 * 60 * 60, clock=time.time, rand=random.random):
+        self.interval = interval
+        self.exam_interval = exam_interval or interval
+        self.exam_windows = exam_windows
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.rand = rand
+        self.failures = {}
+        self.next_poll = {}
+        self.lock = threading.Lock()
+
+        # spread the first polls over the first interval, instead of all at once
+        now = clock()
+        for account in accounts:
+            self.failures[account.name] = 0
+            self.next_poll[account.name] = now + rand() * self.current_interval(now)
+        self.accounts = dict((a.name, a) for a in accounts)
+
+    def current_interval(self, now):
+        if in_exam_window(self.exam_windows, now):
+            return self.exam_interval
+        return self.interval
+
+    def due(self, now=None):
+        """The accounts that should be polled now"""
+        now = now or self.clock()
+        with self.lock:
+            names = sorted((t, name) for name, t in self.next_poll.items() if t <= now)
+        return [self.accounts[name] for t, name in names]
+
+    def seconds_until_next(self, now=None):
+        now = now or self.clock()
+        with self.lock:
+            return max(0, min(self.next_poll.values()) - now)
+
+    def polled(self, account, succeeded, now=None):
+        """Schedules the next poll of the account, backing off after failures"""
+        now = now or self.clock()
+        with self.lock:
+            if succeeded:
+                self.failures[account.name] = 0
+                delay = self.current_interval(now)
+            else:
+                self.failures[account.name] += 1
+                delay = min(self.max_backoff, self.current_interval(now) * 2 ** self.failures[account.name])
+
+            delay *= 1 + self.jitter * (2 * self.rand() - 1)
+            self.next_poll[account.name] = now + delay
+            return delay
+
+    def postpone(self, account, delay, now=None):
+        """Looks at the account again in `delay` seconds, without counting it as polled"""
+        now = now or self.clock()
+        with self.lock:
+            self.next_poll[account.name] = now + delay
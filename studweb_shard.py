@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Splitting the accounts of the daemon between several worker processes or machines
+#
+# Every worker runs `studweb.py --daemon DIR --shard` on the same (shared)
+# account directory, and they coordinate through files in DIR/shard:
+#
+#   workers/<worker>.json - renewed by every live worker every ttl / 3 seconds
+#   leases/<account>.json - held by the worker polling the account
+#
+# The accounts are spread over the live workers by consistent hashing, so
+# when a worker joins or stops renewing its file only the accounts hashed
+# to it move. Ring views can briefly differ between workers, which is what
+# the lease of each account is for: it is only taken by creating the lease
+# file, or by moving an expired one out of the way, so two workers never
+# poll the same account at the same time. A lease is also where the time
+# of the last poll is kept, so the worker taking over an account does not
+# poll it again before the interval is up.
+##
+
+import os, json, time, errno, socket, hashlib, threading
+from bisect import bisect
+
+import studweb
+
+
+class HashRing:
+    """Maps keys to workers, moving few keys when workers come and go
+
+    replicas - points on the ring per worker, evening out the share of each
+    """
+
+    def __init__(self, workers, replicas=100):
+        points = []
+        for worker in workers:
+            for i in range(replicas):
+                points.append((ring_position(u'%s#%d' % (worker, i)), worker))
+        points.sort()
+        self.positions = [p for p, w in points]
+        self.workers = [w for p, w in points]
+
+    def owner(self, key):
+        """The worker of the key, or None if there are no workers"""
+        if not self.positions:
+            return None
+        i = bisect(self.positions, ring_position(key)) % len(self.positions)
+        return self.workers[i]
+
+
+def ring_position(key):
+    return int(hashlib.md5(key.encode('utf8')).hexdigest()[:16], 16)
+
+
+def default_worker_id():
+    return u'%s-%d' % (socket.gethostname(), os.getpid())
+
+
+class Shard:
+    """The share of the accounts polled by one worker
+
+    directory - shared by all the workers
+    ttl - seconds a worker is taken to be alive after renewing its file, and
+          that a lease is held for. Must be longer than a poll may take
+    """
+
+    def __init__(self, directory, worker_id=None, ttl=300, clock=time.time):
+        self.directory = directory
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self.clock = clock
+        self.workers_directory = os.path.join(directory, 'workers')
+        self.leases_directory = os.path.join(directory, 'leases')
+        self.ring = None
+        self.ring_workers = None
+
+        for d in [self.workers_directory, self.leases_directory]:
+            if not os.path.isdir(d):
+                try:
+                    os.makedirs(d)
+                except OSError as e:
+                    # made by another worker starting at the same time
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    def heartbeat(self):
+        """Tells the other workers this one is alive for another ttl seconds"""
+        write_json(self.__worker_file(self.worker_id), {'worker': self.worker_id, 'expires': self.clock() + self.ttl})
+
+    def leave(self):
+        """Hands the accounts of this worker to the others at once, instead of once the ttl has passed"""
+        remove(self.__worker_file(self.worker_id))
+        for name in os.listdir(self.leases_directory):
+            if name.endswith('.json'):
+                lease = read_json(os.path.join(self.leases_directory, name))
+                if lease and lease['worker'] == self.worker_id and lease['expires'] > self.clock():
+                    self.release(name[:-len('.json')])
+
+    def live_workers(self):
+        now = self.clock()
+        workers = set([self.worker_id])
+        for name in os.listdir(self.workers_directory):
+            if name.endswith('.json'):
+                worker = read_json(os.path.join(self.workers_directory, name))
+                if worker and worker['expires'] > now:
+                    workers.add(worker['worker'])
+        return sorted(workers)
+
+    def owns(self, account_name):
+        """Whether the account is hashed to this worker, as far as it knows who is alive"""
+        workers = self.live_workers()
+        if workers != self.ring_workers:
+            if self.ring_workers is not None:
+                studweb.print_error(u"[%s] Sharing the accounts with %s" % (self.worker_id, u", ".join(workers)))
+            self.ring = HashRing(workers)
+            self.ring_workers = workers
+        return self.ring.owner(account_name) == self.worker_id
+
+    def claim(self, account_name):
+        """Takes the lease of the account for ttl seconds. Returns whether this worker now holds it"""
+        filename = self.__lease_file(account_name)
+
+        for attempt in range(3):
+            held = read_json(filename)
+            if held is None:
+                if create_json(filename, self.__lease(None)):
+                    return True
+                continue
+
+            if held['expires'] > self.clock():
+                if held['worker'] != self.worker_id:
+                    return False
+                write_json(filename, self.__lease(held.get('polled')))
+                return True
+
+            # expired: move it out of the way. Only one of the workers trying gets to
+            moved = filename + '.' + safe_name(self.worker_id)
+            try:
+                os.rename(filename, moved)
+            except OSError:
+                continue
+            taken = read_json(moved) or {}
+            if taken.get('expires', 0) > self.clock() and taken.get('worker') != self.worker_id:
+                # taken by another worker since it was read, so put it back
+                try:
+                    os.link(moved, filename)
+                except OSError:
+                    pass
+                remove(moved)
+                return False
+            remove(moved)
+
+            if create_json(filename, self.__lease(taken.get('polled'))):
+                return True
+
+        return False
+
+    def release(self, account_name, polled=None):
+        """Gives up the lease, noting when the account was polled"""
+        filename = self.__lease_file(account_name)
+        held = read_json(filename)
+        if held and held['worker'] == self.worker_id:
+            write_json(filename, {'worker': self.worker_id, 'expires': 0, 'polled': polled or held.get('polled')})
+
+    def last_polled(self, account_name):
+        """(worker, time) of the last poll of the account by any worker, or (None, None)"""
+        lease = read_json(self.__lease_file(account_name)) or {}
+        if not lease.get('polled'):
+            return None, None
+        return lease['worker'], lease['polled']
+
+    def __lease(self, polled):
+        return {'worker': self.worker_id, 'expires': self.clock() + self.ttl, 'polled': polled}
+
+    def __worker_file(self, worker_id):
+        return os.path.join(self.workers_directory, safe_name(worker_id) + '.json')
+
+    def __lease_file(self, account_name):
+        return os.path.join(self.leases_directory, safe_name(account_name) + '.json')
+
+
+def safe_name(name):
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+
+def read_json(filename):
+    """The JSON in the file, or None if it is missing or being written"""
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json(filename, value):
+    """Replaces the file atomically, so it can be read at any time"""
+    tmp_file = '%s.%d-%d.tmp' % (filename, os.getpid(), threading.current_thread().ident)
+    with open(tmp_file, 'w') as f:
+        json.dump(value, f)
+    os.rename(tmp_file, filename)
+
+
+def create_json(filename, value):
+    """Writes the file, unless it exists. Returns whether it was written"""
+    tmp_file = '%s.%d-%d.tmp' % (filename, os.getpid(), threading.current_thread().ident)
+    with open(tmp_file, 'w') as f:
+        json.dump(value, f)
+    try:
+        # the whole file appears at once, and only if there is none already
+        os.link(tmp_file, filename)
+        return True
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        return False
+    finally:
+        remove(tmp_file)
+
+
+def remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for serving the stored results as JSON, and the metrics
+################################################################################
+import unittest, os, shutil, tempfile
+import requests
+import studweb
+import studweb_api
+
+
+class TestResultsApi(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.account = self.account_named('ola')
+        self.server = studweb_api.serve([self.account, self.account_named('kari')], ('127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def account_named(self, name):
+        return studweb.Account({'studweb': 'studweb.uio.no'}, name=name,
+                               results_file=os.path.join(self.dir, name + '.json'), archive_dir=None)
+
+    def results(self, *grades):
+        return studweb.ResultSet(studweb.SubjectResult(u'INF100%d' % i, u'Programmering', g, u'Vår 2014')
+                                 for i, g in enumerate(grades))
+
+    def test_lists_accounts(self):
+        self.assertEqual(requests.get(self.url + '/accounts').json(), {'accounts': ['kari', 'ola']})
+
+    def test_serves_stored_results(self):
+        studweb.store(self.results(u'A', u'Bestått'), self.account)
+
+        response = requests.get(self.url + '/accounts/ola')
+
+        self.assertEqual(response.status_code, 200)
+        document = response.json()
+        self.assertEqual(document['account'], 'ola')
+        self.assertEqual(document['host'], 'studweb.uio.no')
+        self.assertEqual([r['grade'] for r in document['results']], [u'A', u'Bestått'])
+        self.assertTrue(document['changed'])
+
+    def test_no_results_before_the_first_poll(self):
+        document = requests.get(self.url + '/accounts/kari').json()
+
+        self.assertEqual(document['results'], [])
+        self.assertEqual(document['changed'], None)
+
+    def test_unknown_account(self):
+        self.assertEqual(requests.get(self.url + '/accounts/per').status_code, 404)
+
+    def test_is_read_only(self):
+        self.assertEqual(requests.post(self.url + '/accounts/ola').status_code, 405)
+
+    def test_not_modified_when_etag_matches(self):
+        studweb.store(self.results(u'A'), self.account)
+        etag = requests.get(self.url + '/accounts/ola').headers['ETag']
+
+        response = requests.get(self.url + '/accounts/ola', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_new_etag_once_new_results_are_stored(self):
+        studweb.store(self.results(u'A'), self.account)
+        etag = requests.get(self.url + '/accounts/ola').headers['ETag']
+
+        studweb.store(self.results(u'A', u'C'), self.account)
+        response = requests.get(self.url + '/accounts/ola', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_results_file_is_read_once_per_change(self):
+        studweb.store(self.results(u'A'), self.account)
+        cache = self.server.cache
+
+        for i in range(3):
+            cache.get('ola')
+        self.assertEqual((cache.misses, cache.hits), (1, 2))
+
+        studweb.store(self.results(u'B'), self.account)
+        self.assertEqual(cache.get('ola').body, studweb_api.results_json(
+            self.account, studweb_api.stat_key(self.account.results_file)))
+        self.assertEqual(cache.misses, 2)
+
+    def test_picks_up_results_stored_by_another_process(self):
+        studweb.store(self.results(u'A'), self.account)
+        self.server.cache.get('ola')
+
+        # written without going through the listeners of this process
+        with open(self.account.results_file, 'w') as f:
+            f.write(studweb.serialized(self.results(u'B', u'C')))
+
+        self.assertEqual(len(requests.get(self.url + '/accounts/ola').json()['results']), 2)
+
+    def test_serves_metrics_in_text_format(self):
+        studweb.logins.inc(host='studweb.uio.no')
+
+        response = requests.get(self.url + '/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertTrue('# TYPE studweb_logins_total counter' in response.text)
+        self.assertTrue('studweb_logins_total{host="studweb.uio.no"}' in response.text)
+
+    def test_stops_listening_for_stored_results_once_closed(self):
+        server = studweb_api.ApiServer(('127.0.0.1', 0), studweb_api.ResultsCache([]))
+        self.assertTrue(server.cache.invalidate in studweb.results_stored)
+
+        server.server_close()
+
+        self.assertFalse(server.cache.invalidate in studweb.results_stored)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
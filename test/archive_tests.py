@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the archive of the results stored over time
+################################################################################
+import unittest, os, shutil, tempfile
+import studweb
+import studweb_archive
+
+day = 24 * 60 * 60
+
+
+def results(*grades):
+    return studweb.ResultSet(studweb.SubjectResult(code, u'Emne ' + code, grade, u'Vår 2014')
+                             for code, grade in grades)
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.archive = studweb_archive.Archive(os.path.join(self.dir, 'archive'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def objects(self):
+        return os.listdir(self.archive.objects_directory)
+
+    def test_unchanged_results_are_not_archived_again(self):
+        self.archive.add(results(('INF1000', 'B')), now=1 * day)
+        self.archive.add(results(('INF1000', 'B')), now=2 * day)
+
+        self.assertEqual(len(self.archive.snapshots()), 1)
+        self.assertEqual(os.path.getsize(self.archive.index_file), studweb_archive.record.size)
+
+    def test_results_seen_before_are_stored_once(self):
+        self.archive.add(results(('INF1000', 'B')), now=1 * day)
+        self.archive.add(results(('INF1000', 'A')), now=2 * day)
+        self.archive.add(results(('INF1000', 'B')), now=3 * day)
+
+        self.assertEqual(len(self.archive.snapshots()), 3)
+        self.assertEqual(len(self.objects()), 2)
+
+    def test_snapshots_read_back(self):
+        stored = results(('INF1000', 'B'), ('MAT1100', 'C'))
+        self.archive.add(stored, now=1 * day)
+
+        self.assertEqual(self.archive.snapshots(), [(1 * day, stored)])
+
+    def test_first_seen(self):
+        self.archive.add(results(('INF1000', 'F')), now=1 * day)
+        self.archive.add(results(('INF1000', 'F'), ('MAT1100', 'C')), now=2 * day)
+        self.archive.add(results(('INF1000', 'B'), ('MAT1100', 'C')), now=3 * day)
+
+        self.assertEqual(self.archive.first_seen('INF1000')[0], 1 * day)
+        self.assertEqual(self.archive.first_seen('INF1000', 'B')[0], 3 * day)
+        self.assertEqual(self.archive.first_seen('MAT1100')[1].grade, 'C')
+        self.assertEqual(self.archive.first_seen('INF1000', 'A'), None)
+
+    def test_changes_between_dates(self):
+        self.archive.add(results(('INF1000', 'F')), now=1 * day)
+        self.archive.add(results(('INF1000', 'F'), ('MAT1100', 'C')), now=2 * day)
+        self.archive.add(results(('INF1000', 'B'), ('MAT1100', 'C')), now=3 * day)
+        self.archive.add(results(('INF1000', 'B')), now=4 * day)
+
+        changes = self.archive.changes(since=2 * day, until=4 * day)
+
+        self.assertEqual([t for t, diff in changes], [2 * day, 3 * day])
+        self.assertEqual([r.code for r in changes[0][1].added], ['MAT1100'])
+        self.assertEqual([(old.grade, new.grade) for old, new in changes[1][1].changed], [('F', 'B')])
+        self.assertEqual([r.code for r in self.archive.changes(since=4 * day)[0][1].removed], ['MAT1100'])
+
+    def test_empty_archive(self):
+        self.assertEqual(self.archive.snapshots(), [])
+        self.assertEqual(self.archive.changes(since=1 * day), [])
+        self.assertEqual(self.archive.first_seen('INF1000'), None)
+
+    def test_store_adds_to_the_account_archive(self):
+        account = studweb.Account({'studweb': 'studweb.uio.no'},
+                                  results_file=os.path.join(self.dir, 'results.json'),
+                                  archive_dir=self.archive.directory)
+
+        studweb.store(results(('INF1000', 'B')), account)
+
+        self.assertEqual(self.archive.snapshots()[0][1], results(('INF1000', 'B')))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
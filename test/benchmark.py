@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Benchmarks for the PageParser methods, using the pages in testdata
+#
+# Times and memory profiles every parser method on the UiO and NTNU pages,
+# and the results page parsers on larger results pages made by
+# transcript_generator.py to show how they scale with the number of rows.
+# The memory used by the results page parsers is also measured with the page
+# kept in memory and with the page read from a file, as in low memory mode.
+# Prints the measurements as JSON, so runs of different versions can be compared.
+#
+#   PYTHONPATH=.. python benchmark.py --rows 1000 5000 > bench.json
+################################################################################
+import os, sys, time, json, codecs, tempfile, argparse, platform
+import studweb
+import transcript_generator
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+fixtures = {
+    'UIO_2014': 'studweb.uio.no',
+    'NTNU_2014': 'studweb.ntnu.no',
+}
+
+login_page = 'StudentWeb.html'
+start_page = 'Startside Opplysninger.html'
+results_page = 'Innsyn Vurderingsresultater.html'
+
+# the methods to benchmark, and the page each one is given
+parser_methods = [
+    ('parse_login_page_for_form_values', login_page),
+    ('parse_login_page_for_path_to_form_handler', login_page),
+    ('parse_start_page_for_link_url_to_expand_link_section', start_page),
+    ('parse_page_with_expanded_link_section_for_results_url', start_page),
+    ('parse_page_with_expanded_link_section_for_logout_url', results_page),
+    ('parse_result_page_for_results', results_page),
+    ('parse_result_page_streaming', results_page),
+    ('parse_result_page_with_soup', results_page),
+]
+
+# the results parsers measured on enlarged results pages
+scaling_methods = ['parse_result_page_streaming', 'parse_result_page_with_soup']
+
+
+def read_page(directory, page):
+    with open('testdata/' + directory + '/' + page, 'rb') as f:
+        return studweb.Document(f.read()).text()
+
+
+def measure(fn, repeat):
+    """Runs fn `repeat` times, returning the timings and the peak memory allocated by one run"""
+    timings = []
+    for i in range(repeat):
+        started = time.time()
+        fn()
+        timings.append(time.time() - started)
+
+    peak = None
+    if tracemalloc:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'seconds_min': min(timings),
+        'seconds_mean': sum(timings) / len(timings),
+        'peak_bytes': peak,
+        'repeat': repeat,
+    }
+
+
+def call(parser, method, html):
+    # a fresh Document every time, so the cost of parsing the page is included
+    return lambda: getattr(parser, method)(studweb.Document(html))
+
+
+def benchmark_fixtures(repeat):
+    measurements = {}
+    for directory, host in sorted(fixtures.items()):
+        parser = studweb.get_parser(host)
+        measurements[directory] = dict(
+            (method, measure(call(parser, method, read_page(directory, page)), repeat))
+            for method, page in parser_methods)
+    return measurements
+
+
+def benchmark_scaling(row_counts, repeat):
+    measurements = []
+    for directory, host in sorted(fixtures.items()):
+        parser = studweb.get_parser(host)
+
+        for rows in row_counts:
+            enlarged = transcript_generator.generate_results_page(directory, rows)[0]
+            for method in scaling_methods:
+                m = measure(call(parser, method, enlarged), repeat)
+                m.update({'fixture': directory, 'rows': rows, 'method': method, 'bytes': len(enlarged)})
+                measurements.append(m)
+    return measurements
+
+
+def benchmark_low_memory(row_counts, repeat):
+    """The peak memory of parsing the enlarged results pages from memory and from a file"""
+    measurements = []
+    for directory, host in sorted(fixtures.items()):
+        parser = studweb.get_parser(host)
+
+        for rows in row_counts:
+            markup = transcript_generator.generate_results_page(directory, rows)[0].encode('utf-8')
+            fd, filename = tempfile.mkstemp(suffix='.html')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(markup)
+
+                for mode, page in [('memory', lambda: studweb.Document(markup, encoding='utf-8')),
+                                   ('file', lambda: studweb.FileDocument(filename, encoding='utf-8'))]:
+                    m = measure(lambda: parser.parse_result_page_for_results(page()), repeat)
+                    m.update({'fixture': directory, 'rows': rows, 'page': mode, 'bytes': len(markup)})
+                    measurements.append(m)
+            finally:
+                os.remove(filename)
+    return measurements
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Benchmark the StudWeb page parsers")
+    argument_parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (default: 5)")
+    argument_parser.add_argument("--rows", type=int, nargs='*', default=[100, 1000, 5000],
+                                 help="Sizes of the enlarged results pages (default: 100 1000 5000)")
+    argument_parser.add_argument("--output", help="Write the JSON to this file instead of stdout")
+    args = argument_parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'tree_builder': studweb.tree_builder or studweb.best_tree_builder(),
+        'time': time.time(),
+        'fixtures': benchmark_fixtures(args.repeat),
+        'scaling': benchmark_scaling(args.rows, args.repeat),
+        'low_memory': benchmark_low_memory(args.rows, args.repeat),
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with codecs.open(args.output, 'w', encoding='utf8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
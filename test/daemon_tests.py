@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the daemon mode of studweb
+################################################################################
+import unittest, os, stat, shutil, tempfile
+import studweb_daemon
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_config(self, name, host):
+        settings_file = os.path.join(self.dir, name + '.conf')
+        with open(settings_file, 'w') as f:
+            f.write("ssn = 12345678901\npin = 1234\nstudweb = %s\n" % host)
+        os.chmod(settings_file, stat.S_IRUSR | stat.S_IWUSR)
+
+    def test_loads_one_account_per_config_file(self):
+        self.write_config('ola', 'studweb.uio.no')
+        self.write_config('kari', 'studweb.ntnu.no')
+
+        accounts = studweb_daemon.load_accounts(self.dir)
+
+        self.assertEqual([a.name for a in accounts], ['kari', 'ola'])
+        self.assertEqual(accounts[1].hostname(), 'studweb.uio.no')
+        self.assertEqual(accounts[1].results_file, os.path.join(self.dir, 'ola.json'))
+        self.assertEqual(accounts[1].failures_dir, os.path.join(self.dir, 'ola.failures'))
+
+    def test_accounts_on_same_host_share_connection_pool(self):
+        adapters = studweb_daemon.AdapterPool(pool_maxsize=4)
+
+        uio = adapters.adapter_for('studweb.uio.no')
+
+        self.assertTrue(uio is adapters.adapter_for('studweb.uio.no'))
+        self.assertFalse(uio is adapters.adapter_for('studweb.ntnu.no'))
+
+    def test_sessions_do_not_share_cookies(self):
+        self.write_config('ola', 'studweb.uio.no')
+        self.write_config('kari', 'studweb.uio.no')
+        accounts = studweb_daemon.load_accounts(self.dir)
+        adapters = studweb_daemon.AdapterPool(pool_maxsize=4)
+        for a in accounts:
+            a.adapter = adapters.adapter_for(a.hostname())
+
+        s1, s2 = [a.new_session() for a in accounts]
+        s1.cookies.set('wosid', 'abc')
+
+        self.assertEqual(len(s2.cookies), 0)
+        self.assertTrue(s1.get_adapter('https://studweb.uio.no/as') is s2.get_adapter('https://studweb.uio.no/as'))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for bounding the time a run takes, and keeping runs from overlapping
+################################################################################
+import unittest, os, time, shutil, tempfile
+import requests
+from requests.adapters import BaseAdapter
+import studweb
+import studweb_daemon
+import standin_server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StatusAdapter(BaseAdapter):
+    """Answers with the given status codes in turn, remembering the timeouts asked for"""
+
+    def __init__(self, statuses):
+        BaseAdapter.__init__(self)
+        self.statuses = list(statuses)
+        self.timeouts = []
+
+    def send(self, request, **kwargs):
+        self.timeouts.append(kwargs.get('timeout'))
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response._content = b''
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_time_is_shared_between_the_requests_left(self):
+        clock = Clock()
+        deadline = studweb.Deadline(20, clock)
+
+        self.assertEqual(deadline.timeout(requests_left=4), 5)
+        clock.now += 2
+        self.assertEqual(deadline.timeout(requests_left=3), 6)
+
+    def test_no_request_gets_more_than_the_maximum(self):
+        self.assertEqual(studweb.Deadline(600).timeout(), studweb.Deadline.max_request_seconds)
+        self.assertEqual(studweb.Deadline().timeout(), studweb.Deadline.max_request_seconds)
+
+    def test_expired_deadline_raises(self):
+        clock = Clock()
+        deadline = studweb.Deadline(1, clock)
+        clock.now += 1
+
+        self.assertRaises(studweb.DeadlineExceeded, deadline.timeout)
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.account = studweb.Account({'studweb': 'studweb.uio.no'})
+        self.account.deadline = studweb.Deadline(10)
+        self.sleep = time.sleep
+        time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        time.sleep = self.sleep
+
+    def get(self, statuses):
+        adapter = StatusAdapter(statuses)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        return studweb.http_get(session, 'https://studweb.uio.no/', self.account), adapter
+
+    def test_unavailable_studweb_is_retried(self):
+        r, adapter = self.get([503, 200])
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.account.metrics.counters['retries'], 1)
+        self.assertTrue(all(0 < t <= 10 for t in adapter.timeouts))
+
+    def test_retries_are_bounded(self):
+        r, adapter = self.get([503] * 10)
+
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(len(adapter.timeouts), studweb.get_retries + 1)
+
+
+class TestHangingStudweb(unittest.TestCase):
+
+    def setUp(self):
+        self.server = standin_server.StandinServer('studweb.uio.no', delay=2).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_run_gives_up_at_the_deadline(self):
+        account = studweb.Account({'studweb': 'studweb.uio.no', 'studweb_url': self.server.url(),
+                                   'ssn': '01010112345', 'pin': standin_server.valid_pin}, navigation_file=None)
+        account.deadline = studweb.Deadline(0.5)
+        started = time.time()
+
+        self.assertRaises(Exception, studweb.latest_results, studweb.get_parser('studweb.uio.no'), account)
+        self.assertTrue(time.time() - started < 1.5)
+
+
+class TestRunLock(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_second_run_does_not_get_the_lock(self):
+        first = studweb.RunLock(self.filename)
+        self.assertTrue(first.acquire())
+
+        self.assertFalse(studweb.RunLock(self.filename).acquire())
+
+        first.release()
+        self.assertTrue(studweb.RunLock(self.filename).acquire())
+
+    def test_daemon_skips_account_being_checked(self):
+        account = studweb.Account({'studweb': 'studweb.uio.no'}, lock_file=self.filename)
+        lock = studweb.RunLock(self.filename)
+        lock.acquire()
+        try:
+            self.assertFalse(studweb_daemon.poll(account, mail=False))
+        finally:
+            lock.release()
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for skipping the parsing and diffing of results pages that are unchanged
+################################################################################
+import unittest, os, shutil, tempfile
+import studweb
+
+results_page = 'testdata/UIO_2014/Innsyn Vurderingsresultater.html'
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+class TestResultsDigest(unittest.TestCase):
+
+    def test_ignores_webobjects_urls(self):
+        page = read(results_page)
+        other_session = page.replace(b'/wo/3.0.23.20.7.22.', b'/wo/17.0.23.20.7.22.')
+
+        self.assertNotEqual(page, other_session)
+        self.assertEqual(studweb.results_digest(page), studweb.results_digest(other_session))
+
+    def test_changes_with_the_results(self):
+        page = read(results_page)
+        new_grade = page.replace(b'>B<', b'>A<', 1)
+
+        self.assertNotEqual(page, new_grade)
+        self.assertNotEqual(studweb.results_digest(page), studweb.results_digest(new_grade))
+
+    def test_ignores_the_rest_of_the_page(self):
+        page = read(results_page)
+        other_menu = page.replace(b'Logg ut', b'Logg av')
+
+        self.assertEqual(studweb.results_digest(page), studweb.results_digest(other_menu))
+
+    def test_region_is_the_table_inside_the_first_table(self):
+        html = u'<table><tr><td><table><tr><td>1</td></tr></table></td></tr></table><table></table>'
+
+        self.assertEqual(studweb.results_table_region(html), b'<table><tr><td>1</td></tr></table>')
+
+    def test_same_digest_whatever_the_chunks_read(self):
+        page = studweb.FileDocument(results_page)
+
+        for chunk_size in [1, 7, 100, 4096]:
+            page.chunk_size = chunk_size
+            self.assertEqual(studweb.results_digest(page), studweb.results_digest(read(results_page)))
+
+    def test_no_digest_without_results_table(self):
+        self.assertEqual(studweb.results_digest(u'<table><tr><td>Ingen resultater</td></tr></table>'), None)
+
+
+class TestUnchangedResults(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.account = studweb.Account({'studweb': 'studweb.uio.no'},
+                                       results_file=os.path.join(self.dir, 'results.json'),
+                                       data_file=os.path.join(self.dir, 'results.dat'),
+                                       digest_file=os.path.join(self.dir, 'results.digest'),
+                                       archive_dir=os.path.join(self.dir, 'results.archive'))
+        self.parser = studweb.get_parser('studweb.uio.no')
+        self.page = read(results_page)
+
+        self.original = studweb.latest_page
+        studweb.latest_page = lambda parser, account: studweb.Document(self.page)
+
+    def tearDown(self):
+        studweb.latest_page = self.original
+        shutil.rmtree(self.dir)
+
+    def poll(self):
+        self.account.metrics = studweb.RunMetrics()
+        new = studweb.new_results(self.parser, self.account)
+        if new:
+            studweb.store(self.account.latest_results, self.account)
+            studweb.store_digest(self.account.latest_digest, self.account)
+        return new
+
+    def test_unchanged_page_is_not_parsed(self):
+        self.assertEqual(len(self.poll()), 7)
+
+        new = self.poll()
+
+        self.assertEqual(len(new), 0)
+        self.assertEqual(self.account.metrics.counters, {'unchanged_digest': 1})
+        self.assertFalse('parse_results' in self.account.metrics.timings)
+        self.assertFalse('old_results' in self.account.metrics.timings)
+
+    def test_changed_page_is_diffed(self):
+        self.poll()
+        self.page = self.page.replace(b'>B<', b'>A<', 1)
+
+        new = self.poll()
+
+        self.assertEqual(len(new.changed), 1)
+        self.assertEqual(self.account.metrics.counters['rows_parsed'], 7)
+
+    def test_removed_result_is_stored_without_telling(self):
+        self.poll()
+        start = self.page.rfind(b'<tr', 0, self.page.find(b'INF2820'))
+        self.page = self.page[:start] + self.page[self.page.find(b'</tr>', start) + len(b'</tr>'):]
+
+        self.assertEqual(len(self.poll()), 0)
+
+        self.assertEqual(len(studweb.load_results(self.account.results_file)), 6)
+        self.poll()
+        self.assertEqual(self.account.metrics.counters, {'unchanged_digest': 1})
+
+    def test_renamed_subject_is_stored(self):
+        self.poll()
+        self.page = self.page.replace(b'Datalingvistikk', b'Spr\xe5kteknologi')
+
+        self.assertEqual(len(self.poll()), 0)
+
+        names = [r.name for r in studweb.load_results(self.account.results_file)]
+        self.assertTrue(u'Spr\xe5kteknologi' in names)
+
+    def test_digest_is_not_trusted_without_results_file(self):
+        self.poll()
+        os.remove(self.account.results_file)
+
+        self.assertEqual(len(self.poll()), 7)
+
+    def test_digest_is_not_stored_before_the_new_results(self):
+        studweb.new_results(self.parser, self.account)
+
+        self.assertFalse(os.path.exists(self.account.digest_file))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
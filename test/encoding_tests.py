@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for deciding the charset of the pages once per host
+################################################################################
+import unittest, os, shutil, tempfile
+import requests
+import studweb
+
+results_page = 'testdata/UIO_2014/Innsyn Vurderingsresultater.html'
+
+
+def response(content, content_type=None):
+    r = requests.Response()
+    r.status_code = 200
+    r._content = content
+    if content_type:
+        r.headers['Content-Type'] = content_type
+    return r
+
+
+class TestCharset(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = studweb.HostProfile('studweb.uio.no', studweb.studweb_settings['studweb.uio.no'])
+
+    def test_content_type_header_decides(self):
+        r = response(u'<p>Vår</p>'.encode('utf-8'), 'text/html; charset=UTF-8')
+
+        self.assertEqual(self.profile.charset_for(r), 'utf-8')
+
+    def test_meta_tag_decides_without_header(self):
+        r = response(b'<meta http-equiv="Content-Type" content="text/html; charset=ISO-8859-1"><p>V\xe5r</p>')
+
+        self.assertEqual(self.profile.charset_for(r), 'iso8859-1')
+
+    def test_decision_is_kept_for_the_next_pages(self):
+        self.profile.charset_for(response(b'<meta charset="windows-1252"><p>V\xe5r</p>'))
+
+        self.assertEqual(self.profile.charset_for(response(b'<p>H\xf8st</p>')), 'cp1252')
+
+    def test_host_file_can_give_the_charset(self):
+        options = dict(studweb.studweb_settings['studweb.uio.no'], encoding='latin-1')
+
+        self.assertEqual(studweb.HostProfile('studweb.example.no', options).encoding, 'iso8859-1')
+
+    def test_host_file_charset_overrides_header(self):
+        options = dict(studweb.studweb_settings['studweb.uio.no'], encoding='iso-8859-1')
+        profile = studweb.HostProfile('studweb.example.no', options)
+
+        r = response(b'<p>V\xe5r</p>', 'text/html; charset=UTF-8')
+
+        self.assertEqual(profile.charset_for(r), 'iso8859-1')
+
+    def test_document_decodes_with_given_encoding(self):
+        page = studweb.Document(u'<p>Høst</p>'.encode('cp1252'), encoding='cp1252')
+
+        self.assertEqual(page.text(), u'<p>Høst</p>')
+        self.assertEqual(page.soup().p.text, u'Høst')
+
+
+class TestNonAsciiResults(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.account = studweb.Account({'studweb': 'studweb.uio.no'},
+                                       results_file=os.path.join(self.dir, 'results.json'),
+                                       failures_dir=os.path.join(self.dir, 'failures'),
+                                       archive_dir=None)
+        with open(results_page, 'rb') as f:
+            self.content = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_stored_results_keep_non_ascii_names(self):
+        page = studweb.page_of(response(self.content, 'text/html; charset=ISO-8859-1'), self.account)
+        results = studweb.get_parser('studweb.uio.no').parse_result_page_for_results(page)
+
+        studweb.store(results, self.account)
+
+        self.assertEqual(studweb.load_results(self.account.results_file), results)
+        self.assertTrue(any(u'Vår' in r.semester for r in results))
+
+    def test_failed_page_is_kept_with_the_charset_used_for_parsing(self):
+        import studweb_failures
+        page = studweb.Document(self.content, encoding='iso8859-1')
+
+        studweb.record_failure(studweb.PageLayoutError('No table', page), self.account)
+        studweb.flush_failure_snapshots()
+
+        snapshots = studweb_failures.FailureSnapshots(self.account.failures_dir)
+        snapshot_id = snapshots.ids()[0]
+        self.assertEqual(snapshots.page(snapshot_id), self.content)
+        self.assertEqual(snapshots.page(snapshot_id).decode(snapshots.metadata(snapshot_id)['encoding']), page.text())
+
+
+if __name__ == "__main__":
+
+    unittest.main()
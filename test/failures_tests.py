@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the snapshots of the pages that could not be parsed
+################################################################################
+import unittest, os, json, time, shutil, tempfile
+import studweb
+import studweb_failures
+import standin_server
+
+results_page = 'testdata/UIO_2014/Innsyn Vurderingsresultater.html'
+
+
+class StuckWriter(studweb_failures.SnapshotWriter):
+    """Never gets around to writing anything"""
+
+    def run(self):
+        pass
+
+
+class TestFailureSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshots = studweb_failures.FailureSnapshots(os.path.join(self.dir, 'failures'), max_snapshots=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_keeps_page_compressed_with_metadata(self):
+        with open(results_page, 'rb') as f:
+            markup = f.read()
+
+        snapshot_id = self.snapshots.add(markup, {'time': 1402900000.0, 'step': 'parse_results'})
+
+        self.assertEqual(self.snapshots.page(snapshot_id), markup)
+        self.assertEqual(self.snapshots.metadata(snapshot_id)['step'], 'parse_results')
+        self.assertEqual(self.snapshots.metadata(snapshot_id)['size'], len(markup))
+        self.assertTrue(os.path.getsize(os.path.join(self.snapshots.directory, snapshot_id + '.html.gz')) < len(markup))
+
+    def test_only_the_latest_snapshots_are_kept(self):
+        ids = [self.snapshots.add(b'<html>%d</html>' % i, {'time': 1402900000.0 + i}) for i in range(5)]
+
+        self.assertEqual(self.snapshots.ids(), ids[2:])
+        self.assertEqual(len(os.listdir(self.snapshots.directory)), 6)
+
+    def test_size_is_bounded_but_newest_is_kept(self):
+        self.snapshots.max_bytes = 300
+        for i in range(3):
+            self.snapshots.add(os.urandom(200), {'time': 1402900000.0 + i})
+
+        self.assertEqual(len(self.snapshots.ids()), 1)
+        self.assertEqual(self.snapshots.metadata(self.snapshots.ids()[0])['time'], 1402900002.0)
+
+    def test_directory_is_private(self):
+        self.snapshots.add(b'<html></html>', {'time': time.time()})
+
+        self.assertEqual(os.stat(self.snapshots.directory).st_mode & 0o077, 0)
+
+
+class TestRecordFailure(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.account = studweb.Account({'studweb': 'studweb.uio.no'}, name='ola',
+                                       failures_dir=os.path.join(self.dir, 'failures'))
+        self.snapshots = studweb_failures.FailureSnapshots(self.account.failures_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_failing_parse_is_recorded_with_step_host_and_error(self):
+        page = studweb.Document(b'<html><body><table><tr><td>Feil</td></tr></table></body></html>',
+                                url='https://studweb.uio.no/as/WebObjects/studentweb2.woa/wo/4.0.23')
+
+        self.assertRaises(Exception, studweb.parse_latest_results,
+                          studweb.get_parser('studweb.uio.no'), page, self.account)
+        studweb.flush_failure_snapshots()
+
+        metadata = self.snapshots.snapshots()[0]
+        self.assertEqual(metadata['step'], 'parse_results')
+        self.assertEqual(metadata['account'], 'ola')
+        self.assertEqual(metadata['host'], 'studweb.uio.no')
+        self.assertEqual(metadata['url'], page.url)
+        self.assertEqual(metadata['profile']['term_used_for_semester'], 'Semester')
+        self.assertTrue(metadata['error'])
+
+    def test_page_layout_error_gets_the_step_of_its_phase(self):
+        metrics = studweb.RunMetrics()
+        try:
+            with metrics.timer('total'):
+                with metrics.timer('navigation'):
+                    studweb.check(None, 'Did not find "Oversikt".', '<html></html>')
+        except studweb.PageLayoutError as e:
+            self.assertEqual(e.step, 'navigation')
+        else:
+            self.fail()
+
+    def test_nothing_recorded_without_failures_directory(self):
+        self.account.failures_dir = None
+
+        studweb.record_failure(studweb.PageLayoutError('No table', '<html></html>'), self.account)
+        studweb.flush_failure_snapshots()
+
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'failures')))
+
+    def test_snapshots_are_dropped_rather_than_waited_for(self):
+        writer = StuckWriter(backlog=1)
+        before = studweb_failures.dropped.value()
+
+        self.assertTrue(writer.put(self.account.failures_dir, b'<html></html>', {}))
+        self.assertFalse(writer.put(self.account.failures_dir, b'<html></html>', {}))
+        self.assertEqual(studweb_failures.dropped.value(), before + 1)
+
+    def test_failed_navigation_is_recorded(self):
+        server = standin_server.StandinServer('studweb.uio.no').start()
+        try:
+            # a start page without the link to expand
+            server.pages.start = server.pages.login
+            self.account.config.update({'studweb_url': server.url(), 'ssn': '01010112345',
+                                        'pin': standin_server.valid_pin})
+            self.account.navigation_file = None
+
+            self.assertRaises(Exception, studweb.latest_results, studweb.get_parser('studweb.uio.no'), self.account)
+        finally:
+            server.stop()
+        studweb.flush_failure_snapshots()
+
+        metadata = self.snapshots.snapshots()[0]
+        self.assertEqual(metadata['step'], 'navigation')
+        self.assertTrue(metadata['url'].startswith(server.url()))
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshots = studweb_failures.FailureSnapshots(os.path.join(self.dir, 'failures'))
+        self.id = self.snapshots.add(b'<html>Feil</html>', {'time': 1402900000.0, 'host': 'studweb.uio.no'})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_extracts_pages_and_metadata(self):
+        output = os.path.join(self.dir, 'out')
+
+        studweb_failures.main(['--failures', self.snapshots.directory, 'extract', '--output', output])
+
+        with open(os.path.join(output, self.id + '.html'), 'rb') as f:
+            self.assertEqual(f.read(), b'<html>Feil</html>')
+        with open(os.path.join(output, self.id + '.json')) as f:
+            self.assertEqual(json.load(f)['host'], 'studweb.uio.no')
+
+    def test_unknown_snapshot(self):
+        self.assertEqual(studweb_failures.main(['--failures', self.snapshots.directory, 'extract', 'nope']), 1)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
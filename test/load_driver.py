@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Load test of the whole polling flow against the stand-in StudWeb
+#
+# Starts a StandinServer and runs a number of simulated accounts through
+# latest_results concurrently: login, expanding the link section, fetching
+# the results page and logging out. The accounts share one connection pool
+# per host, like in daemon mode. Prints the throughput and the latency
+# percentiles of the polls as JSON, along with the peak RSS of the process.
+#
+# RSS only ever grows, so compare the normal and the low memory mode in
+# separate runs:
+#
+#   PYTHONPATH=.. python load_driver.py --accounts 50 --workers 10 --rounds 4
+#   PYTHONPATH=.. python load_driver.py --accounts 50 --workers 10 --rounds 4 --low-memory
+################################################################################
+import os, sys, time, json, codecs, shutil, tempfile, argparse, platform
+from multiprocessing.pool import ThreadPool
+
+import studweb
+import studweb_daemon
+import standin_server
+
+try:
+    import resource
+except ImportError:
+    # not on Windows
+    resource = None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def peak_rss():
+    """The peak resident set size of the process in bytes, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def simulated_accounts(n, host, url, adapters, directory, low_memory=False, pin=standin_server.valid_pin):
+    accounts = []
+    for i in range(n):
+        config = {'studweb': host, 'studweb_url': url, 'ssn': '%011d' % i, 'pin': pin,
+                  'low_memory': 'yes' if low_memory else 'no'}
+        account = studweb.Account(config, name='account%d' % i,
+                                  page_file=os.path.join(directory, 'account%d.latest.html' % i),
+                                  navigation_file=os.path.join(directory, 'navigation.json'))
+        account.adapter = adapters.adapter_for(host)
+        accounts.append(account)
+    return accounts
+
+
+def timed_poll(account):
+    """Runs one account through the flow. Returns (seconds, number of results or None if it failed)"""
+    started = time.time()
+    try:
+        results = studweb.latest_results(studweb.get_parser(account.hostname()), account)
+        return time.time() - started, len(results)
+    except Exception as e:
+        studweb.print_error(u"[%s] %s" % (account, e))
+        return time.time() - started, None
+
+
+def run(host, accounts, workers, rounds, delay=0, low_memory=False):
+    server = standin_server.StandinServer(host, delay=delay).start()
+    directory = tempfile.mkdtemp()
+    rss_before = peak_rss()
+    try:
+        adapters = studweb_daemon.AdapterPool(pool_maxsize=workers)
+        polled = simulated_accounts(accounts, host, server.url(), adapters, directory, low_memory)
+        pool = ThreadPool(workers)
+
+        started = time.time()
+        try:
+            polls = []
+            for i in range(rounds):
+                polls.extend(pool.map(timed_poll, polled))
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = time.time() - started
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+    rss_after = peak_rss()
+    latencies = sorted(seconds for seconds, results in polls)
+    failed = sum(1 for seconds, results in polls if results is None)
+
+    return {
+        'host': host,
+        'accounts': accounts,
+        'workers': workers,
+        'rounds': rounds,
+        'delay': delay,
+        'low_memory': low_memory,
+        'peak_rss_bytes': rss_after,
+        # the growth of the peak over the run, shared by the accounts polled at the same time
+        'peak_rss_per_account_bytes': (rss_after - rss_before) / min(workers, accounts) if rss_after else None,
+        'polls': len(polls),
+        'failed': failed,
+        'logins': server.logins,
+        'seconds': elapsed,
+        'polls_per_second': len(polls) / elapsed if elapsed else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p90': percentile(latencies, 90),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': latencies[-1] if latencies else None,
+    }
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Load test the polling flow against a local stand-in StudWeb")
+    argument_parser.add_argument("--host", nargs='*', choices=sorted(standin_server.institutions),
+                                 default=sorted(standin_server.institutions), help="The StudWeb hosts to emulate")
+    argument_parser.add_argument("--accounts", type=int, default=20, help="Simulated accounts (default: 20)")
+    argument_parser.add_argument("--workers", type=int, default=5, help="Accounts polled at the same time (default: 5)")
+    argument_parser.add_argument("--rounds", type=int, default=3, help="Polls of every account (default: 3)")
+    argument_parser.add_argument("--delay", type=float, default=0, help="Seconds the stand-in waits before every response")
+    argument_parser.add_argument("--low-memory", action="store_true",
+                                 help="Stream the results pages to disk, like low_memory = yes")
+    argument_parser.add_argument("--output", help="Write the JSON to this file instead of stdout")
+    args = argument_parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'time': time.time(),
+        'runs': [run(host, args.accounts, args.workers, args.rounds, args.delay, args.low_memory) for host in args.host],
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with codecs.open(args.output, 'w', encoding='utf8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
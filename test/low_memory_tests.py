@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for streaming the results page to disk in low memory mode
+################################################################################
+import unittest, os, shutil, tempfile
+import studweb
+import standin_server
+
+pages = [('testdata/UIO_2014/', 'studweb.uio.no'), ('testdata/NTNU_2014/', 'studweb.ntnu.no')]
+
+
+class TestFileDocument(unittest.TestCase):
+
+    def test_text_chunks_add_up_to_the_text(self):
+        filename = 'testdata/NTNU_2014/Innsyn Vurderingsresultater.html'
+        page = studweb.FileDocument(filename, encoding='iso8859-1')
+        page.chunk_size = 1000
+
+        chunks = list(page.text_chunks())
+
+        self.assertTrue(len(chunks) > 30)
+        self.assertEqual(u''.join(chunks), studweb.Document(page.read(), encoding='iso8859-1').text())
+
+    def test_charset_is_found_without_reading_the_whole_file(self):
+        page = studweb.FileDocument('testdata/v2013_uio.html')
+
+        u''.join(page.text_chunks())
+
+        self.assertEqual(page.encoding, 'utf-8')
+
+    def test_parses_like_a_document_in_memory(self):
+        for directory, host in pages:
+            parser = studweb.get_parser(host)
+            for name in ['Startside Opplysninger.html', 'Innsyn Vurderingsresultater.html']:
+                in_file = studweb.FileDocument(directory + name)
+                in_memory = studweb.Document(in_file.read())
+
+                for method in ['parse_page_with_expanded_link_section_for_logout_url',
+                               'parse_page_with_expanded_link_section_for_results_url',
+                               'parse_start_page_for_link_url_to_expand_link_section']:
+                    self.assertEqual(getattr(parser, method)(in_file), getattr(parser, method)(in_memory))
+
+            results_page = studweb.FileDocument(directory + 'Innsyn Vurderingsresultater.html')
+            self.assertEqual(parser.parse_result_page_for_results(results_page),
+                             parser.parse_result_page_for_results(studweb.Document(results_page.read())))
+
+    def test_digest_and_links_without_reading_the_whole_file(self):
+        parser = studweb.get_parser('studweb.uio.no')
+        page = studweb.FileDocument('testdata/UIO_2014/Innsyn Vurderingsresultater.html', encoding='iso8859-1')
+        page.read = None
+
+        self.assertTrue(studweb.results_digest(page))
+        self.assertTrue(parser.parse_page_with_expanded_link_section_for_logout_url(page))
+        self.assertTrue(parser.parse_page_with_expanded_link_section_for_results_url(page))
+
+    def test_missing_link_is_a_layout_error(self):
+        parser = studweb.get_parser('studweb.uio.no')
+        page = studweb.FileDocument('testdata/UIO_2014/StudentWeb.html')
+
+        self.assertRaises(studweb.PageLayoutError, parser.parse_page_with_expanded_link_section_for_results_url, page)
+
+
+class TestLowMemoryFlow(unittest.TestCase):
+
+    def setUp(self):
+        self.server = standin_server.StandinServer('studweb.uio.no').start()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def test_results_page_is_streamed_to_the_page_file(self):
+        account = studweb.Account({'studweb': 'studweb.uio.no', 'studweb_url': self.server.url(),
+                                   'ssn': '01010112345', 'pin': standin_server.valid_pin, 'low_memory': 'yes'},
+                                  page_file=os.path.join(self.dir, 'test.latest.html'), navigation_file=None)
+
+        results = studweb.latest_results(studweb.get_parser('studweb.uio.no'), account)
+
+        self.assertEqual(len(results), 7)
+        self.assertEqual(os.listdir(self.dir), ['test.latest.html'])
+        with open(account.page_file, 'rb') as f:
+            self.assertEqual(f.read(), self.server.pages.results)
+        # logged out using the link found in the file
+        self.assertEqual(len(self.server.sessions), 0)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
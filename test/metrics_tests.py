@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the metrics collected while polling StudWeb
+################################################################################
+import unittest, os, json, shutil, tempfile
+import studweb
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_timer_adds_up_time_spent_in_phase(self):
+        metrics = studweb.RunMetrics()
+
+        with metrics.timer('parse_results'):
+            pass
+        with metrics.timer('parse_results'):
+            pass
+
+        self.assertEqual(list(metrics.timings.keys()), ['parse_results'])
+        self.assertTrue(metrics.timings['parse_results'] >= 0)
+
+    def test_timer_records_phase_that_raises(self):
+        metrics = studweb.RunMetrics()
+
+        try:
+            with metrics.timer('login'):
+                raise studweb.LoginError('Feil pin')
+        except studweb.LoginError:
+            pass
+
+        self.assertTrue('login' in metrics.timings)
+
+    def test_writes_one_json_line_per_run(self):
+        filename = os.path.join(self.dir, 'metrics.jsonl')
+        account = studweb.Account({'studweb': 'studweb.uio.no'}, name='ola')
+
+        for i in range(2):
+            account.metrics = studweb.RunMetrics()
+            account.metrics.count('rows_parsed', 7)
+            account.metrics.write(filename, account)
+
+        with open(filename) as f:
+            records = [json.loads(l) for l in f]
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1]['account'], 'ola')
+        self.assertEqual(records[1]['host'], 'studweb.uio.no')
+        self.assertEqual(records[1]['counters'], {'rows_parsed': 7})
+
+    def test_new_results_counts_diffed_results(self):
+        account = studweb.Account({'studweb': 'studweb.uio.no'},
+                                  results_file=os.path.join(self.dir, 'results.json'),
+                                  data_file=os.path.join(self.dir, 'results.dat'),
+                                  digest_file=os.path.join(self.dir, 'results.digest'))
+        with open('testdata/UIO_2014/Innsyn Vurderingsresultater.html', 'rb') as f:
+            page = studweb.Document(f.read())
+        original = studweb.latest_page
+        studweb.latest_page = lambda parser, account: page
+        try:
+            new = studweb.new_results(studweb.get_parser('studweb.uio.no'), account)
+        finally:
+            studweb.latest_page = original
+
+        self.assertEqual(set(new), set(account.latest_results))
+        self.assertEqual(account.metrics.counters['results_diffed'], 7)
+        self.assertEqual(account.metrics.counters['new_results'], 7)
+        self.assertTrue('diff' in account.metrics.timings)
+        self.assertTrue('old_results' in account.metrics.timings)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counters_are_kept_per_label_values(self):
+        registry = studweb.MetricsRegistry()
+        logins = registry.counter('logins_total', 'Logins', ['host'])
+
+        logins.inc(host='studweb.uio.no')
+        logins.inc(2, host='studweb.uio.no')
+        logins.inc(host='studweb.ntnu.no')
+
+        self.assertEqual(registry.exposition(),
+                         '# HELP logins_total Logins\n'
+                         '# TYPE logins_total counter\n'
+                         'logins_total{host="studweb.ntnu.no"} 1\n'
+                         'logins_total{host="studweb.uio.no"} 3\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = studweb.MetricsRegistry()
+        seconds = registry.histogram('seconds', 'Seconds', ['phase'], buckets=(1, 5))
+
+        for value in [0.5, 2, 10]:
+            seconds.observe(value, phase='login')
+
+        lines = registry.exposition().splitlines()
+        self.assertEqual(lines[2:], ['seconds_bucket{phase="login",le="1.0"} 1',
+                                     'seconds_bucket{phase="login",le="5.0"} 2',
+                                     'seconds_bucket{phase="login",le="+Inf"} 3',
+                                     'seconds_sum{phase="login"} 12.5',
+                                     'seconds_count{phase="login"} 3'])
+
+    def test_label_values_are_escaped(self):
+        registry = studweb.MetricsRegistry()
+        registry.counter('errors_total', 'Errors', ['error']).inc(error='"a\\b"\n')
+
+        self.assertTrue('errors_total{error="\\"a\\\\b\\"\\n"} 1' in registry.exposition())
+
+    def test_registering_a_name_again_gives_the_same_metric(self):
+        registry = studweb.MetricsRegistry()
+
+        self.assertTrue(registry.counter('a_total', 'A') is registry.counter('a_total', 'A'))
+
+    def test_run_timers_feed_phase_histogram_of_host(self):
+        before = studweb.phase_seconds.count(host='studweb.uio.no', phase='login')
+
+        with studweb.RunMetrics('studweb.uio.no').timer('login'):
+            pass
+        with studweb.RunMetrics().timer('login'):
+            pass
+
+        self.assertEqual(studweb.phase_seconds.count(host='studweb.uio.no', phase='login'), before + 1)
+
+    def test_failed_checks_are_counted(self):
+        before = studweb.layout_errors.value()
+
+        self.assertRaises(studweb.PageLayoutError, studweb.check, None, 'No table', '<html></html>')
+        studweb.check('found', 'No table', '<html></html>')
+
+        self.assertEqual(studweb.layout_errors.value(), before + 1)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the shortcut from the start page to the results page
+################################################################################
+import unittest, os, json, shutil, tempfile
+from multiprocessing import Pool
+import studweb
+
+host = 'studweb.uio.no'
+expand = '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.9.1.1'
+results = '/as/WebObjects/studentweb2.woa/wo/4.0.23.24.6.12.1.1'
+
+
+def learn_repeatedly(job):
+    """Run in a process of its own: learns a path of its own host over and over. Returns the errors printed"""
+    filename, hostname = job
+    errors = []
+    studweb.print_error = errors.append
+    cache = studweb.NavigationCache(filename)
+    for i in range(200):
+        cache.learned(hostname, expand, results if i % 2 else '/as/WebObjects/studentweb2.woa/wo/4.0.23.24.6.13.1.1')
+        cache.missed(hostname)
+    return errors
+
+
+class TestNavigationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'navigation.json')
+        self.cache = studweb.NavigationCache(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_no_shortcut_before_the_path_is_learned(self):
+        self.assertEqual(self.cache.shortcut(host, expand), None)
+
+    def test_shortcut_continues_from_the_context_of_the_start_page(self):
+        self.cache.learned(host, expand, results)
+
+        self.assertEqual(self.cache.shortcut(host, '/as/WebObjects/studentweb2.woa/wo/11.0.23.24.6.9.1.1'),
+                         '/as/WebObjects/studentweb2.woa/wo/12.0.23.24.6.12.1.1')
+
+    def test_keeps_session_part_and_query_of_the_link(self):
+        self.cache.learned(host, '/cgi-bin/WebObjects/studentweb2.woa/12/wo/ctnn9q83/6.0.23.24.6.13.1.1',
+                           '/cgi-bin/WebObjects/studentweb2.woa/12/wo/ctnn9q83/6.0.23.24.6.16.1.1')
+
+        self.assertEqual(self.cache.shortcut(host, '/cgi-bin/WebObjects/studentweb2.woa/12/wo/xyz/2.0.23.24.6.13.1.1?a=b'),
+                         '/cgi-bin/WebObjects/studentweb2.woa/12/wo/xyz/2.0.23.24.6.16.1.1?a=b')
+
+    def test_no_shortcut_once_the_start_page_has_changed(self):
+        self.cache.learned(host, expand, results)
+
+        self.assertEqual(self.cache.shortcut(host, '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.10.1.1'), None)
+        self.assertEqual(self.cache.shortcut('studweb.ntnu.no', expand), None)
+
+    def test_only_webobjects_links_are_learned(self):
+        self.cache.learned(host, '/start?expand=1', '/results')
+
+        self.assertEqual(self.cache.shortcut(host, '/start?expand=1'), None)
+
+    def test_stops_taking_shortcut_after_missing_repeatedly(self):
+        self.cache.learned(host, expand, results)
+
+        for i in range(studweb.NavigationCache.max_misses):
+            self.assertTrue(self.cache.shortcut(host, expand))
+            self.cache.missed(host)
+
+        self.assertEqual(self.cache.shortcut(host, expand), None)
+        # following the same path again does not make it worth trying
+        self.cache.learned(host, expand, results)
+        self.assertEqual(self.cache.shortcut(host, expand), None)
+        # a new path is
+        self.cache.learned(host, expand, '/as/WebObjects/studentweb2.woa/wo/4.0.23.24.6.13.1.1')
+        self.assertTrue(self.cache.shortcut(host, expand))
+
+    def test_hit_forgives_misses(self):
+        self.cache.learned(host, expand, results)
+        for i in range(studweb.NavigationCache.max_misses - 1):
+            self.cache.missed(host)
+
+        self.cache.hit(host)
+        self.cache.missed(host)
+
+        self.assertTrue(self.cache.shortcut(host, expand))
+
+    def test_processes_keep_the_paths_of_each_other(self):
+        hosts = ['studweb%d.example.no' % i for i in range(3)]
+        pool = Pool(3)
+        try:
+            errors = pool.map(learn_repeatedly, [(self.filename, h) for h in hosts])
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(errors, [[], [], []])
+        with open(self.filename) as f:
+            self.assertEqual(sorted(json.load(f).keys()), hosts)
+
+    def test_failing_write_does_not_fail_the_poll(self):
+        cache = studweb.NavigationCache(os.path.join(self.dir, 'missing', 'navigation.json'))
+        errors = []
+        original = studweb.print_error
+        studweb.print_error = errors.append
+        try:
+            cache.learned(host, expand, results)
+            cache.missed(host)
+        finally:
+            studweb.print_error = original
+
+        self.assertTrue(errors)
+        self.assertEqual(cache.shortcut(host, expand), None)
+
+    def test_paths_are_kept_between_runs(self):
+        self.cache.learned(host, expand, results)
+
+        with open(self.filename) as f:
+            self.assertEqual(json.load(f)[host]['results'], '0.23.24.6.12.1.1')
+        self.assertTrue(studweb.NavigationCache(self.filename).shortcut(host, expand))
+
+
+class TestHasResultsTable(unittest.TestCase):
+
+    def page(self, name):
+        with open('testdata/UIO_2014/' + name, 'rb') as f:
+            return studweb.Document(f.read())
+
+    def test_results_page(self):
+        self.assertTrue(studweb.has_results_table(self.page('Innsyn Vurderingsresultater.html'),
+                                                  studweb.get_parser(host).profile))
+
+    def test_other_pages(self):
+        profile = studweb.get_parser(host).profile
+
+        self.assertFalse(studweb.has_results_table(self.page('Startside Opplysninger.html'), profile))
+        self.assertFalse(studweb.has_results_table(self.page('StudentWeb.html'), profile))
+        self.assertFalse(studweb.has_results_table(u'<html><body>Feil</body></html>', profile))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the mail outbox of studweb
+################################################################################
+import unittest, os, stat, time, shutil, tempfile
+import studweb_outbox
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP_SSL, recording what is sent"""
+
+    connections = []
+    fail_login = False
+    fail_to = None
+
+    def __init__(self, host, timeout=None):
+        self.host = host
+        self.sent = []
+        self.quit_called = False
+        FakeSMTP.connections.append(self)
+
+    def login(self, username, password):
+        if FakeSMTP.fail_login:
+            raise IOError('Connection refused')
+
+    def sendmail(self, from_addr, to_addr, msg):
+        if to_addr == FakeSMTP.fail_to:
+            raise IOError('Recipient refused')
+        self.sent.append((from_addr, to_addr, msg))
+
+    def quit(self):
+        self.quit_called = True
+
+
+def mail_config(to_addr='ola@nordmann.no', smtp_username='ola.nordmann'):
+    return {
+        'smtp_server': 'smtp.uio.no',
+        'smtp_username': smtp_username,
+        'smtp_password': 'p4ssw0rd',
+        'from_addr': 'ola.nordmann@ifi.uio.no',
+        'to_addr': to_addr,
+    }
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.outbox = studweb_outbox.Outbox(os.path.join(self.dir, 'outbox'))
+        FakeSMTP.connections = []
+        FakeSMTP.fail_login = False
+        FakeSMTP.fail_to = None
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sender(self, **kwargs):
+        return studweb_outbox.Sender(self.outbox, smtp_class=FakeSMTP, **kwargs)
+
+    def test_queued_mail_is_only_readable_by_user(self):
+        self.outbox.put('ola', u'Subject', u'Body', mail_config())
+
+        for name in os.listdir(self.outbox.directory):
+            mode = os.stat(os.path.join(self.outbox.directory, name)).st_mode
+            self.assertEqual(mode & (stat.S_IRWXG | stat.S_IRWXO), 0)
+
+    def test_sends_many_mails_over_one_connection(self):
+        self.outbox.put('ola', u'Subject', u'Body', mail_config())
+        self.outbox.put('kari', u'Subject', u'Body', mail_config(to_addr='kari@nordmann.no'))
+
+        sent = self.sender().drain()
+
+        self.assertEqual(sent, 2)
+        self.assertEqual(len(FakeSMTP.connections), 1)
+        self.assertEqual(len(FakeSMTP.connections[0].sent), 2)
+        self.assertTrue(FakeSMTP.connections[0].quit_called)
+        self.assertTrue(self.outbox.is_empty())
+
+    def test_one_connection_per_smtp_login(self):
+        self.outbox.put('ola', u'Subject', u'Body', mail_config())
+        self.outbox.put('kari', u'Subject', u'Body', mail_config(smtp_username='kari.nordmann'))
+
+        self.sender().drain()
+
+        self.assertEqual(len(FakeSMTP.connections), 2)
+
+    def test_keeps_mail_and_backs_off_when_server_is_down(self):
+        FakeSMTP.fail_login = True
+        self.outbox.put('ola', u'Subject', u'Body', mail_config())
+
+        self.assertEqual(self.sender(backoff=60).drain(), 0)
+
+        messages = self.outbox.messages()
+        self.assertEqual(messages[0]['attempts'], 1)
+        self.assertEqual(self.outbox.due(), [])
+        self.assertEqual(len(self.outbox.due(now=messages[0]['next_attempt'])), 1)
+
+    def test_backoff_doubles_with_every_attempt(self):
+        self.outbox.put('ola', u'Subject', u'Body', mail_config())
+        message = self.outbox.messages()[0]
+
+        self.outbox.retry(message, 'failed', 60, 8)
+        first = message['next_attempt'] - message['created']
+        self.outbox.retry(message, 'failed', 60, 8)
+        second = message['next_attempt'] - message['created']
+
+        self.assertTrue(55 < first < 65, first)
+        self.assertTrue(115 < second < 125, second)
+
+    def test_failing_mail_does_not_stop_the_rest(self):
+        FakeSMTP.fail_to = 'kari@nordmann.no'
+        self.outbox.put('kari', u'Subject', u'Body', mail_config(to_addr='kari@nordmann.no'))
+        self.outbox.put('ola', u'Subject', u'Body', mail_config())
+
+        self.assertEqual(self.sender().drain(), 1)
+        self.assertEqual([m['account'] for m in self.outbox.messages()], ['kari'])
+
+    def test_keeps_retrying_at_the_longest_backoff(self):
+        self.outbox.put('ola', u'Subject', u'Body', mail_config())
+        message = self.outbox.messages()[0]
+
+        for i in range(5):
+            self.outbox.retry(message, 'failed', 60, 3)
+        wait = message['next_attempt'] - time.time()
+
+        self.assertEqual(self.outbox.messages()[0]['attempts'], 5)
+        self.assertTrue(235 < wait < 245, wait)
+
+    def test_digest_merges_mail_to_same_address(self):
+        self.outbox.put('ola', u'Subject', u'\n - INF1820 A', mail_config())
+        self.outbox.put('ola-master', u'Subject', u'\n - INF5261 B', mail_config())
+        self.outbox.put('kari', u'Subject', u'\n - INF2810 C', mail_config(to_addr='kari@nordmann.no'))
+
+        sent = self.sender(digest=True).drain()
+
+        self.assertEqual(sent, 2)
+        mails = FakeSMTP.connections[0].sent
+        self.assertEqual(mails[0][1], 'ola@nordmann.no')
+        self.assertTrue('2 accounts' in mails[0][2])
+        self.assertTrue(self.outbox.is_empty())
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -3,7 +3,8 @@
 # Tests for studweb - testdata held back for privacy reasons ...
 # Carl-Erik Kopseng <carlerik@ifi.uio.no>
 ################################################################################
-import unittest, re, codecs
+import unittest, re, codecs, json
+from bs4 import BeautifulSoup
 from studweb import * 
 import studweb
 
@@ -14,6 +15,49 @@ class TestSubjectResult(unittest.TestCase):
         r2 = SubjectResult('inf101', 'beregningsorientert matematikk', 'A', 'V2014')
         self.assertEqual(r1,r2)
 
+    def test_equal_results_have_equal_hashes(self):
+        r1 = SubjectResult('inf101', 'beregningsorientert matematikk', 'A', 'V2014')
+        r2 = SubjectResult('inf101', 'Beregningsorientert matematikk', 'A', 'V2014')
+        self.assertEqual(r1, r2)
+        self.assertEqual(hash(r1), hash(r2))
+        self.assertEqual(len(set([r1, r2])), 1)
+
+class TestResultSet(unittest.TestCase):
+
+    def test_diff_classifies_added_changed_and_removed_results(self):
+        old = ResultSet([SubjectResult('INF1820', u'desc', 'Godkjent', u'Vår 2013'),
+                         SubjectResult('INF2810', u'Funksjonell programmering', 'Godkjent', u'Vår 2013'),
+                         SubjectResult('MAT100B', u'Grunnkurs i matematisk analyse med beregninger', 'B', u'Høst 2002')])
+        new = ResultSet([SubjectResult('INF1820', u'desc', 'A', u'Vår 2013'),
+                         SubjectResult('INF2810', u'Funksjonell programmering', 'Godkjent', u'Vår 2013'),
+                         SubjectResult('INF2820', u'Datalingvistikk', 'Godkjent', u'Vår 2014')])
+
+        d = new.diff(old)
+
+        self.assertEqual([r.code for r in d.added], ['INF2820'])
+        self.assertEqual([(o.grade, n.grade) for o, n in d.changed], [('Godkjent', 'A')])
+        self.assertEqual([r.code for r in d.removed], ['MAT100B'])
+        self.assertEqual(len(d), 2)
+
+    def test_diff_without_new_results_is_false(self):
+        results = result_set_uio_v13()
+
+        self.assertFalse(ResultSet(results).diff(ResultSet(results)))
+
+    def test_lookup_by_code_and_semester(self):
+        results = ResultSet(result_set_uio_v13())
+
+        self.assertEqual(results.get('INF101', u'Høst 2002').grade, 'B')
+        self.assertEqual(results.get('INF101', u'Vår 2013'), None)
+        self.assertTrue(SubjectResult('INF101', u'', 'B', u'Høst 2002') in results)
+        self.assertFalse(SubjectResult('INF101', u'', 'A', u'Høst 2002') in results)
+
+    def test_formats_changed_results_with_previous_grade(self):
+        old = ResultSet([SubjectResult('INF1820', u'desc', 'Godkjent', u'Vår 2013')])
+        new = ResultSet([SubjectResult('INF1820', u'desc', 'A', u'Vår 2013')])
+
+        self.assertEqual(studweb.format_results(new.diff(old)), u"\n - INF1820 desc A Vår 2013 (was Godkjent)")
+
 class TestResultPageParser(unittest.TestCase):
 
     def test_parses_returns_expected_result_set_for_uio2013(self):
@@ -57,6 +101,84 @@ class TestResultPageParser(unittest.TestCase):
 
         self.assertTrue(expected in link)
 
+class TestResultTableExtractor(unittest.TestCase):
+
+    fixtures = [('testdata/v2013_uio.html', 'studweb.uio.no'),
+                ('testdata/UIO_2014/Innsyn Vurderingsresultater.html', 'studweb.uio.no'),
+                ('testdata/NTNU_2014/Innsyn Vurderingsresultater.html', 'studweb.ntnu.no')]
+
+    def test_streaming_and_soup_parsers_agree(self):
+        for filename, host in self.fixtures:
+            with open(filename, 'rb') as f:
+                page = studweb.Document(f.read())
+
+            parser = studweb.get_parser(host)
+            streamed = parser.parse_result_page_streaming(page.text())
+            parsed = parser.parse_result_page_with_soup(page)
+
+            self.assertTrue(len(streamed) > 0)
+            self.assertEqual(sorted(r.asUnicode() for r in streamed),
+                             sorted(r.asUnicode() for r in parsed), filename)
+
+    def test_can_be_fed_in_chunks(self):
+        with open('testdata/v2013_uio.html', 'rb') as f:
+            html = f.read().decode('utf-8')
+
+        extractor = studweb.ResultTableExtractor()
+        for i in range(0, len(html), 100):
+            extractor.feed(html[i:i + 100])
+
+        parser = studweb.get_parser('studweb.uio.no')
+        self.assertTrue(extractor.done)
+        self.assertEqual(parser.results_from_table(extractor.headers, extractor.rows), result_set_uio_v13())
+
+    def test_falls_back_to_soup_for_unexpected_tables(self):
+        html = u"""
+        <table><tr><td><table>
+            <tr><th>Semester</th><th>Emnekode</th><th>Emnenavn</th><th>Resultat</th><th></th></tr>
+            <tr><td>Vår 2013</td><td>INF2810</td><td>Funksjonell programmering</td><td>A</td><td><table><tr><td>Statistikk</td></tr></table></td></tr>
+            <tr><td></td></tr>
+            <tr><td></td></tr>
+        </table></td></tr></table>
+        """
+        parser = studweb.get_parser('studweb.uio.no')
+
+        self.assertRaises(studweb.FastPathError, parser.parse_result_page_streaming, html)
+        self.assertEqual(parser.parse_result_page_for_results(html),
+                         set([SubjectResult('INF2810', u'Funksjonell programmering', 'A', u'Vår 2013')]))
+
+class TestDocument(unittest.TestCase):
+
+    def test_page_is_only_parsed_once(self):
+        with codecs.open('testdata/UIO_2014/StudentWeb.html', 'r', encoding='utf-8', errors='ignore') as f:
+            page = studweb.Document(f.read())
+
+        parser = studweb.get_parser('studweb.uio.no')
+        parser.parse_login_page_for_form_values(page)
+        soup = page.soup()
+        parser.parse_login_page_for_path_to_form_handler(page)
+
+        self.assertTrue(soup is page.soup())
+
+    def test_tree_builders_give_same_results(self):
+        with codecs.open('testdata/NTNU_2014/Innsyn Vurderingsresultater.html', 'r', encoding='utf-8', errors='ignore') as f:
+            html = f.read()
+
+        parser = studweb.get_parser('studweb.ntnu.no')
+        with_lxml = parser.parse_result_page_for_results(studweb.Document(html, 'lxml'))
+        with_stdlib = parser.parse_result_page_for_results(studweb.Document(html, 'html.parser'))
+
+        self.assertEqual(with_lxml, with_stdlib)
+
+    def test_parses_login_form_of_document(self):
+        with open('testdata/UIO_2014/StudentWeb.html', 'rb') as f:
+            page = studweb.Document(f.read())
+
+        parser = studweb.get_parser('studweb.uio.no')
+
+        self.assertEqual(parser.parse_login_page_for_path_to_form_handler(page), '/as/WebObjects/studentweb2.woa/wa/login')
+        self.assertTrue('pinkode' in parser.parse_login_page_for_form_values(page))
+
 class TestStudWeb(unittest.TestCase):
 
     def test_url_to_result_page_NTNU(self):
@@ -91,12 +213,26 @@ class TestStudWeb(unittest.TestCase):
 
 
     def test_stores_results_in_dotfile(self):
-        html = '<html>something</html>'
-        studweb.store(html)
-        with open(studweb.data_file) as f:
-            content = f.read()
+        results = result_set_uio_v13()
+        studweb.store(results, make_account())
+
+        self.assertEqual(studweb.load_results(test_results_file), results)
+
+    def test_stored_results_are_keyed_on_code_and_semester(self):
+        studweb.store(result_set_uio_v13(), make_account())
+        with codecs.open(test_results_file, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
 
-        self.assertEqual(content, html)
+        self.assertEqual(stored['results'][u'INF2810|Vår 2013']['grade'], 'Godkjent')
+
+    def test_imports_results_page_stored_by_earlier_versions(self):
+        import shutil
+        shutil.copy('testdata/v2013_uio.html', test_data_file)
+        account = make_account()
+        parser = studweb.get_parser('studweb.uio.no')
+
+        self.assertEqual(studweb.old_results(parser, account), result_set_uio_v13())
+        self.assertEqual(studweb.load_results(test_results_file), result_set_uio_v13())
 
     def test_regex_parsing(self):
         text_and_img_in_a_tag = """
@@ -117,11 +253,19 @@ class TestStudWeb(unittest.TestCase):
 
     def tearDown(self):
         import os
-        try:
-            os.remove(studweb.data_file)
-        except OSError:
-            pass
+        for f in [test_results_file, test_data_file]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+
+test_results_file = 'test_output.json'
+test_data_file = 'test_output.dat'
 
+def make_account():
+    return studweb.Account({'studweb': 'studweb.uio.no'}, results_file=test_results_file, data_file=test_data_file,
+                           archive_dir=None)
 
 def result_set_uio_v13():
     results = set()
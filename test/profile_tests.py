@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the host profiles describing each StudWeb
+################################################################################
+import unittest, os, shutil, tempfile
+import studweb
+
+uio_headers = [u'Semester', u'Emnekode', u'Emnenavn', u'Ordning', u'Resultat']
+
+
+class TestHostProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(content)
+
+    def test_builtin_hosts_are_always_there(self):
+        profiles = studweb.load_host_profiles(self.dir)
+
+        self.assertEqual(sorted(profiles.keys()), sorted(studweb.studweb_settings.keys()))
+        self.assertEqual(profiles['studweb.ntnu.no'].term, 'Termin')
+
+    def test_loads_host_files(self):
+        self.write('example.conf', studweb.example_host_config)
+
+        profile = studweb.load_host_profiles(self.dir)['studweb.example.no']
+
+        self.assertEqual(profile.expand_link_text, 'Se opplysninger om deg')
+        self.assertEqual(profile.options['requests_per_minute'], 60)
+        self.assertEqual(profile.logout_link_text, 'Logg ut')
+
+    def test_ignores_incomplete_host_files(self):
+        self.write('example.conf', 'studweb = studweb.example.no\n')
+
+        self.assertFalse('studweb.example.no' in studweb.load_host_profiles(self.dir))
+
+    def test_parser_uses_selectors_of_profile(self):
+        profile = studweb.HostProfile('studweb.example.no', {
+            'term_used_for_semester': 'Semester', 'expand_link_text': 'Oversikt', 'login_form_name': 'loginForm'})
+        html = u'<form name="loginForm" action="/login"><input name="pin" value=""/></form>'
+
+        parser = studweb.PageParser(profile)
+
+        self.assertEqual(parser.parse_login_page_for_path_to_form_handler(html), '/login')
+        self.assertEqual(parser.parse_login_page_for_form_values(html), {'pin': ''})
+
+
+class TestColumnLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = studweb.HostProfile('studweb.uio.no', studweb.studweb_settings['studweb.uio.no'])
+
+    def test_resolves_columns_from_headers(self):
+        layout = self.profile.column_layout(uio_headers)
+
+        self.assertEqual((layout.semester, layout.code, layout.name, layout.grade, layout.last), (0, 1, 2, 4, 4))
+
+    def test_layout_is_cached_on_header_row(self):
+        first = self.profile.column_layout(uio_headers)
+        second = self.profile.column_layout([h + u' ' for h in uio_headers])
+
+        self.assertTrue(first is second)
+        self.assertEqual(len(self.profile.layouts), 1)
+        self.assertEqual(self.profile.layout_changes, 0)
+
+    def test_changed_layout_is_reported(self):
+        self.profile.column_layout(uio_headers)
+        layout = self.profile.column_layout([u'Emnekode', u'Emnenavn', u'Semester', u'Resultat'])
+
+        self.assertEqual((layout.code, layout.semester), (0, 2))
+        self.assertEqual(self.profile.layout_changes, 1)
+
+    def test_other_headers_with_the_same_columns_are_no_change(self):
+        first = self.profile.column_layout(uio_headers)
+        second = self.profile.column_layout(uio_headers + [u'Kommentar'])
+        self.profile.column_layout(uio_headers)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.profile.layout_changes, 0)
+
+    def test_changed_layout_can_be_kept_quiet(self):
+        printed = []
+        original = studweb.print_error
+        studweb.print_error = printed.append
+        studweb.report_layout_changes = False
+        try:
+            self.profile.column_layout(uio_headers)
+            self.profile.column_layout([u'Emnekode', u'Emnenavn', u'Semester', u'Resultat'])
+        finally:
+            studweb.print_error = original
+            studweb.report_layout_changes = True
+
+        self.assertEqual(printed, [])
+        self.assertEqual(self.profile.layout_changes, 1)
+
+    def test_missing_column_gives_no_layout(self):
+        self.assertEqual(self.profile.column_layout([u'Semester', u'Emnekode', u'Emnenavn']), None)
+        self.assertEqual(self.profile.layouts, {})
+
+
+if __name__ == "__main__":
+
+    unittest.main()
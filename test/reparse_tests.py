@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for re-parsing saved pages in bulk
+################################################################################
+import unittest, os, shutil, tempfile
+import studweb
+import studweb_reparse
+
+uio_results = 'testdata/UIO_2014/Innsyn Vurderingsresultater.html'
+ntnu_results = 'testdata/NTNU_2014/Innsyn Vurderingsresultater.html'
+
+
+class TestReparse(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def lines(self, files, hosts=None):
+        return dict((line['file'], line) for line in studweb_reparse.reparse(files, hosts, workers=2))
+
+    def test_expands_directories_and_globs_once(self):
+        files = studweb_reparse.expand(['testdata/UIO_2014', 'testdata/*/Innsyn*.html'])
+
+        self.assertEqual(len(files), 4)
+        self.assertEqual(files.count(uio_results), 1)
+
+    def test_finds_the_host_of_each_page(self):
+        lines = self.lines([uio_results, ntnu_results, 'testdata/v2013_uio.html'])
+
+        self.assertEqual((lines[uio_results]['host'], len(lines[uio_results]['results'])), ('studweb.uio.no', 7))
+        self.assertEqual((lines[ntnu_results]['host'], len(lines[ntnu_results]['results'])), ('studweb.ntnu.no', 55))
+        self.assertEqual(len(lines['testdata/v2013_uio.html']['results']), 4)
+
+    def test_reports_failures_per_file(self):
+        login_page = 'testdata/UIO_2014/StudentWeb.html'
+
+        lines = self.lines([login_page, uio_results], hosts=['studweb.uio.no'])
+
+        self.assertTrue('studweb.uio.no' in lines[login_page]['error'])
+        self.assertFalse('error' in lines[uio_results])
+        self.assertTrue(lines[login_page]['seconds'] >= 0)
+
+    def test_error_dumps_are_read_as_utf8(self):
+        filename = os.path.join(self.dir, 'error.html')
+        with open(uio_results, 'rb') as f:
+            text = studweb.Document(f.read()).text()
+        with open(filename, 'wb') as f:
+            f.write(text.encode('utf8'))
+
+        results = self.lines([filename])[filename]['results']
+
+        self.assertTrue(any(r['semester'] == u'Vår 2014' for r in results))
+
+    def test_reads_failure_snapshots(self):
+        account = studweb.Account({'studweb': 'studweb.uio.no'}, failures_dir=os.path.join(self.dir, 'failures'))
+        with open(uio_results, 'rb') as f:
+            studweb.record_failure(Exception('Failed'), account, studweb.Document(f.read()))
+        studweb.flush_failure_snapshots()
+
+        files = studweb_reparse.expand([account.failures_dir])
+        results = self.lines(files)[files[0]]['results']
+
+        self.assertEqual(len(files), 1)
+        self.assertTrue(any(r['semester'] == u'Vår 2014' for r in results))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
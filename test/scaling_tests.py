@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests that parsing results pages scales linearly with the number of results
+################################################################################
+import unittest, time
+import studweb
+import transcript_generator
+
+# parsing 8 times the rows may take this many times longer before it counts as
+# worse than linear. A quadratic parser would take about 64 times longer
+rows = (200, 1600)
+max_slowdown = 8 * 2.5
+
+# generating the pages takes longer than parsing them, so each is only made once
+pages = {}
+
+
+def generated_page(fixture, n):
+    if (fixture, n) not in pages:
+        pages[(fixture, n)] = transcript_generator.generate_results_page(fixture, n)[0]
+    return pages[(fixture, n)]
+
+
+def parse_seconds(parser, method, html, repeat=2):
+    """The fastest of `repeat` parses of the page, building the Document every time"""
+    timings = []
+    for i in range(repeat):
+        started = time.time()
+        getattr(parser, method)(studweb.Document(html))
+        timings.append(time.time() - started)
+    return min(timings)
+
+
+class TestGeneratedPages(unittest.TestCase):
+
+    def test_parsers_find_the_generated_results(self):
+        for fixture, host in sorted(transcript_generator.fixtures.items()):
+            html, expected = transcript_generator.generate_results_page(fixture, 300, extra_columns=2)
+            parser = studweb.get_parser(host)
+
+            self.assertEqual(len(expected), 300)
+            self.assertEqual(parser.parse_result_page_streaming(html), expected)
+            self.assertEqual(parser.parse_result_page_with_soup(html), expected)
+
+    def test_same_seed_gives_same_page(self):
+        first = transcript_generator.generate_results_page('UIO_2014', 50, seed=1)[0]
+
+        self.assertEqual(transcript_generator.generate_results_page('UIO_2014', 50, seed=1)[0], first)
+        self.assertNotEqual(transcript_generator.generate_results_page('UIO_2014', 50, seed=2)[0], first)
+
+
+class TestParserScaling(unittest.TestCase):
+
+    def assertLinear(self, fixture, method):
+        host = transcript_generator.fixtures[fixture]
+        parser = studweb.get_parser(host)
+        small, large = [generated_page(fixture, n) for n in rows]
+
+        slowdown = parse_seconds(parser, method, large) / parse_seconds(parser, method, small)
+
+        self.assertTrue(slowdown < max_slowdown,
+                        "%s took %.1f times longer on %d rows than on %d" % (method, slowdown, rows[1], rows[0]))
+
+    def test_streaming_parser_is_linear(self):
+        for fixture in sorted(transcript_generator.fixtures):
+            self.assertLinear(fixture, 'parse_result_page_streaming')
+
+    def test_soup_parser_is_linear(self):
+        for fixture in sorted(transcript_generator.fixtures):
+            self.assertLinear(fixture, 'parse_result_page_with_soup')
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for the scheduling and rate limiting of polls in daemon mode
+################################################################################
+import unittest, time
+import studweb, studweb_daemon, studweb_scheduler
+
+
+class FakeClock:
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def account(name):
+    return studweb.Account({'studweb': 'studweb.uio.no'}, name=name)
+
+
+def local_time(month, day):
+    return time.mktime((2014, month, day, 12, 0, 0, 0, 0, -1))
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_allows_burst_then_limits_to_rate(self):
+        clock = FakeClock()
+        bucket = studweb_scheduler.TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+
+        for i in range(3):
+            bucket.acquire()
+        self.assertEqual(clock.slept, [])
+
+        bucket.acquire()
+        self.assertEqual(clock.slept, [0.5])
+
+    def test_refills_up_to_capacity(self):
+        clock = FakeClock()
+        bucket = studweb_scheduler.TokenBucket(rate=1, capacity=2, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        bucket.acquire()
+
+        clock.now += 100
+
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertTrue(bucket.try_acquire() > 0)
+
+    def test_one_bucket_per_studweb_host(self):
+        settings = {'studweb.uio.no': {'requests_per_minute': 60},
+                    'studweb.ntnu.no': {'requests_per_minute': 30},
+                    'studweb.example.no': {}}
+
+        buckets = studweb_scheduler.host_buckets(settings)
+
+        self.assertEqual(sorted(buckets.keys()), ['studweb.ntnu.no', 'studweb.uio.no'])
+        self.assertEqual(buckets['studweb.uio.no'].rate, 1.0)
+        self.assertEqual(buckets['studweb.ntnu.no'].rate, 0.5)
+
+    def test_does_not_wait_past_the_timeout(self):
+        clock = FakeClock()
+        bucket = studweb_scheduler.TokenBucket(rate=0.1, capacity=1, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+
+        self.assertRaises(studweb.DeadlineExceeded, bucket.acquire, 5)
+        self.assertEqual(clock.slept, [])
+        self.assertEqual(bucket.acquire(10), 10)
+
+    def test_adapter_takes_token_before_sending(self):
+        class Bucket:
+            def acquire(self, timeout=None):
+                raise RuntimeError('no tokens')
+
+        adapters = studweb_daemon.AdapterPool(pool_maxsize=2, buckets={'studweb.uio.no': Bucket()})
+        a = account('ola')
+        a.adapter = adapters.adapter_for('studweb.uio.no')
+
+        self.assertRaises(RuntimeError, a.new_session().get, 'https://studweb.uio.no/as/')
+
+    def test_adapter_gives_up_when_the_token_comes_too_late(self):
+        clock = FakeClock()
+        bucket = studweb_scheduler.TokenBucket(rate=0.1, capacity=1, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        adapters = studweb_daemon.AdapterPool(pool_maxsize=2, buckets={'studweb.uio.no': bucket})
+        a = account('ola')
+        a.adapter = adapters.adapter_for('studweb.uio.no')
+        a.deadline = studweb.Deadline(5, clock=clock)
+
+        self.assertRaises(studweb.DeadlineExceeded, studweb.http_get, a.new_session(), 'https://studweb.uio.no/as/', a)
+        self.assertEqual(clock.slept, [])
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_spreads_first_polls_over_interval(self):
+        clock = FakeClock()
+        randoms = iter([0.0, 0.5, 0.99])
+        scheduler = studweb_scheduler.Scheduler([account('a'), account('b'), account('c')], 1800,
+                                                clock=clock, rand=lambda: next(randoms))
+
+        self.assertEqual([a.name for a in scheduler.due()], ['a'])
+        self.assertEqual(scheduler.seconds_until_next(), 0)
+
+        clock.now += 900
+        self.assertEqual([a.name for a in scheduler.due()], ['a', 'b'])
+
+    def test_backs_off_exponentially_after_failures(self):
+        clock = FakeClock()
+        a = account('a')
+        scheduler = studweb_scheduler.Scheduler([a], 1800, jitter=0, max_backoff=10000,
+                                                clock=clock, rand=lambda: 0.5)
+
+        self.assertEqual(scheduler.polled(a, False), 3600)
+        self.assertEqual(scheduler.polled(a, False), 7200)
+        self.assertEqual(scheduler.polled(a, False), 10000)
+        self.assertEqual(scheduler.polled(a, True), 1800)
+
+    def test_jitter_moves_polls_within_bounds(self):
+        a = account('a')
+        scheduler = studweb_scheduler.Scheduler([a], 1000, jitter=0.1, clock=FakeClock(), rand=lambda: 1.0)
+
+        self.assertEqual(scheduler.polled(a, True), 1100)
+
+    def test_polls_more_often_in_exam_windows(self):
+        windows = studweb_scheduler.parse_exam_windows('05-20:07-10, 12-01:01-31')
+        clock = FakeClock(local_time(6, 15))
+        a = account('a')
+        scheduler = studweb_scheduler.Scheduler([a], 1800, exam_interval=300, exam_windows=windows,
+                                                jitter=0, clock=clock, rand=lambda: 0.5)
+
+        self.assertEqual(scheduler.polled(a, True), 300)
+
+        clock.now = local_time(9, 1)
+        self.assertEqual(scheduler.polled(a, True), 1800)
+
+    def test_exam_windows_can_wrap_around_new_year(self):
+        windows = studweb_scheduler.parse_exam_windows('12-01:01-31')
+
+        self.assertEqual(windows, [((12, 1), (1, 31))])
+        self.assertTrue(studweb_scheduler.in_exam_window(windows, local_time(12, 24)))
+        self.assertTrue(studweb_scheduler.in_exam_window(windows, local_time(1, 10)))
+        self.assertFalse(studweb_scheduler.in_exam_window(windows, local_time(3, 1)))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
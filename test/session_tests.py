@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for reusing a logged in StudWeb session between runs
+################################################################################
+import unittest, os, stat, shutil, tempfile
+import requests
+from requests.adapters import BaseAdapter
+import studweb
+
+
+class FixtureAdapter(BaseAdapter):
+    """Answers every request with the same page, remembering the urls asked for"""
+
+    def __init__(self, filename):
+        BaseAdapter.__init__(self)
+        with open(filename, 'rb') as f:
+            self.content = f.read()
+        self.urls = []
+
+    def send(self, request, **kwargs):
+        self.urls.append(request.url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.content
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class TestSessionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.account = studweb.Account({'studweb': 'studweb.uio.no', 'keep_session': 'yes'},
+                                       session_file=os.path.join(self.dir, 'test.session'), navigation_file=None)
+        self.parser = studweb.get_parser('studweb.uio.no')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def logged_in_session(self):
+        session = requests.Session()
+        session.cookies.set('woinst', '-1', domain='studweb.uio.no', path='/')
+        return session
+
+    def test_saved_session_is_only_readable_by_user(self):
+        studweb.save_session(self.logged_in_session(), '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1', self.account)
+
+        mode = os.stat(self.account.session_file).st_mode
+        self.assertEqual(mode & (stat.S_IRWXG | stat.S_IRWXO), 0)
+
+    def test_loads_cookies_and_results_url(self):
+        studweb.save_session(self.logged_in_session(), '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1', self.account)
+
+        session, url = studweb.load_session(self.account)
+
+        self.assertEqual(session.cookies.get('woinst'), '-1')
+        self.assertEqual(url, '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1')
+
+    def test_fetches_results_directly_with_saved_session(self):
+        adapter = FixtureAdapter('testdata/UIO_2014/Innsyn Vurderingsresultater.html')
+        self.account.adapter = adapter
+        studweb.save_session(self.logged_in_session(), '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1', self.account)
+
+        results = studweb.latest_results(self.parser, self.account)
+
+        self.assertEqual(len(results), 7)
+        self.assertEqual(self.account.metrics.counters['requests'], 1)
+        self.assertEqual(self.account.metrics.counters['bytes_downloaded'], len(adapter.content))
+        self.assertEqual(self.account.metrics.counters['rows_parsed'], 7)
+        self.assertEqual(adapter.urls, ['https://studweb.uio.no/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1'])
+        self.assertEqual(studweb.load_session(self.account)[1],
+                         'https://studweb.uio.no/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.11.1.1')
+
+    def test_expired_session_is_discarded(self):
+        self.account.adapter = FixtureAdapter('testdata/UIO_2014/StudentWeb.html')
+        studweb.save_session(self.logged_in_session(), '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1', self.account)
+
+        self.assertEqual(studweb.page_from_saved_session(self.parser, self.account), None)
+        self.assertFalse(os.path.exists(self.account.session_file))
+
+    def test_unreadable_session_is_discarded(self):
+        with open(self.account.session_file, 'w') as f:
+            f.write('{"cookies": [{"name": "woinst"')
+        os.chmod(self.account.session_file, stat.S_IRUSR | stat.S_IWUSR)
+
+        self.assertEqual(studweb.page_from_saved_session(self.parser, self.account), None)
+        self.assertFalse(os.path.exists(self.account.session_file))
+
+    def test_ignores_session_readable_by_others(self):
+        studweb.save_session(self.logged_in_session(), '/as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1', self.account)
+        os.chmod(self.account.session_file, stat.S_IRUSR | stat.S_IRGRP)
+
+        self.assertEqual(studweb.load_session(self.account), (None, None))
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests for splitting the accounts between several daemons
+################################################################################
+import unittest, os, json, time, shutil, tempfile
+from multiprocessing import Pool
+import studweb
+import studweb_daemon
+import studweb_scheduler
+import studweb_shard
+
+accounts = ['account%d' % i for i in range(60)]
+
+
+class Clock:
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def claim_owned(job):
+    """Run in a process of its own: joins the shard and claims the accounts it owns"""
+    directory, worker_id, workers = job
+    shard = studweb_shard.Shard(directory, worker_id)
+    shard.heartbeat()
+    started = time.time()
+    while len(shard.live_workers()) < workers and time.time() - started < 20:
+        time.sleep(0.05)
+    return worker_id, [a for a in accounts if shard.owns(a) and shard.claim(a)]
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_spreads_keys_over_workers(self):
+        ring = studweb_shard.HashRing(['a', 'b', 'c'])
+
+        shares = [sum(1 for i in range(3000) if ring.owner('account%d' % i) == w) for w in 'abc']
+
+        for share in shares:
+            self.assertTrue(600 < share < 1400, shares)
+
+    def test_only_keys_of_a_failed_worker_move(self):
+        before = studweb_shard.HashRing(['a', 'b', 'c'])
+        after = studweb_shard.HashRing(['a', 'c'])
+
+        for key in accounts:
+            if before.owner(key) != 'b':
+                self.assertEqual(after.owner(key), before.owner(key))
+            else:
+                self.assertTrue(after.owner(key) in ('a', 'c'))
+
+    def test_no_owner_without_workers(self):
+        self.assertEqual(studweb_shard.HashRing([]).owner('ola'), None)
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def shard(self, worker_id, ttl=300):
+        shard = studweb_shard.Shard(self.dir, worker_id, ttl=ttl, clock=self.clock)
+        shard.heartbeat()
+        return shard
+
+    def test_live_workers_split_the_accounts(self):
+        a, b = self.shard('a'), self.shard('b')
+
+        owned_by_a = set(n for n in accounts if a.owns(n))
+        owned_by_b = set(n for n in accounts if b.owns(n))
+
+        self.assertEqual(owned_by_a & owned_by_b, set())
+        self.assertEqual(owned_by_a | owned_by_b, set(accounts))
+        self.assertTrue(owned_by_a and owned_by_b)
+
+    def test_lease_held_by_another_worker_is_not_taken(self):
+        a, b = self.shard('a'), self.shard('b')
+
+        self.assertTrue(a.claim('ola'))
+        self.assertTrue(a.claim('ola'))
+        self.assertFalse(b.claim('ola'))
+
+    def test_released_lease_can_be_taken(self):
+        a, b = self.shard('a'), self.shard('b')
+        a.claim('ola')
+
+        a.release('ola', polled=self.clock.now)
+
+        self.assertTrue(b.claim('ola'))
+        self.assertEqual(b.last_polled('ola'), ('b', self.clock.now))
+
+    def test_accounts_of_a_failed_worker_move_once_it_expires(self):
+        a, b = self.shard('a', ttl=60), self.shard('b', ttl=60)
+        of_b = [n for n in accounts if b.owns(n)]
+        for n in of_b:
+            b.claim(n)
+
+        # b stops renewing its file and its leases
+        self.clock.now += 61
+        a.heartbeat()
+
+        self.assertEqual(a.live_workers(), ['a'])
+        self.assertTrue(all(a.owns(n) for n in of_b))
+        self.assertTrue(all(a.claim(n) for n in of_b))
+
+    def test_expired_lease_taken_back_by_its_worker(self):
+        a = self.shard('a', ttl=60)
+        a.claim('ola')
+        self.clock.now += 61
+
+        self.assertTrue(a.claim('ola'))
+        self.assertEqual(os.listdir(a.leases_directory), ['ola.json'])
+
+    def test_leaving_hands_over_at_once(self):
+        a, b = self.shard('a'), self.shard('b')
+        of_a = [n for n in accounts if a.owns(n)]
+        for n in of_a:
+            a.claim(n)
+
+        a.leave()
+
+        self.assertEqual(b.live_workers(), ['b'])
+        self.assertTrue(all(b.owns(n) and b.claim(n) for n in of_a))
+
+    def test_processes_claim_each_account_once(self):
+        pool = Pool(3)
+        try:
+            claimed = dict(pool.map(claim_owned, [(self.dir, 'w%d' % i, 3) for i in range(3)]))
+        finally:
+            pool.close()
+            pool.join()
+
+        all_claimed = sum(claimed.values(), [])
+        self.assertEqual(sorted(all_claimed), sorted(accounts))
+        self.assertTrue(all(claimed.values()))
+
+
+class TestClaimDue(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.accounts = [studweb.Account({'studweb': 'studweb.uio.no'}, name=n) for n in accounts[:20]]
+        self.scheduler = studweb_scheduler.Scheduler(self.accounts, interval=1800, rand=lambda: 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_polls_only_accounts_of_this_worker(self):
+        a = studweb_shard.Shard(self.dir, 'a')
+        b = studweb_shard.Shard(self.dir, 'b')
+        a.heartbeat()
+        b.heartbeat()
+
+        claimed = studweb_daemon.claim_due(a, self.scheduler, self.accounts)
+
+        self.assertEqual([x.name for x in claimed], [x.name for x in self.accounts if a.owns(x.name)])
+        # the others are looked at again later, without counting as polled
+        self.assertEqual(set(self.scheduler.due()), set(claimed))
+        self.assertEqual(len(self.scheduler.due(time.time() + a.ttl)), len(self.accounts))
+
+    def test_lease_is_renewed_right_before_the_poll(self):
+        clock = Clock()
+        a = studweb_shard.Shard(self.dir, 'a', ttl=300, clock=clock)
+        account = studweb.Account({'studweb': 'studweb.invalid'}, name='account0',
+                                  lock_file=os.path.join(self.dir, 'account0.lock'))
+        a.claim(account.name)
+        # the polls before it in the round took most of the lease
+        clock.now += 290
+
+        studweb_daemon.poll(account, mail=False, shard=a)
+
+        with open(os.path.join(a.leases_directory, 'account0.json')) as f:
+            self.assertEqual(json.load(f)['expires'], clock.now + 300)
+
+    def test_skips_account_taken_over_during_the_round(self):
+        clock = Clock()
+        a = studweb_shard.Shard(self.dir, 'a', ttl=300, clock=clock)
+        b = studweb_shard.Shard(self.dir, 'b', ttl=300, clock=clock)
+        a.claim('account0')
+        clock.now += 301
+        b.claim('account0')
+
+        self.assertEqual(studweb_daemon.poll(self.accounts[0], mail=False, shard=a), None)
+
+    def test_does_not_repoll_account_taken_over_before_interval(self):
+        b = studweb_shard.Shard(self.dir, 'b')
+        b.claim('account0')
+        b.release('account0', polled=time.time() - 600)
+        a = studweb_shard.Shard(self.dir, 'a')
+        a.heartbeat()
+
+        claimed = studweb_daemon.claim_due(a, self.scheduler, self.accounts[:1])
+
+        self.assertEqual(claimed, [])
+        next_poll = self.scheduler.next_poll['account0'] - time.time()
+        self.assertTrue(1100 < next_poll <= 1200, next_poll)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# A local stand-in for StudWeb, serving the pages in testdata
+#
+# Emulates the WebObjects flow studweb.py goes through: the login page, the
+# POST of the fnrForm setting a session cookie, the start page, the page with
+# the expanded link section, the results page and the logout link. Pages are
+# found from the element id at the end of the /wo/ urls, so any context id is
+# accepted, like the element ids of the links in the saved pages. Pages asked
+# for without a valid session cookie get the login page, like an expired session.
+#
+# Point an account at it with `studweb_url = http://127.0.0.1:8080`, keeping
+# `studweb = studweb.uio.no` (or studweb.ntnu.no) for the right parser.
+#
+#   PYTHONPATH=.. python standin_server.py --host studweb.uio.no --port 8080
+################################################################################
+import os, sys, re, time, uuid, argparse, threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+import studweb
+
+testdata = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+
+# the saved pages of each institution
+institutions = {
+    'studweb.uio.no': 'UIO_2014',
+    'studweb.ntnu.no': 'NTNU_2014',
+}
+
+# the saved pages contain absolute links to the real hosts
+real_hosts = [b'https://studweb.uio.no', b'https://studentweb.ntnu.no']
+
+cookie_name = 'wosid'
+valid_pin = '1234'
+login_failed_message = u'Ugyldig fødselsnummer eller PIN-kode'
+
+
+def element_id(path):
+    """The part of a WebObjects url identifying the link, without the context id
+
+    /as/WebObjects/studentweb2.woa/wo/3.0.23.24.6.12.1.1 -> 0.23.24.6.12.1.1
+    """
+    last = path.rstrip('/').split('/')[-1]
+    return last.split('.', 1)[-1]
+
+
+class StandinPages:
+    """The pages of one institution, and which element id leads to which page"""
+
+    def __init__(self, host):
+        directory = os.path.join(testdata, institutions[host])
+        parser = studweb.get_parser(host)
+
+        def read(name):
+            with open(os.path.join(directory, name), 'rb') as f:
+                page = f.read()
+            for real_host in real_hosts:
+                page = page.replace(real_host, b'')
+            return page
+
+        self.login = read('StudentWeb.html')
+        self.start = read('Startside Opplysninger.html')
+        self.results = read('Innsyn Vurderingsresultater.html')
+        self.login_action = parser.parse_login_page_for_path_to_form_handler(self.login)
+
+        alert = (u'<div id="alert-box"><ul><li>%s</li></ul></div>' % login_failed_message).encode('iso-8859-1')
+        self.login_failed = re.sub(b'(<body[^>]*>)', lambda m: m.group(1) + alert, self.login, count=1)
+
+        self.routes = {
+            element_id(parser.parse_start_page_for_link_url_to_expand_link_section(self.start)): self.start,
+            element_id(parser.parse_page_with_expanded_link_section_for_results_url(self.start)): self.results,
+            element_id(parser.parse_page_with_expanded_link_section_for_results_url(self.results)): self.results,
+        }
+        self.logout_ids = set([
+            element_id(parser.parse_page_with_expanded_link_section_for_logout_url(self.start)),
+            element_id(parser.parse_page_with_expanded_link_section_for_logout_url(self.results)),
+        ])
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def session_id(self):
+        for cookie in self.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == cookie_name:
+                return value
+        return None
+
+    def reply(self, page, cookie=None):
+        self.server.delay()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=ISO-8859-1')
+        self.send_header('Content-Length', str(len(page)))
+        if cookie is not None:
+            self.send_header('Set-Cookie', '%s=%s; Path=/' % (cookie_name, cookie))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def do_GET(self):
+        pages = self.server.pages
+        path = self.path.split('?')[0]
+
+        if '/wo/' not in path:
+            return self.reply(pages.login)
+
+        session = self.session_id()
+        if not self.server.is_logged_in(session):
+            return self.reply(pages.login)
+
+        key = element_id(path)
+        if key in pages.logout_ids:
+            self.server.log_out(session)
+            return self.reply(pages.login, cookie='')
+
+        self.reply(pages.routes.get(key, pages.start))
+
+    def do_POST(self):
+        pages = self.server.pages
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('iso-8859-1'))
+
+        if self.path.split('?')[0] != pages.login_action:
+            self.send_error(404)
+            return
+
+        if form.get('pinkode') != [valid_pin] or not form.get('fodselsnr'):
+            return self.reply(pages.login_failed)
+
+        self.reply(pages.start, cookie=self.server.log_in())
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    """Serves the pages of one institution
+
+    delay - seconds to wait before every response, to emulate a slow StudWeb
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host, address=('127.0.0.1', 0), delay=0):
+        HTTPServer.__init__(self, address, StandinHandler)
+        self.pages = StandinPages(host)
+        self.response_delay = delay
+        self.sessions = set()
+        self.logins = 0
+        self.lock = threading.Lock()
+
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def delay(self):
+        if self.response_delay:
+            time.sleep(self.response_delay)
+
+    def log_in(self):
+        session = uuid.uuid4().hex
+        with self.lock:
+            self.sessions.add(session)
+            self.logins += 1
+        return session
+
+    def log_out(self, session):
+        with self.lock:
+            self.sessions.discard(session)
+
+    def is_logged_in(self, session):
+        with self.lock:
+            return session in self.sessions
+
+    def start(self):
+        """Serves from a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Serve a local stand-in for StudWeb")
+    argument_parser.add_argument("--host", choices=sorted(institutions), default='studweb.uio.no',
+                                 help="The StudWeb host to emulate")
+    argument_parser.add_argument("--port", type=int, default=8080)
+    argument_parser.add_argument("--delay", type=float, default=0, help="Seconds to wait before every response")
+    args = argument_parser.parse_args(argv)
+
+    server = StandinServer(args.host, ('127.0.0.1', args.port), args.delay)
+    print("Emulating %s on %s (pin %s)" % (args.host, server.url(), valid_pin))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
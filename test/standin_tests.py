@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests of the whole polling flow against the local stand-in StudWeb
+################################################################################
+import unittest, os, json, shutil, tempfile
+import studweb
+import studweb_daemon
+import standin_server
+
+
+class StandinTestCase(unittest.TestCase):
+
+    host = 'studweb.uio.no'
+
+    def setUp(self):
+        self.server = standin_server.StandinServer(self.host).start()
+        self.dir = tempfile.mkdtemp()
+        self.parser = studweb.get_parser(self.host)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def account(self, pin=standin_server.valid_pin, **config):
+        config.update({'studweb': self.host, 'studweb_url': self.server.url(), 'ssn': '01010112345', 'pin': pin})
+        return studweb.Account(config,
+                               session_file=os.path.join(self.dir, 'test.session'),
+                               failures_dir=os.path.join(self.dir, 'failures'),
+                               navigation_file=os.path.join(self.dir, 'navigation.json'))
+
+
+class TestUioFlow(StandinTestCase):
+
+    def test_logs_in_fetches_results_and_logs_out(self):
+        results = studweb.latest_results(self.parser, self.account())
+
+        self.assertEqual(len(results), 7)
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(len(self.server.sessions), 0)
+
+    def test_wrong_pin_raises_login_error(self):
+        self.assertRaises(studweb.LoginError, studweb.latest_results, self.parser, self.account(pin='0000'))
+
+    def test_logins_are_counted(self):
+        logins = studweb.logins.value(host=self.host)
+        refused = studweb.login_failures.value(host=self.host, reason='refused')
+
+        studweb.latest_results(self.parser, self.account())
+        self.assertRaises(studweb.LoginError, studweb.latest_results, self.parser, self.account(pin='0000'))
+
+        self.assertEqual(studweb.logins.value(host=self.host), logins + 2)
+        self.assertEqual(studweb.login_failures.value(host=self.host, reason='refused'), refused + 1)
+
+    def test_learned_path_skips_the_expanded_page(self):
+        studweb.latest_results(self.parser, self.account())
+        account = self.account()
+
+        results = studweb.latest_results(self.parser, account)
+
+        self.assertEqual(len(results), 7)
+        # login page, login, results and logout
+        self.assertEqual(account.metrics.counters['requests'], 4)
+        self.assertEqual(account.metrics.counters['navigation_shortcuts'], 1)
+        self.assertEqual(len(self.server.sessions), 0)
+
+    def test_learned_path_leading_elsewhere_falls_back_to_navigating(self):
+        account = self.account()
+        studweb.latest_results(self.parser, account)
+        with open(account.navigation_file) as f:
+            paths = json.load(f)
+        paths[self.host]['results'] = '0.23.99'
+        with open(account.navigation_file, 'w') as f:
+            json.dump(paths, f)
+
+        account = self.account()
+        results = studweb.latest_results(self.parser, account)
+
+        self.assertEqual(len(results), 7)
+        self.assertEqual(account.metrics.counters['navigation_misses'], 1)
+        # and the path is learned again
+        with open(account.navigation_file) as f:
+            path = json.load(f)[self.host]
+        self.assertNotEqual(path['results'], '0.23.99')
+        self.assertEqual(path['misses'], 0)
+
+    def test_learned_path_in_low_memory_mode(self):
+        studweb.latest_results(self.parser, self.account())
+        account = self.account(low_memory='yes')
+        account.page_file = os.path.join(self.dir, 'test.latest.html')
+
+        results = studweb.latest_results(self.parser, account)
+
+        self.assertEqual(len(results), 7)
+        self.assertEqual(account.metrics.counters['navigation_shortcuts'], 1)
+
+    def test_kept_session_is_reused(self):
+        account = self.account(keep_session='yes')
+
+        first = studweb.latest_results(self.parser, account)
+        account.metrics = studweb.RunMetrics()
+        second = studweb.latest_results(self.parser, account)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(account.metrics.counters['requests'], 1)
+
+    def test_login_keeps_the_newest_results_link(self):
+        account = self.account(keep_session='yes')
+
+        studweb.latest_results(self.parser, account)
+
+        newest = self.parser.parse_page_with_expanded_link_section_for_results_url(self.server.pages.results)
+        self.assertNotEqual(newest, self.parser.parse_page_with_expanded_link_section_for_results_url(self.server.pages.start))
+        self.assertEqual(studweb.load_session(account)[1], newest)
+
+    def test_expired_session_logs_in_again(self):
+        account = self.account(keep_session='yes')
+
+        studweb.latest_results(self.parser, account)
+        self.server.sessions.clear()
+        layout_errors = studweb.layout_errors.value()
+        results = studweb.latest_results(self.parser, account)
+
+        self.assertEqual(len(results), 7)
+        self.assertEqual(self.server.logins, 2)
+        # an expired session is nothing out of the ordinary
+        self.assertEqual(studweb.layout_errors.value(), layout_errors)
+
+    def test_results_page_without_table_is_a_layout_error(self):
+        broken = b'<html><body><p>Ingen resultater</p><a href="/as/WebObjects/studentweb2.woa/wo/9.0.1">Logg ut</a></body></html>'
+        for key, page in list(self.server.pages.routes.items()):
+            if page == self.server.pages.results:
+                self.server.pages.routes[key] = broken
+        account = self.account()
+        account.results_file = os.path.join(self.dir, 'test.json')
+        account.digest_file = os.path.join(self.dir, 'test.digest')
+        account.lock_file = os.path.join(self.dir, 'test.lock')
+        layout_errors = studweb.layout_errors.value()
+        polls = studweb_daemon.polls.value(host=self.host, outcome='layout_error')
+
+        self.assertFalse(studweb_daemon.poll(account, mail=False))
+
+        self.assertEqual(studweb.layout_errors.value(), layout_errors + 1)
+        self.assertEqual(studweb_daemon.polls.value(host=self.host, outcome='layout_error'), polls + 1)
+
+
+class TestUnchangedPoll(StandinTestCase):
+
+    def setUp(self):
+        StandinTestCase.setUp(self)
+        self.soup = studweb.Document.soup
+        self.souped = souped = []
+
+        def counting_soup(page):
+            souped.append(page)
+            return self.soup(page)
+        studweb.Document.soup = counting_soup
+
+        self.text_chunks = studweb.Document.text_chunks
+        self.streamed = streamed = []
+
+        def counting_text_chunks(page, *args, **kwargs):
+            streamed.append(page)
+            return self.text_chunks(page, *args, **kwargs)
+        studweb.Document.text_chunks = counting_text_chunks
+
+    def tearDown(self):
+        studweb.Document.soup = self.soup
+        studweb.Document.text_chunks = self.text_chunks
+        StandinTestCase.tearDown(self)
+
+    def poll_twice(self, **config):
+        account = self.account(**config)
+        account.results_file = os.path.join(self.dir, 'test.json')
+        account.digest_file = os.path.join(self.dir, 'test.digest')
+        account.archive_dir = None
+
+        studweb.new_results(self.parser, account)
+        studweb.store(account.latest_results, account)
+        studweb.store_digest(account.latest_digest, account)
+        del self.souped[:]
+        del self.streamed[:]
+
+        account.metrics = studweb.RunMetrics()
+        self.assertEqual(len(studweb.new_results(self.parser, account)), 0)
+        return account
+
+    def results_pages_souped(self):
+        return [p for p in self.souped if studweb.has_results_table(p, self.parser.profile)]
+
+    def test_results_page_is_only_hashed(self):
+        account = self.poll_twice()
+
+        self.assertEqual(account.metrics.counters['unchanged_digest'], 1)
+        self.assertEqual(self.results_pages_souped(), [])
+
+    def test_results_page_is_only_hashed_with_kept_session(self):
+        account = self.poll_twice(keep_session='yes')
+
+        self.assertEqual(account.metrics.counters['requests'], 1)
+        self.assertEqual(self.souped, [])
+
+    def test_login_response_is_parsed_once(self):
+        self.poll_twice()
+
+        self.assertTrue(self.souped)
+        self.assertEqual([p for p in self.souped if p in self.streamed], [])
+
+
+class TestNtnuFlow(StandinTestCase):
+
+    host = 'studweb.ntnu.no'
+
+    def test_logs_in_fetches_results_and_logs_out(self):
+        results = studweb.latest_results(self.parser, self.account())
+
+        self.assertEqual(len(results), 55)
+        self.assertEqual(len(self.server.sessions), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
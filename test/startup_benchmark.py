@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Startup benchmark for studweb.py
+#
+# Most runs from cron find nothing new, so the time it takes to start the
+# interpreter and import the script is a large part of every run. This
+# measures the import time of studweb (as reported by `python -X importtime`),
+# the wall clock time of `studweb.py --help` and `studweb.py --config`, and
+# that of a whole run finding the same results as the last one, logging in to
+# the stand-in StudWeb. These are put next to the time of starting the bare
+# interpreter, and the numbers are printed as JSON.
+#
+#   PYTHONPATH=.. python startup_benchmark.py --repeat 10 > startup.json
+################################################################################
+import os, sys, json, stat, time, shutil, tempfile, subprocess, argparse, platform
+
+import standin_server
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'studweb.py')
+script_dir = os.path.dirname(script)
+
+# modules that are slow to import, and should only be imported when needed
+heavy_modules = ['requests', 'bs4', 'lxml', 'urllib3', 'html5lib']
+
+
+def environment(home):
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['PYTHONPATH'] = script_dir + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def import_times(home):
+    """Returns the cumulative import time in microseconds of every module imported by `import studweb`"""
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import studweb'],
+                               env=environment(home), stderr=subprocess.PIPE)
+    stderr = process.communicate()[1].decode('utf-8')
+
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = [p.strip() for p in line[len('import time:'):].split('|')]
+        if parts[0].isdigit():
+            times[parts[2]] = int(parts[1])
+    return times
+
+
+def time_command(command, home, repeat):
+    timings = []
+    for i in range(repeat):
+        started = time.time()
+        subprocess.call(command, env=environment(home),
+                        stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        timings.append(time.time() - started)
+    return {'seconds_min': min(timings), 'seconds_mean': sum(timings) / len(timings), 'repeat': repeat}
+
+
+def time_run(args, home, repeat):
+    return time_command([sys.executable, script] + args, home, repeat)
+
+
+def time_interpreter(home, repeat):
+    """The time it takes to start Python without the script, for comparison"""
+    return time_command([sys.executable, '-c', 'pass'], home, repeat)
+
+
+def time_config(repeat):
+    # --config only writes the example config when there is none, so every run gets a fresh home
+    timings = []
+    for i in range(repeat):
+        home = tempfile.mkdtemp()
+        try:
+            timings.append(time_run(['--config'], home, 1)['seconds_min'])
+        finally:
+            shutil.rmtree(home)
+    return {'seconds_min': min(timings), 'seconds_mean': sum(timings) / len(timings), 'repeat': repeat}
+
+
+def time_unchanged_run(repeat):
+    """A cron run finding nothing new: logging in to the stand-in StudWeb and finding the results table unchanged"""
+    server = standin_server.StandinServer('studweb.uio.no').start()
+    home = tempfile.mkdtemp()
+    try:
+        settings_file = os.path.join(home, '.studweb.conf')
+        with open(settings_file, 'w') as f:
+            f.write('studweb = studweb.uio.no\nstudweb_url = %s\nssn = 01010112345\npin = %s\n'
+                    % (server.url(), standin_server.valid_pin))
+        os.chmod(settings_file, stat.S_IRUSR | stat.S_IWUSR)
+
+        # the first run stores the results, so the ones timed find nothing new
+        time_run(['--quiet'], home, 1)
+        if not os.path.isfile(os.path.join(home, '.studweb.json')):
+            raise Exception("The first run against the stand-in StudWeb stored no results")
+
+        metrics_file = os.path.join(home, 'metrics.jsonl')
+        timings = time_run(['--quiet', '--metrics', metrics_file], home, repeat)
+
+        with open(metrics_file) as f:
+            runs = [json.loads(l) for l in f]
+        timings['unchanged_digest'] = sum(r['counters'].get('unchanged_digest', 0) for r in runs)
+        timings['requests_per_run'] = runs[-1]['counters'].get('requests')
+        return timings
+    finally:
+        server.stop()
+        shutil.rmtree(home)
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Benchmark the startup of studweb.py")
+    argument_parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (default: 5)")
+    args = argument_parser.parse_args(argv)
+
+    home = tempfile.mkdtemp()
+    try:
+        times = import_times(home)
+        report = {
+            'python': platform.python_version(),
+            'time': time.time(),
+            'import_studweb_us': times.get('studweb'),
+            'heavy_modules_imported': sorted(m for m in heavy_modules if m in times),
+            'interpreter': time_interpreter(home, args.repeat),
+            'help': time_run(['--help'], home, args.repeat),
+            'config': time_config(args.repeat),
+            'unchanged': time_unchanged_run(args.repeat),
+        }
+    finally:
+        shutil.rmtree(home)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
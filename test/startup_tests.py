@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tests that studweb starts without importing the slow third party modules
+################################################################################
+import unittest, os, sys, subprocess
+
+script_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def modules_loaded_by(code):
+    """Runs the code in a fresh interpreter and returns the modules it left imported"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = script_dir + os.pathsep + env.get('PYTHONPATH', '')
+    process = subprocess.Popen([sys.executable, '-c', code + '\nimport sys\nprint(" ".join(sys.modules))'],
+                               env=env, stdout=subprocess.PIPE)
+    return process.communicate()[0].decode('utf-8').split()
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_importing_does_not_import_requests_or_bs4(self):
+        modules = modules_loaded_by('import studweb')
+
+        self.assertFalse('requests' in modules)
+        self.assertFalse('bs4' in modules)
+        self.assertFalse('lxml' in modules)
+
+    def test_parsing_results_with_fast_path_does_not_import_bs4(self):
+        modules = modules_loaded_by(
+            'import codecs, studweb\n'
+            'html = codecs.open("testdata/v2013_uio.html", encoding="utf-8").read()\n'
+            'assert len(studweb.get_parser("studweb.uio.no").parse_result_page_for_results(html)) == 4')
+
+        self.assertTrue('studweb' in modules)
+        self.assertFalse('bs4' in modules)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
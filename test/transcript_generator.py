@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Generates results pages with as many results and columns as you like
+#
+# The pages are made from the results pages in testdata, keeping their
+# markup, and filled with made up results: a unique subject code, a name,
+# a grade and a semester for every row. Extra columns are added to the right
+# of the ones StudWeb has. Used by the scaling tests and the benchmarks.
+#
+#   PYTHONPATH=.. python transcript_generator.py --fixture NTNU_2014 --rows 5000 > big.html
+################################################################################
+import sys, copy, random, argparse
+import studweb
+
+fixtures = {
+    'UIO_2014': 'studweb.uio.no',
+    'NTNU_2014': 'studweb.ntnu.no',
+}
+
+results_page = 'Innsyn Vurderingsresultater.html'
+
+subjects = [u'Grunnkurs i programmering', u'Diskret matematikk', u'Språkteknologi', u'Økonomi og ledelse',
+            u'Datamodellering og databasesystemer', u'Kvantefysikk', u'Ex.phil.', u'Læringsteori']
+grades = [u'A', u'B', u'C', u'D', u'E', u'F', u'Bestått', u'Godkjent']
+terms = [u'Vår', u'Høst', u'Sommer']
+
+
+def read_fixture(fixture):
+    with open('testdata/' + fixture + '/' + results_page, 'rb') as f:
+        return studweb.Document(f.read())
+
+
+def generate_results_page(fixture, rows, extra_columns=0, seed=0):
+    """Makes a results page looking like the one in testdata/<fixture>
+
+    rows - the number of results on the page
+    extra_columns - columns to add to the right of the table
+    Returns the page as unicode, and the ResultSet a parser should find in it
+    """
+    rand = random.Random(seed)
+    host = fixtures[fixture]
+    profile = studweb.get_parser(host).profile
+
+    soup = read_fixture(fixture).soup()
+    table = soup.table.table
+    trs = table.find_all('tr')
+    header, data_trs, end = trs[0], trs[1:-2], trs[-2]
+
+    # resolve_layout leaves the profile shared by the process alone
+    layout = profile.resolve_layout([th.text.strip() for th in header.find_all('th')])
+    template = [tr for tr in data_trs if tr.find_all('td')[layout.code].text.strip()][0]
+    for tr in data_trs:
+        tr.extract()
+
+    for i in range(extra_columns):
+        th = soup.new_tag('th')
+        th.string = u'Ekstra %d' % (i + 1)
+        header.append(th)
+
+    expected = studweb.ResultSet()
+    for i in range(rows):
+        result = studweb.SubjectResult(
+            u'GEN%05d' % i,
+            rand.choice(subjects),
+            rand.choice(grades),
+            u'%s %d' % (rand.choice(terms), rand.randint(2000, 2014)))
+        expected.add(result)
+
+        tr = copy.copy(template)
+        tds = tr.find_all('td')
+        tds[layout.code].string = result.code
+        tds[layout.name].string = result.name
+        tds[layout.grade].string = result.grade
+        tds[layout.semester].string = result.semester
+        for c in range(extra_columns):
+            td = soup.new_tag('td')
+            td.string = u'%d' % rand.randint(0, 99999)
+            tr.append(td)
+        end.insert_before(tr)
+
+    return soup.decode(), expected
+
+
+def main(argv):
+    argument_parser = argparse.ArgumentParser(description="Generate a StudWeb results page with made up results")
+    argument_parser.add_argument("--fixture", choices=sorted(fixtures), default='UIO_2014',
+                                 help="The results page to model the page on")
+    argument_parser.add_argument("--rows", type=int, default=1000, help="Number of results (default: 1000)")
+    argument_parser.add_argument("--columns", type=int, default=0, help="Extra columns to add (default: 0)")
+    argument_parser.add_argument("--seed", type=int, default=0)
+    args = argument_parser.parse_args(argv)
+
+    html, expected = generate_results_page(args.fixture, args.rows, args.columns, args.seed)
+
+    # the page says it is ISO-8859-1, like the pages StudWeb sends
+    out = sys.stdout.buffer if hasattr(sys.stdout, 'buffer') else sys.stdout
+    out.write(html.encode('iso-8859-1', 'xmlcharrefreplace'))
+
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])